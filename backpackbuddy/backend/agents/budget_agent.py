@@ -1,4 +1,273 @@
 """
 This module contains the agent responsible for budget-aware planning and adjustments.
+
+Costs are estimated locally from each activity's ``budget_notes`` and
+converted to USD through a cached rate table, so checking a plan against the
+user's budget never needs an LLM call. Only the days that go over budget are
+sent back to the replanner for cheaper alternatives.
 """
-pass
+import copy
+import json
+import os
+import re
+
+import numpy as np
+
+from backend.agents.repack_agent import areplan_days
+
+BUDGET_RATES_PATH = os.environ.get("BUDGET_RATES_PATH", "")
+BUDGET_DEFAULT_CURRENCY = os.environ.get("BUDGET_DEFAULT_CURRENCY", "USD")
+# Daily spend limits in USD per budget mode; modes not listed are unlimited.
+BUDGET_DAILY_LIMITS = {
+    "strict": float(os.environ.get("BUDGET_STRICT_DAILY_USD", "40")),
+    "chill": float(os.environ.get("BUDGET_CHILL_DAILY_USD", "90")),
+}
+
+# USD per unit of currency. Approximate; override with BUDGET_RATES_PATH
+# (a JSON object of the same shape) to keep rates current.
+DEFAULT_RATES = {
+    "USD": 1.0, "EUR": 1.08, "GBP": 1.27, "JPY": 0.0067, "CNY": 0.14, "INR": 0.012,
+    "THB": 0.028, "VND": 0.00004, "IDR": 0.000063, "MYR": 0.21, "SGD": 0.74, "PHP": 0.018,
+    "KRW": 0.00074, "AUD": 0.66, "NZD": 0.61, "CAD": 0.74, "MXN": 0.058, "BRL": 0.2,
+    "CHF": 1.12, "CZK": 0.043, "HUF": 0.0028, "PLN": 0.25, "TRY": 0.031, "AED": 0.27,
+    "LKR": 0.0033, "NPR": 0.0075, "KHR": 0.00025, "LAK": 0.000047, "MAD": 0.1, "ZAR": 0.054,
+    "NOK": 0.094, "SEK": 0.096, "DKK": 0.145, "ISK": 0.0072,
+}
+
+_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP", "¥": "JPY", "₹": "INR", "฿": "THB", "₫": "VND", "₩": "KRW", "₱": "PHP"}
+_WORDS = {
+    "dollar": "USD", "euro": "EUR", "pound": "GBP", "yen": "JPY", "yuan": "CNY", "rmb": "CNY",
+    "rupee": "INR", "rs": "INR", "baht": "THB", "dong": "VND", "rupiah": "IDR", "ringgit": "MYR",
+    "peso": "MXN", "won": "KRW", "dirham": "AED", "rand": "ZAR", "lira": "TRY", "krone": "NOK",
+    "krona": "SEK",
+}
+_FREE = re.compile(r"\bfree\b", re.IGNORECASE)
+# An amount (optionally a range, "$10-$20" included) with a currency
+# symbol/code before or after it.
+_NUMBER = r"\d[\d,]*(?:\.\d+)*"
+_AMOUNT = re.compile(
+    r"(?P<pre>[$€£¥₹฿₫₩₱]|\b[A-Za-z]{2,3}\b\.?)?\s*"
+    r"(?P<low>" + _NUMBER + r")"
+    r"(?:\s*(?:-|–|to)\s*(?:[$€£¥₹฿₫₩₱]|\b[A-Z]{3}\b)?\s*(?P<high>" + _NUMBER + r"))?"
+    r"\s*(?P<post>[$€£¥₹฿₫₩₱]|[A-Za-z]+)?"
+)
+# Clock times ("9:00", "12:30") are removed before looking for amounts.
+_TIME = re.compile(r"\b\d{1,2}:\d{2}\b")
+# A bare number in this range, without a currency, is read as a year.
+_YEAR = re.compile(r"(1[6-9]|20)\d\d")
+_PARENTHESES = re.compile(r"\([^)]*\)")
+_WORD_BEFORE = re.compile(r"([A-Za-z#]+)\.?\s*$")
+# Words after bare numbers that mark them as something other than a price...
+_NOT_PRICES = {"am", "pm", "h", "hr", "hrs", "hour", "hours", "min", "mins", "minutes", "km", "m", "mi",
+               "day", "days", "night", "nights", "people", "persons", "pax", "adults", "kids", "tickets",
+               "km/h", "st", "nd", "rd", "th"}
+# ...and words before them that make them a count or a number ("for 2",
+# "Line 2", "Top 10").
+_COUNT_WORDS = {"for", "line", "top", "no", "#", "number", "bus", "tram", "route", "platform", "gate",
+                "exit", "zone", "floor", "level", "room", "terminal", "stop", "day", "night", "week"}
+# Currencies without a minor unit, where "1.500" means fifteen hundred.
+_NO_MINOR_UNIT = {"ISK", "JPY", "KRW", "VND", "IDR"}
+_THOUSANDS_DOTS = re.compile(r"\d{1,3}(?:\.\d{3})+")
+
+_rates = None
+_rate_index = None
+
+
+# --- Rate Table ---
+def get_rates() -> dict:
+    """Returns the USD conversion table, loading BUDGET_RATES_PATH once."""
+    global _rates, _rate_index
+    if _rates is None:
+        rates = dict(DEFAULT_RATES)
+        if BUDGET_RATES_PATH:
+            try:
+                with open(BUDGET_RATES_PATH) as f:
+                    rates.update({code.upper(): float(rate) for code, rate in json.load(f).items()})
+            except (OSError, ValueError) as e:
+                print(f"Could not load budget rates from {BUDGET_RATES_PATH}: {e}")
+        _rates = rates
+        _rate_index = {code: i for i, code in enumerate(rates)}
+    return _rates
+
+
+def _currency_code(token: str):
+    if not token:
+        return None
+    if token in _SYMBOLS:
+        return _SYMBOLS[token]
+    token = token.rstrip(".")
+    if token.upper() in get_rates():
+        return token.upper()
+    word = token.lower()
+    return _WORDS.get(word) or _WORDS.get(word.rstrip("s"))
+
+
+# --- Parsing ---
+def parse_cost(note: str, default_currency: str = BUDGET_DEFAULT_CURRENCY):
+    """
+    Extracts the cost from a ``budget_notes`` string.
+
+    Amounts in parentheses are treated as conversions of the preceding price
+    and skipped; items joined with "+" are summed; ranges use the upper bound.
+    Within an item an amount with a currency wins over a bare number, and
+    times, counts ("for 2", "Line 2") and years are never read as prices.
+
+    Args:
+        note (str): e.g. "Entry fee: ~500 THB ($15)" or "Free".
+        default_currency (str): Currency for amounts without one.
+
+    Returns:
+        tuple: (amount, currency code), or None if no cost could be found.
+    """
+    if not isinstance(note, str) or not note.strip():
+        return None
+    outside = _PARENTHESES.sub(" ", note)
+    amount, currency, free = 0.0, None, False
+    for part in outside.split("+"):
+        found = _part_amounts(part)
+        priced = [(value, code) for value, code in found if code is not None]
+        if priced:
+            value, code = priced[0]
+        elif _FREE.search(part):
+            # "Top 10 views, free": the number is not what the item costs.
+            free = True
+            continue
+        elif found:
+            value, code = found[0]
+        else:
+            continue
+        if currency is not None and code is not None and code != currency:
+            # Mixed currencies in one note: convert to the first one.
+            value = value * get_rates()[code] / get_rates()[currency]
+        currency = currency or code
+        amount += value
+    if currency is None and amount == 0.0:
+        if free or _FREE.search(note):
+            return 0.0, default_currency
+        inner = " ".join(_PARENTHESES.findall(note))
+        return parse_cost(inner.strip("() "), default_currency) if inner else None
+    return amount, currency or default_currency
+
+def _to_number(text: str, code: str) -> float:
+    if code in _NO_MINOR_UNIT and _THOUSANDS_DOTS.fullmatch(text.replace(",", "")):
+        text = text.replace(".", "")
+    return float(text.replace(",", ""))
+
+def _part_amounts(part: str) -> list:
+    """
+    Returns the (amount, currency code or None) candidates in one "+"-separated
+    part of a note, in order, leaving out times, counts and years.
+    """
+    part = _TIME.sub(" ", part)
+    found = []
+    for match in _AMOUNT.finditer(part):
+        code = _currency_code(match.group("pre")) or _currency_code(match.group("post"))
+        try:
+            value = _to_number(match.group("high") or match.group("low"), code)
+        except ValueError:
+            continue
+        if code is None:
+            # Bare numbers like "2 hours", "Line 2", "Day 3" or "Jan 2025" are not prices.
+            before = _WORD_BEFORE.search(part, 0, match.start("low"))
+            words = {(match.group("pre") or "").lower().rstrip("."), (match.group("post") or "").lower(),
+                     before.group(1).lower() if before else ""}
+            if words & (_NOT_PRICES | _COUNT_WORDS):
+                continue
+            if not match.group("high") and _YEAR.fullmatch(match.group("low")):
+                continue
+        found.append((value, code))
+    return found
+
+
+# --- Roll-up ---
+def daily_limit(budget_mode: str):
+    """Returns the daily USD limit for a budget mode, or None if unlimited."""
+    return BUDGET_DAILY_LIMITS.get((budget_mode or "").strip().lower())
+
+def analyze_budget(itinerary: dict, budget_mode: str, default_currency: str = BUDGET_DEFAULT_CURRENCY) -> dict:
+    """
+    Estimates per-day and per-trip costs and checks them against the
+    budget mode's daily limit.
+
+    Args:
+        itinerary (dict): The itinerary, with an ``itinerary`` list of days.
+        budget_mode (str): The user's budget mode (e.g. "Strict", "Chill").
+        default_currency (str): Currency for notes that don't name one.
+
+    Returns:
+        dict: ``days`` (day, total_usd, unpriced activity count), ``trip_total_usd``,
+              ``daily_limit_usd`` and ``over_budget_days``.
+    """
+    rates = get_rates()
+    days = [d for d in itinerary.get("itinerary", []) if isinstance(d, dict)]
+    day_index, amounts, currencies = [], [], []
+    unpriced = np.zeros(len(days), dtype=int)
+    for i, day in enumerate(days):
+        for activity in day.get("activities", []):
+            cost = parse_cost(activity.get("budget_notes"), default_currency)
+            if cost is None:
+                unpriced[i] += 1
+                continue
+            day_index.append(i)
+            amounts.append(cost[0])
+            currencies.append(_rate_index.get(cost[1], _rate_index.get(default_currency, 0)))
+
+    # One vectorized conversion and per-day sum for the whole trip.
+    rate_vector = np.array(list(rates.values()), dtype=float)
+    usd = np.asarray(amounts, dtype=float) * rate_vector[np.asarray(currencies, dtype=int)]
+    totals = np.bincount(np.asarray(day_index, dtype=int), weights=usd, minlength=len(days))
+
+    limit = daily_limit(budget_mode)
+    return {
+        "currency": "USD",
+        "daily_limit_usd": limit,
+        "trip_total_usd": round(float(totals.sum()), 2),
+        "days": [
+            {"day": day.get("day"), "total_usd": round(float(totals[i]), 2), "unpriced": int(unpriced[i])}
+            for i, day in enumerate(days)
+        ],
+        "over_budget_days": [] if limit is None else [
+            day.get("day") for i, day in enumerate(days) if totals[i] > limit
+        ],
+    }
+
+def attach_budget_summary(itinerary: dict, budget_mode: str) -> dict:
+    """Adds a ``budget_summary`` to the itinerary and each day, in place."""
+    report = analyze_budget(itinerary, budget_mode)
+    days = [d for d in itinerary.get("itinerary", []) if isinstance(d, dict)]
+    for day, summary in zip(days, report["days"]):
+        day["budget_summary"] = {
+            "total_usd": summary["total_usd"],
+            "over_budget": day.get("day") in report["over_budget_days"],
+        }
+    itinerary["budget_summary"] = {
+        "trip_total_usd": report["trip_total_usd"],
+        "daily_limit_usd": report["daily_limit_usd"],
+        "over_budget_days": report["over_budget_days"],
+    }
+    return report
+
+
+# --- Rebalancing ---
+async def arebalance_budget(itinerary: dict, budget_mode: str) -> dict:
+    """
+    Sends only the over-budget days back to the LLM for cheaper alternatives.
+
+    Returns:
+        dict: ``itinerary`` (updated copy, with budget summaries), ``changes``
+              (per-day diffs from the replanner) and the ``budget`` report.
+    """
+    report = analyze_budget(itinerary, budget_mode)
+    if not report["over_budget_days"]:
+        result = {"itinerary": copy.deepcopy(itinerary), "changes": []}
+    else:
+        limit = report["daily_limit_usd"]
+        totals = {d["day"]: d["total_usd"] for d in report["days"]}
+        print(f"Rebalancing over-budget days: {report['over_budget_days']}")
+        result = await areplan_days(itinerary, [
+            (day, f"Over budget: this day costs about ${totals[day]:.0f} but the {budget_mode} budget allows "
+                  f"${limit:.0f} per day. Swap in cheaper or free alternatives and keep budget_notes priced.")
+            for day in report["over_budget_days"]
+        ])
+    result["budget"] = attach_budget_summary(result["itinerary"], budget_mode)
+    return result
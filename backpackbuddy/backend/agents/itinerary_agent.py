@@ -1,9 +1,19 @@
 """
 This module contains the primary agent responsible for generating the travel itinerary.
 """
+import asyncio
 import json
-from langchain_core.prompts import ChatPromptTemplate
-from backend.utils.api_clients import get_groq_llm, get_serper_tool, get_places_of_interest, get_route
+import os
+from backend.utils.json_stream import ArrayItemStreamParser, MalformedItem
+from backend.utils.output_parser import (
+    DAY_SCHEMA, ITINERARY_SCHEMA, OUTLINE_SCHEMA, OutputParseError, aparse_and_repair, parse_and_repair
+)
+from backend.utils.concurrency import QueueFullError
+from backend.utils.api_clients import get_groq_llm
+from backend.utils.grounding import NO_GROUNDING, destination_grounder
+from backend.utils.metrics import timed
+from backend.utils.prompts import LazyChatPrompt
+from backend.utils.rate_limit import LLM_DAY_OUTPUT_TOKENS, LLM_OUTLINE_OUTPUT_TOKENS, output_budget
 
 # Create a simple prompt for direct LLM usage
 SYSTEM_PROMPT = """
@@ -52,59 +62,337 @@ USER_PROMPT = """
 - Budget: {budget_mode}
 - Preferences: {preferences}
 
+**Local context (web search and OpenTripMap; prefer these places and coordinates where they fit):**
+{grounding}
+
 Generate a complete itinerary as a JSON object:
 """
 
-prompt = ChatPromptTemplate.from_messages([
+prompt = LazyChatPrompt([
     ("system", SYSTEM_PROMPT),
     ("human", USER_PROMPT)
 ])
 
-# Initialize the LLM
-llm = get_groq_llm()
+# --- Skeleton / Fan-out Prompts ---
+# Long trips are generated in two phases: one short call for a per-day
+# skeleton, then one call per day for its activities, run concurrently.
+SKELETON_SYSTEM_PROMPT = """
+You are BackpackBuddy, an expert travel agent AI. Plan the outline of a backpacker's trip.
+
+Return ONLY a JSON object with one entry per day of the trip, in order:
+{{
+  "days": [
+    {{"day": 1, "date": "2024-11-10", "theme": "Cultural Immersion & Street Food Tour", "area": "Old Town / Rattanakosin"}}
+  ]
+}}
+
+Give each day a distinct theme and a compact geographic area so the day can be planned on its own.
+"""
+
+SKELETON_USER_PROMPT = """
+**User's Requirements:**
+- Destination: {destination}
+- Travel Dates: {travel_dates}
+- Budget: {budget_mode}
+- Preferences: {preferences}
+
+**Local context (web search and OpenTripMap; prefer these places and coordinates where they fit):**
+{grounding}
+
+Generate the trip outline as a JSON object:
+"""
+
+DAY_SYSTEM_PROMPT = """
+You are BackpackBuddy, an expert travel agent AI. Plan a single day of a backpacker's trip.
+
+Return ONLY a JSON object for that day with this structure:
+{{
+  "day": 1,
+  "date": "2024-11-10",
+  "theme": "Cultural Immersion & Street Food Tour",
+  "activities": [
+    {{
+      "time": "09:00 - 11:00",
+      "description": "Visit the Grand Palace and Wat Phra Kaew (Temple of the Emerald Buddha)",
+      "location": {{
+        "name": "Grand Palace",
+        "lat": 13.7500,
+        "lon": 100.4915
+      }},
+      "budget_notes": "Entry fee: ~500 THB ($15)"
+    }}
+  ]
+}}
+
+Plan 3-5 activities within the day's area, budget-conscious, with realistic times and
+specific location coordinates. Do not repeat places planned for other days.
+"""
+
+DAY_USER_PROMPT = """
+**User's Requirements:**
+- Destination: {destination}
+- Budget: {budget_mode}
+- Preferences: {preferences}
+
+**This day:** Day {day}, {date} - {theme} (area: {area})
+
+**Other days of the trip:**
+{other_days}
+
+**Local context (web search and OpenTripMap; prefer these places and coordinates where they fit):**
+{grounding}
+
+Generate this day as a JSON object:
+"""
+
+skeleton_prompt = LazyChatPrompt([
+    ("system", SKELETON_SYSTEM_PROMPT),
+    ("human", SKELETON_USER_PROMPT)
+])
+
+day_prompt = LazyChatPrompt([
+    ("system", DAY_SYSTEM_PROMPT),
+    ("human", DAY_USER_PROMPT)
+])
+
+# "single" asks for the whole trip in one call; "fanout" uses skeleton + per-day calls.
+ITINERARY_GENERATION_MODE = os.environ.get("ITINERARY_GENERATION_MODE", "single")
+ITINERARY_FANOUT_CONCURRENCY = int(os.environ.get("ITINERARY_FANOUT_CONCURRENCY", "6"))
+
+
+def _repair_context(destination: str, travel_dates: str, budget_mode: str, preferences: str) -> str:
+    """Describes the trip for fragment re-prompts, so fixes stay on-topic."""
+    return (f"An itinerary for {destination} ({travel_dates}), budget mode {budget_mode}, "
+            f"interests: {preferences}.")
 
 # Main function to generate itinerary
+@timed("generate_itinerary")
 def generate_itinerary(destination: str, travel_dates: str, budget_mode: str, preferences: str) -> dict:
     """
     Generates a travel itinerary using direct LLM invocation.
     """
     try:
         # Create the chain
+        llm = get_groq_llm()
         chain = prompt | llm
         
-        # Invoke the chain
+        # Invoke the chain (grounded only if the destination is already cached)
         response = chain.invoke({
             "destination": destination,
             "travel_dates": travel_dates,
             "budget_mode": budget_mode,
             "preferences": preferences,
+            "grounding": destination_grounder.get_cached(destination) or NO_GROUNDING,
         })
         
         # Extract content from the response
         content = response.content if hasattr(response, 'content') else str(response)
-        
-        # Try to parse JSON from the response
-        # Look for JSON content between curly braces
-        start_idx = content.find('{')
-        end_idx = content.rfind('}') + 1
-        
-        if start_idx != -1 and end_idx > start_idx:
-            json_content = content[start_idx:end_idx]
-            return json.loads(json_content)
-        else:
-            # If no JSON found, return a basic structure
-            return {
-                "error": "Could not extract JSON from response",
-                "raw_response": content
-            }
+        return parse_and_repair(
+            content, ITINERARY_SCHEMA, llm, _repair_context(destination, travel_dates, budget_mode, preferences)
+        )
             
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error in generate_itinerary: {e}")
+    except OutputParseError as e:
+        print(f"Parse error in generate_itinerary: {e}")
         return {"error": "Failed to parse the itinerary from the model's response."}
     except Exception as e:
         print(f"An unexpected error occurred in generate_itinerary: {e}")
         return {"error": str(e)}
 
+@timed("generate_itinerary")
+async def agenerate_itinerary(destination: str, travel_dates: str, budget_mode: str, preferences: str) -> dict:
+    """
+    Async version of generate_itinerary. Uses the Groq async client via
+    ``ainvoke`` so the event loop stays free while the model is generating.
+    """
+    try:
+        grounding = await destination_grounder.aget(destination)
+        llm = get_groq_llm()
+        chain = prompt | llm
+
+        response = await chain.ainvoke({
+            "destination": destination,
+            "travel_dates": travel_dates,
+            "budget_mode": budget_mode,
+            "preferences": preferences,
+            "grounding": grounding or NO_GROUNDING,
+        })
+
+        content = response.content if hasattr(response, 'content') else str(response)
+        return await aparse_and_repair(
+            content, ITINERARY_SCHEMA, llm, _repair_context(destination, travel_dates, budget_mode, preferences)
+        )
+
+    except QueueFullError:
+        # The rate scheduler is saturated; let the caller answer 429 or retry.
+        raise
+    except OutputParseError as e:
+        print(f"Parse error in agenerate_itinerary: {e}")
+        return {"error": "Failed to parse the itinerary from the model's response."}
+    except Exception as e:
+        print(f"An unexpected error occurred in agenerate_itinerary: {e}")
+        return {"error": str(e)}
+
+@timed("stream_itinerary")
+async def astream_itinerary(destination: str, travel_dates: str, budget_mode: str, preferences: str):
+    """
+    Streams the itinerary day by day.
+
+    Consumes the Groq token stream and yields each day object (with its
+    activities) as soon as its closing brace arrives, instead of waiting for
+    the whole trip to be generated.
+
+    Yields:
+        dict: One entry of the ``itinerary`` array per completed day.
+    """
+    grounding = await destination_grounder.aget(destination)
+    llm = get_groq_llm()
+    chain = prompt | llm
+    parser = ArrayItemStreamParser("itinerary", keep_malformed=True)
+    context = _repair_context(destination, travel_dates, budget_mode, preferences)
+    days_sent = set()
+
+    async for chunk in chain.astream({
+        "destination": destination,
+        "travel_dates": travel_dates,
+        "budget_mode": budget_mode,
+        "preferences": preferences,
+        "grounding": grounding or NO_GROUNDING,
+    }):
+        text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+        for item in parser.feed(text):
+            # Each day is validated on its own; a malformed day is repaired
+            # with a re-prompt for just that day.
+            fragment = item.text if isinstance(item, MalformedItem) else json.dumps(item)
+            try:
+                day = await aparse_and_repair(fragment, DAY_SCHEMA, llm, context)
+            except OutputParseError as e:
+                print(f"Skipping streamed day: {e}")
+                continue
+            days_sent.add(day["day"])
+            yield day
+
+    if not parser.done:
+        # The response was cut off, or the model did not follow the expected
+        # layout closely enough to be parsed incrementally; parse the full
+        # response and send the days that haven't been sent yet.
+        result = await aparse_and_repair(parser.text, ITINERARY_SCHEMA, llm, context)
+        for day in result["itinerary"]:
+            if day["day"] not in days_sent:
+                yield day
+
+async def _agenerate_day(skeleton_day: dict, skeleton: list, destination: str, budget_mode: str,
+                         preferences: str, grounding: str, semaphore: asyncio.Semaphore) -> tuple:
+    """
+    Generates the activities for one skeleton day.
+
+    Returns:
+        tuple: (day, error). ``error`` is None on success; a failed day comes
+               back without activities and with the error message, so the
+               rest of the trip is kept.
+
+    Raises:
+        QueueFullError: If the LLM rate budget is exhausted.
+    """
+    other_days = "\n".join(
+        f"- Day {d.get('day')}: {d.get('theme', '')} (area: {d.get('area', '')})"
+        for d in skeleton if d is not skeleton_day
+    ) or "- None"
+    day = {
+        "day": skeleton_day.get("day"),
+        "date": skeleton_day.get("date", ""),
+        "theme": skeleton_day.get("theme", ""),
+        "activities": [],
+    }
+    llm = get_groq_llm()
+    try:
+        async with semaphore:
+            response = await (day_prompt | llm).ainvoke({
+                "destination": destination,
+                "budget_mode": budget_mode,
+                "preferences": preferences,
+                "day": day["day"],
+                "date": day["date"],
+                "theme": day["theme"],
+                "area": skeleton_day.get("area", ""),
+                "other_days": other_days,
+                "grounding": grounding or NO_GROUNDING,
+            }, config=output_budget(LLM_DAY_OUTPUT_TOKENS))
+        content = response.content if hasattr(response, 'content') else str(response)
+        result = await aparse_and_repair(
+            content, DAY_SCHEMA, llm,
+            f"Day {day['day']} ({day['theme']}) of a trip to {destination}, budget mode {budget_mode}.",
+        )
+        day["activities"] = result["activities"]
+    except QueueFullError:
+        raise
+    except OutputParseError as e:
+        print(f"Day {day['day']} response could not be parsed: {e}")
+        return day, "Failed to parse the day from the model's response."
+    except Exception as e:
+        print(f"An unexpected error occurred while generating day {day['day']}: {e}")
+        return day, str(e)
+    return day, None
+
+@timed("generate_itinerary_fanout")
+async def agenerate_itinerary_fanout(destination: str, travel_dates: str, budget_mode: str, preferences: str) -> dict:
+    """
+    Generates an itinerary in two phases: a compact per-day skeleton (date,
+    theme, area), then each day's activities in concurrent LLM calls
+    (at most ITINERARY_FANOUT_CONCURRENCY at a time). The merged result has
+    the same schema as generate_itinerary, and wall-clock time stays close
+    to one skeleton call plus one day call regardless of trip length.
+
+    If some days fail, the trip is returned with ``partial`` set and the
+    failed day numbers in ``failed_days``; if every day fails, an error.
+    """
+    try:
+        grounding = await destination_grounder.aget(destination)
+        llm = get_groq_llm()
+        response = await (skeleton_prompt | llm).ainvoke({
+            "destination": destination,
+            "travel_dates": travel_dates,
+            "budget_mode": budget_mode,
+            "preferences": preferences,
+            "grounding": grounding or NO_GROUNDING,
+        }, config=output_budget(LLM_OUTLINE_OUTPUT_TOKENS))
+        content = response.content if hasattr(response, 'content') else str(response)
+        skeleton = (await aparse_and_repair(
+            content, OUTLINE_SCHEMA, llm, _repair_context(destination, travel_dates, budget_mode, preferences)
+        ))["days"]
+
+        semaphore = asyncio.Semaphore(ITINERARY_FANOUT_CONCURRENCY)
+        tasks = [
+            asyncio.ensure_future(_agenerate_day(d, skeleton, destination, budget_mode, preferences, grounding, semaphore))
+            for d in skeleton
+        ]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            # A day hit the rate limit (or the request was cancelled): the trip
+            # can't be completed, so stop the other days from spending budget.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        failed = [(day["day"], error) for day, error in results if error is not None]
+        if failed and len(failed) == len(results):
+            return {"error": f"Failed to generate any day of the trip: {failed[0][1]}"}
+        itinerary = {"itinerary": [day for day, _ in results]}
+        if failed:
+            itinerary["partial"] = True
+            itinerary["failed_days"] = [number for number, _ in failed]
+        return itinerary
+
+    except QueueFullError:
+        raise
+    except OutputParseError as e:
+        print(f"Parse error in agenerate_itinerary_fanout: {e}")
+        return {"error": "Failed to parse the trip outline from the model's response."}
+    except Exception as e:
+        print(f"An unexpected error occurred in agenerate_itinerary_fanout: {e}")
+        return {"error": str(e)}
+
 if __name__ == '__main__':
     # This block is for direct testing of the agent.
     # Note: Requires .env file with API keys at the root of the project.
@@ -0,0 +1,118 @@
+"""
+This module contains the packing list engine. Packing lists are shared
+between trips with the same feature key (region, season, length bucket and
+activity tags): a cached list is served directly, and on a miss a rule-built
+list is returned at once while the LLM writes a richer one in the background
+that replaces it in the cache for the next traveller.
+"""
+import asyncio
+import copy
+import os
+import time
+
+from backend.agents.packing_rules import build_rule_packing_list, extract_trip_features, packing_feature_key
+from backend.agents.repack_agent import agenerate_packing_list
+from backend.utils.cache import packing_list_cache
+from backend.utils.concurrency import llm_limiter
+from backend.utils.metrics import timed
+
+PACKING_LLM_ENRICHMENT = os.environ.get("PACKING_LLM_ENRICHMENT", "true").lower() == "true"
+PACKING_ENRICH_RETRY_SECONDS = float(os.environ.get("PACKING_ENRICH_RETRY_SECONDS", "300"))
+
+
+class PackingListEngine:
+    """
+    Serves packing lists from the feature-keyed cache or the rules, and
+    enriches cache misses with an LLM-generated list in the background.
+
+    At most one enrichment runs per key, and a key whose enrichment failed
+    is not retried for ``retry_seconds``.
+    """
+
+    def __init__(self, cache=packing_list_cache, enrich: bool = PACKING_LLM_ENRICHMENT,
+                 retry_seconds: float = PACKING_ENRICH_RETRY_SECONDS):
+        self.cache = cache
+        self.enrich = enrich
+        self.retry_seconds = retry_seconds
+        self._tasks = {}
+        self._failed_at = {}
+        self.cache_hits = 0
+        self.rule_lists = 0
+        self.enriched = 0
+        self.enrich_failures = 0
+
+    @timed("packing_list")
+    def get(self, itinerary: dict) -> dict:
+        """
+        Returns the packing list for an itinerary without waiting on the LLM.
+
+        Must be called from the event loop when enrichment is enabled, since
+        a miss schedules a background task.
+
+        Returns:
+            dict: The packing list, with ``source`` set to ``"llm"`` (cached
+                  enrichment) or ``"rules"``.
+        """
+        features = extract_trip_features(itinerary)
+        key = packing_feature_key(features)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache_hits += 1
+            return cached
+
+        self.rule_lists += 1
+        self._schedule(key, itinerary)
+        return build_rule_packing_list(features)
+
+    def stats(self) -> dict:
+        """Returns how lists were served and the state of background enrichment."""
+        return {
+            "cache_hits": self.cache_hits,
+            "rule_lists": self.rule_lists,
+            "enriched": self.enriched,
+            "enrich_failures": self.enrich_failures,
+            "enriching": len(self._tasks),
+        }
+
+    async def aclose(self):
+        """Cancels enrichments still running."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _schedule(self, key: str, itinerary: dict):
+        if not self.enrich or key in self._tasks:
+            return
+        failed_at = self._failed_at.pop(key, None)
+        if failed_at is not None and time.monotonic() - failed_at < self.retry_seconds:
+            self._failed_at[key] = failed_at
+            return
+        task = asyncio.ensure_future(self._enrich(key, copy.deepcopy(itinerary)))
+        self._tasks[key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+
+    async def _enrich(self, key: str, itinerary: dict):
+        try:
+            async with llm_limiter.slot():
+                result = await agenerate_packing_list(itinerary)
+        except Exception as e:
+            result = {"error": str(e)}
+
+        # A rules result means the LLM's output was unusable.
+        if "error" in result or result.get("source") == "rules":
+            print(f"Packing list enrichment failed for {key}: {result.get('error', 'unusable response')}")
+            self.enrich_failures += 1
+            self._failed_at[key] = time.monotonic()
+            return
+
+        # The usage report describes this one call, not the shared entry; the
+        # prompt size is already in /token-stats and the prompt token metrics.
+        result.pop("usage", None)
+        result["source"] = "llm"
+        self.cache.set(key, result)
+        self._failed_at.pop(key, None)
+        self.enriched += 1
+
+
+packing_engine = PackingListEngine()
@@ -0,0 +1,207 @@
+"""
+This module contains the rule-based side of packing list generation: the
+trip features a packing list depends on, the feature key used to share
+packing lists between similar trips, and a packing list built from rules
+alone, without an LLM call.
+"""
+import re
+from datetime import date
+
+from backend.utils.cache import make_cache_key, normalize_text
+
+ACTIVITY_CATEGORIES = {
+    "hiking": ("hike", "hiking", "trek", "trekking", "trail", "mountain", "summit", "waterfall", "national park"),
+    "beach & water": ("beach", "snorkel", "swim", "island", "surf", "dive", "diving", "kayak", "lagoon"),
+    "temples & religious sites": ("temple", "shrine", "pagoda", "wat", "mosque", "church", "cathedral", "monastery"),
+    "museums & galleries": ("museum", "gallery", "exhibition"),
+    "markets & shopping": ("market", "bazaar", "shopping", "souk", "mall"),
+    "food tours": ("street food", "food tour", "cooking class", "tasting"),
+    "nightlife": ("bar", "nightlife", "club", "pub", "rooftop"),
+    "city walking": ("walking tour", "old town", "stroll", "walk around", "explore the city"),
+    "snow & cold": ("ski", "skiing", "snow", "glacier", "ice skating"),
+    "cycling": ("bike", "cycling", "bicycle"),
+    "boat trips": ("boat", "cruise", "ferry", "river"),
+    "wildlife": ("safari", "elephant", "wildlife", "sanctuary", "zoo"),
+    "wellness": ("spa", "massage", "yoga", "hot spring", "onsen"),
+    "caves": ("cave",),
+}
+# Whole words only (plurals allowed), so "bar" doesn't match "bargain".
+_CATEGORY_PATTERNS = {
+    name: re.compile(r"\b(?:" + "|".join(map(re.escape, words)) + r")(?:s|es)?\b")
+    for name, words in ACTIVITY_CATEGORIES.items()
+}
+_MONTHS = ["January", "February", "March", "April", "May", "June", "July",
+           "August", "September", "October", "November", "December"]
+_MONTH_PATTERN = re.compile(r"\b(" + "|".join(m[:3] for m in _MONTHS) + r")[a-z]*\b", re.IGNORECASE)
+
+def _trip_months(itinerary: dict, days: list) -> list:
+    months = []
+    for day in days:
+        try:
+            month = _MONTHS[date.fromisoformat(str(day.get("date", ""))[:10]).month - 1]
+        except ValueError:
+            continue
+        if month not in months:
+            months.append(month)
+    if not months:
+        for match in _MONTH_PATTERN.findall(str(itinerary.get("travel_dates", ""))):
+            month = next(m for m in _MONTHS if m.lower().startswith(match.lower()[:3]))
+            if month not in months:
+                months.append(month)
+    return months
+
+def extract_trip_features(itinerary: dict) -> dict:
+    """
+    Reduces an itinerary to the features a packing list depends on.
+
+    Returns:
+        dict: ``destination``, ``months``, ``days``, deduplicated activity
+              ``categories``, distinct day ``themes``, the mean ``latitude`` and
+              ``longitude`` of the activities and, when the destination is
+              unknown, a few ``places`` to infer it from.
+    """
+    days = [d for d in itinerary.get("itinerary", []) if isinstance(d, dict)]
+    categories, themes, places, coords = set(), [], [], []
+    for day in days:
+        theme = str(day.get("theme") or "").strip()
+        if theme and theme not in themes:
+            themes.append(theme)
+        for activity in day.get("activities", []):
+            text = f"{activity.get('description', '')} {theme}".lower()
+            categories.update(name for name, pattern in _CATEGORY_PATTERNS.items() if pattern.search(text))
+            location = activity.get("location") or {}
+            place = location.get("name")
+            if place and place not in places:
+                places.append(place)
+            if isinstance(location.get("lat"), (int, float)) and isinstance(location.get("lon"), (int, float)):
+                coords.append((location["lat"], location["lon"]))
+    return {
+        "destination": itinerary.get("destination"),
+        "months": _trip_months(itinerary, days),
+        "days": len(days),
+        "categories": sorted(categories),
+        "themes": themes[:10],
+        "places": [] if itinerary.get("destination") else places[:5],
+        "latitude": round(sum(c[0] for c in coords) / len(coords), 2) if coords else None,
+        "longitude": round(sum(c[1] for c in coords) / len(coords), 2) if coords else None,
+    }
+
+
+# --- Feature Key ---
+_SEASONS_NORTH = {12: "winter", 1: "winter", 2: "winter", 3: "spring", 4: "spring", 5: "spring",
+                  6: "summer", 7: "summer", 8: "summer", 9: "autumn", 10: "autumn", 11: "autumn"}
+_SOUTHERN = {"winter": "summer", "summer": "winter", "spring": "autumn", "autumn": "spring"}
+
+def climate_zone(latitude) -> str:
+    """Returns a coarse climate band for a latitude."""
+    if latitude is None:
+        return "unknown"
+    latitude = abs(latitude)
+    if latitude < 23.5:
+        return "tropical"
+    if latitude < 35:
+        return "subtropical"
+    if latitude < 55:
+        return "temperate"
+    return "cold"
+
+def trip_season(features: dict) -> str:
+    """Returns the season of the first travel month, accounting for hemisphere."""
+    if climate_zone(features.get("latitude")) == "tropical":
+        return "tropical"
+    if not features.get("months"):
+        return "any"
+    season = _SEASONS_NORTH[_MONTHS.index(features["months"][0]) + 1]
+    if features.get("latitude") is not None and features["latitude"] < 0:
+        season = _SOUTHERN[season]
+    return season
+
+def length_bucket(days: int) -> str:
+    """Groups trip lengths that need the same quantities."""
+    if days <= 3:
+        return "short"
+    if days <= 7:
+        return "week"
+    if days <= 14:
+        return "two-weeks"
+    return "long"
+
+def destination_region(features: dict) -> str:
+    """
+    The region part of the key: the country (last part of the destination),
+    or a 5-degree grid cell when only coordinates are known.
+    """
+    if features.get("destination"):
+        return normalize_text(str(features["destination"]).split(",")[-1])
+    if features.get("latitude") is not None:
+        return f"grid:{round(features['latitude'] / 5) * 5},{round(features['longitude'] / 5) * 5}"
+    return "unknown"
+
+def packing_feature_key(features: dict) -> str:
+    """Builds the cache key shared by trips needing the same packing list."""
+    return make_cache_key("packing", {
+        "region": destination_region(features),
+        "climate": climate_zone(features.get("latitude")),
+        "season": trip_season(features),
+        "length": length_bucket(features.get("days", 0)),
+        "tags": sorted(features.get("categories", [])),
+    })
+
+
+# --- Rules ---
+_BASE_LIST = {
+    "Documents": ["Passport", "Travel insurance", "Copies of bookings", "Cards and some local cash"],
+    "Toiletries": ["Toothbrush", "Toothpaste", "Travel-size shampoo", "Deodorant", "Sunscreen"],
+    "Electronics": ["Phone charger", "Power bank", "Universal travel adapter"],
+    "Miscellaneous": ["Daypack", "Reusable water bottle", "Basic first aid kit", "Padlock"],
+}
+_SEASON_ITEMS = {
+    "tropical": (["Light breathable clothes", "Rain jacket or poncho", "Sandals", "Sunhat"], ["Insect repellent"],
+                 "Expect hot, humid weather; pack for sudden downpours."),
+    "summer": (["Shorts", "Sunhat", "Sunglasses"], [], "Expect warm weather; protect yourself from the sun."),
+    "winter": (["Warm jacket", "Thermal base layers", "Beanie and gloves", "Waterproof boots"], ["Lip balm"],
+               "Expect cold weather; pack warm layers."),
+    "spring": (["Light jacket", "Layers", "Compact umbrella"], [], "Expect mild, changeable weather; bring layers."),
+    "autumn": (["Light jacket", "Layers", "Compact umbrella"], [], "Expect cool, changeable weather; bring layers."),
+    "any": (["Light jacket"], [], "Check the local weather forecast before you go."),
+}
+_CATEGORY_ITEMS = {
+    "hiking": {"Clothing": ["Hiking shoes", "Quick-dry shirt"], "Miscellaneous": ["Trail snacks", "Headlamp"]},
+    "beach & water": {"Clothing": ["Swimwear", "Flip-flops"], "Miscellaneous": ["Quick-dry towel", "Dry bag"]},
+    "temples & religious sites": {"Clothing": ["Outfit covering shoulders and knees", "Slip-on shoes"]},
+    "nightlife": {"Clothing": ["One smarter outfit"]},
+    "city walking": {"Clothing": ["Comfortable walking shoes"]},
+    "snow & cold": {"Clothing": ["Insulated jacket", "Thermal socks"], "Miscellaneous": ["Hand warmers"]},
+    "cycling": {"Clothing": ["Padded shorts"], "Miscellaneous": ["Bike lights"]},
+    "boat trips": {"Toiletries": ["Motion sickness tablets"], "Miscellaneous": ["Dry bag"]},
+    "wildlife": {"Clothing": ["Neutral-coloured clothes"], "Electronics": ["Binoculars"]},
+    "wellness": {"Clothing": ["Yoga or lounge wear"]},
+    "caves": {"Miscellaneous": ["Headlamp"], "Clothing": ["Shoes with good grip"]},
+    "markets & shopping": {"Miscellaneous": ["Foldable tote bag"]},
+    "food tours": {"Toiletries": ["Antacids", "Hand sanitizer"]},
+}
+
+def build_rule_packing_list(features: dict) -> dict:
+    """
+    Builds a packing list from the trip features alone: base essentials,
+    clothing quantities for the trip length (assuming laundry weekly), and
+    items for the season and each activity category.
+
+    Returns:
+        dict: A packing list in the same schema as the LLM's, with
+              ``source`` set to ``"rules"``.
+    """
+    count = max(1, min(features.get("days", 1) or 1, 7))
+    season_clothes, season_misc, weather = _SEASON_ITEMS[trip_season(features)]
+    packing_list = {key: list(items) for key, items in _BASE_LIST.items()}
+    packing_list["Clothing"] = [f"{count}x T-shirts", f"{count}x Underwear", f"{count}x Socks",
+                                f"{max(1, count // 3)}x Pants or shorts", "Sleepwear"] + season_clothes
+    packing_list["Miscellaneous"].extend(season_misc)
+    for category in features.get("categories", []):
+        for group, items in _CATEGORY_ITEMS.get(category, {}).items():
+            packing_list.setdefault(group, []).extend(items)
+    return {
+        "packing_list": {group: list(dict.fromkeys(items)) for group, items in packing_list.items()},
+        "weather_summary": weather,
+        "source": "rules",
+    }
@@ -1,13 +1,23 @@
 """
 This module contains the agent responsible for autonomous replanning and packing list generation.
 """
-from langchain_core.prompts import ChatPromptTemplate
+import asyncio
+import copy
 import json
+import os
+from collections import Counter
 
+from backend.agents.packing_rules import build_rule_packing_list, extract_trip_features
 from backend.utils.api_clients import get_groq_llm
+from backend.utils.concurrency import QueueFullError, llm_limiter
+from backend.utils.metrics import timed
+from backend.utils.prompts import LazyChatPrompt
+from backend.utils.rate_limit import LLM_DAY_OUTPUT_TOKENS, LLM_PACKING_OUTPUT_TOKENS, output_budget
+from backend.utils.output_parser import (
+    DAY_SCHEMA, PACKING_LIST_SCHEMA, OutputParseError, aparse_and_repair, parse_and_repair
+)
+from backend.utils.tokens import count_tokens, token_meter, truncate_to_tokens
 
-# Initialize the LLM
-llm = get_groq_llm()
 
 # Simple prompt for packing list generation
 SYSTEM_PROMPT = """
@@ -17,7 +27,7 @@ You are BackpackBuddy's "Repack Expert". Your job is to generate a practical pac
 Create a comprehensive packing list based on the provided itinerary.
 
 **Your Process:**
-1. Analyze the destination, duration, and planned activities from the itinerary
+1. Analyze the destination, travel month, duration, and planned activity types from the trip summary
 2. Consider the typical weather for the destination and season
 3. Categorize items into logical groups
 4. Be specific with quantities where helpful
@@ -39,72 +49,318 @@ Return ONLY the JSON object, no additional text.
 """
 
 USER_PROMPT = """
-**Itinerary Details:**
+**Trip Summary:**
 {itinerary}
 
 Generate a packing list as a JSON object:
 """
 
 # Create the prompt
-packing_list_prompt = ChatPromptTemplate.from_messages([
+packing_list_prompt = LazyChatPrompt([
     ("system", SYSTEM_PROMPT),
     ("human", USER_PROMPT)
 ])
 
+PACKING_LIST_CONTEXT = "A backpacker's packing list grouped by category, with a short weather summary."
+
+# --- 1. Packing List: Compact Trip Encoding ---
+# A packing list only depends on where, when, how long and what kind of
+# activities, so the prompt gets those features instead of the full
+# itinerary JSON (coordinates, times, notes), keeping it small for any trip length.
+PACKING_PROMPT_MAX_TOKENS = int(os.environ.get("PACKING_PROMPT_MAX_TOKENS", "700"))
+
+def encode_trip_features(features: dict) -> str:
+    """Renders trip features as a few short lines, most important first."""
+    lines = [
+        f"Destination: {features['destination'] or 'unknown (infer from places)'}",
+        f"Month: {', '.join(features['months']) or 'unknown'}",
+        f"Days: {features['days']}",
+        f"Activity types: {', '.join(features['categories']) or 'general sightseeing'}",
+    ]
+    if features["places"]:
+        lines.append(f"Places: {'; '.join(features['places'])}")
+    if features["themes"]:
+        lines.append(f"Day themes: {'; '.join(features['themes'])}")
+    return "\n".join(lines)
+
+def build_packing_prompt_input(itinerary: dict) -> tuple:
+    """
+    Encodes the trip for the packing list prompt, trimmed so the whole
+    prompt stays within PACKING_PROMPT_MAX_TOKENS.
+
+    Returns:
+        tuple: (trip summary text, prompt tokens, whether it was trimmed)
+    """
+    summary = encode_trip_features(extract_trip_features(itinerary))
+    fixed_tokens = count_tokens(SYSTEM_PROMPT) + count_tokens(USER_PROMPT.replace("{itinerary}", ""))
+    trimmed = truncate_to_tokens(summary, max(PACKING_PROMPT_MAX_TOKENS - fixed_tokens, 0))
+    return trimmed, fixed_tokens + count_tokens(trimmed), trimmed != summary
+
+def _with_usage(result: dict, prompt_tokens: int, trimmed: bool, response) -> dict:
+    """Adds a ``usage`` report (prompt size, whether it was trimmed) to the result."""
+    reported = (getattr(response, "usage_metadata", None) or {}).get("input_tokens")
+    result["usage"] = {"prompt_tokens": prompt_tokens, "reported_prompt_tokens": reported, "trimmed": trimmed}
+    return result
+
+@timed("generate_packing_list")
 def generate_packing_list(itinerary: dict) -> dict:
     """
     Generates a packing list for the given itinerary using direct LLM invocation.
     """
     try:
         # Create the chain
+        llm = get_groq_llm()
         chain = packing_list_prompt | llm
         
-        # Convert itinerary to string for the prompt
-        itinerary_str = json.dumps(itinerary, indent=2)
+        # Encode the trip compactly for the prompt
+        trip_summary, prompt_tokens, trimmed = build_packing_prompt_input(itinerary)
+        token_meter.record("packing_list", prompt_tokens, trimmed)
         
         # Invoke the chain
-        response = chain.invoke({"itinerary": itinerary_str})
+        response = chain.invoke({"itinerary": trip_summary}, config=output_budget(LLM_PACKING_OUTPUT_TOKENS))
         
         # Extract content from the response
         content = response.content if hasattr(response, 'content') else str(response)
-        
-        # Try to parse JSON from the response
-        start_idx = content.find('{')
-        end_idx = content.rfind('}') + 1
-        
-        if start_idx != -1 and end_idx > start_idx:
-            json_content = content[start_idx:end_idx]
-            return json.loads(json_content)
-        else:
-            # Return a basic packing list if JSON parsing fails
-            return {
-                "packing_list": {
-                    "Clothing": ["T-shirts", "Pants", "Underwear", "Socks"],
-                    "Toiletries": ["Toothbrush", "Toothpaste", "Shampoo"],
-                    "Electronics": ["Phone charger", "Power bank"],
-                    "Documents": ["Passport", "Travel insurance"],
-                    "Miscellaneous": ["Backpack", "Water bottle"]
-                },
-                "weather_summary": "Check local weather forecast"
-            }
+        result = parse_and_repair(content, PACKING_LIST_SCHEMA, llm, PACKING_LIST_CONTEXT)
+        return _with_usage(result, prompt_tokens, trimmed, response)
             
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error in generate_packing_list: {e}")
-        return {"error": "Failed to parse the packing list from the model's response."}
+    except OutputParseError as e:
+        print(f"Parse error in generate_packing_list: {e}")
+        return build_rule_packing_list(extract_trip_features(itinerary))
     except Exception as e:
         print(f"An unexpected error occurred in generate_packing_list: {e}")
         return {"error": str(e)}
 
+@timed("generate_packing_list")
+async def agenerate_packing_list(itinerary: dict) -> dict:
+    """
+    Async version of generate_packing_list built on ``ainvoke``.
+    """
+    try:
+        llm = get_groq_llm()
+        chain = packing_list_prompt | llm
+
+        trip_summary, prompt_tokens, trimmed = build_packing_prompt_input(itinerary)
+        token_meter.record("packing_list", prompt_tokens, trimmed)
+
+        response = await chain.ainvoke({"itinerary": trip_summary}, config=output_budget(LLM_PACKING_OUTPUT_TOKENS))
+
+        content = response.content if hasattr(response, 'content') else str(response)
+        result = await aparse_and_repair(content, PACKING_LIST_SCHEMA, llm, PACKING_LIST_CONTEXT)
+        return _with_usage(result, prompt_tokens, trimmed, response)
+
+    except OutputParseError as e:
+        print(f"Parse error in agenerate_packing_list: {e}")
+        return build_rule_packing_list(extract_trip_features(itinerary))
+    except Exception as e:
+        print(f"An unexpected error occurred in agenerate_packing_list: {e}")
+        return {"error": str(e)}
+
+
+# --- 2. Itinerary Replanner ---
+# Replanning sends only the affected day plus a one-line summary of its
+# neighbours to the LLM, then splices the new day back into the itinerary,
+# so reacting to rain or a closure costs about one day's worth of tokens.
+REPLAN_SYSTEM_PROMPT = """
+You are BackpackBuddy's "Replanner". A day of a backpacker's trip has to change because of a new condition.
+
+Rewrite ONLY the given day so it works under the new condition. Keep activities that are still fine,
+replace the ones that are affected, keep the plan budget-conscious and geographically sensible, and
+don't duplicate places from the neighbouring days.
+
+Return ONLY the JSON object for the day, with the same structure as the input:
+{{
+  "day": 1,
+  "date": "2024-11-10",
+  "theme": "...",
+  "activities": [
+    {{
+      "time": "09:00 - 11:00",
+      "description": "...",
+      "location": {{"name": "...", "lat": 0.0, "lon": 0.0}},
+      "budget_notes": "..."
+    }}
+  ]
+}}
+"""
+
+REPLAN_USER_PROMPT = """
+**Day to replan:**
+{day}
+
+**Neighbouring days:**
+{neighbours}
+
+**New condition:** {condition}
+
+Generate the replanned day as a JSON object:
+"""
+
+replan_prompt = LazyChatPrompt([
+    ("system", REPLAN_SYSTEM_PROMPT),
+    ("human", REPLAN_USER_PROMPT)
+])
+
+REPLAN_CONCURRENCY = int(os.environ.get("REPLAN_CONCURRENCY", "4"))
+
+
+def _find_day(days: list, day_number: int) -> int:
+    for index, day in enumerate(days):
+        if isinstance(day, dict) and day.get("day") == day_number:
+            return index
+    raise KeyError(f"Day {day_number} is not in the itinerary.")
+
+def _summarize_day(day: dict) -> str:
+    places = [a.get("location", {}).get("name") or a.get("description", "") for a in day.get("activities", [])]
+    return f"Day {day.get('day')} ({day.get('date', '')}): {day.get('theme', '')} - {', '.join(p for p in places if p)}"
+
+def _keyed_activities(activities: list) -> dict:
+    """
+    Keys activities by (time, place, occurrence), so a place visited twice in
+    a day, or two activities without a place name, are not collapsed.
+    """
+    keyed, seen = {}, Counter()
+    for activity in activities:
+        location = activity.get("location") or {}
+        name = (location.get("name") or activity.get("description") or "").strip().lower()
+        slot = (str(activity.get("time") or "").strip(), name)
+        keyed[(*slot, seen[slot])] = activity
+        seen[slot] += 1
+    return keyed
+
+def diff_day(old_day: dict, new_day: dict) -> dict:
+    """
+    Compares two versions of a day, matching activities by time slot and
+    place. An activity moved to another time shows up as removed and added.
+
+    Returns:
+        dict: ``added`` and ``removed`` activities, ``changed`` activities
+              with the fields that differ, and the ``unchanged`` count.
+    """
+    old = _keyed_activities(old_day.get("activities", []))
+    new = _keyed_activities(new_day.get("activities", []))
+    changed = []
+    for key in old.keys() & new.keys():
+        fields = {
+            field: {"before": old[key].get(field), "after": new[key].get(field)}
+            for field in old[key].keys() | new[key].keys()
+            if old[key].get(field) != new[key].get(field)
+        }
+        if fields:
+            changed.append({"activity": new[key].get("description", key[1]), "fields": fields})
+    return {
+        "day": new_day.get("day", old_day.get("day")),
+        "added": [a for k, a in new.items() if k not in old],
+        "removed": [a for k, a in old.items() if k not in new],
+        "changed": changed,
+        "unchanged": len(old.keys() & new.keys()) - len(changed),
+    }
+
+def _replan_input(days: list, index: int, condition: str) -> dict:
+    neighbours = [days[i] for i in (index - 1, index + 1) if 0 <= i < len(days) and isinstance(days[i], dict)]
+    return {
+        "day": json.dumps(days[index], separators=(",", ":"), ensure_ascii=False),
+        "neighbours": "\n".join(_summarize_day(d) for d in neighbours) or "None",
+        "condition": condition,
+    }
+
+def _keep_day_identity(old_day: dict, new_day: dict) -> dict:
+    # The model must not renumber or move the day.
+    new_day["day"] = old_day.get("day")
+    new_day.setdefault("date", old_day.get("date"))
+    new_day.setdefault("theme", old_day.get("theme"))
+    return new_day
+
+async def _areplan_one(days: list, index: int, condition: str, semaphore: asyncio.Semaphore) -> dict:
+    """
+    Replans days[index] and returns the new day (or the old one on failure)
+    with its diff. Each call holds its own ``llm_limiter`` slot.
+
+    Raises:
+        QueueFullError: If the server's LLM queue is full.
+    """
+    old_day = days[index]
+    llm = get_groq_llm()
+    try:
+        async with semaphore, llm_limiter.slot():
+            response = await (replan_prompt | llm).ainvoke(
+                _replan_input(days, index, condition), config=output_budget(LLM_DAY_OUTPUT_TOKENS)
+            )
+            content = response.content if hasattr(response, 'content') else str(response)
+            new_day = await aparse_and_repair(content, DAY_SCHEMA, llm, f"Day {old_day.get('day')} replanned for: {condition}")
+        new_day = _keep_day_identity(old_day, new_day)
+        return {"index": index, "day": new_day, "diff": {**diff_day(old_day, new_day), "condition": condition}}
+    except QueueFullError:
+        raise
+    except Exception as e:
+        print(f"An unexpected error occurred while replanning day {old_day.get('day')}: {e}")
+        return {"index": index, "day": old_day, "diff": {"day": old_day.get("day"), "condition": condition, "error": str(e)}}
+
+@timed("replan_days")
+async def areplan_days(itinerary: dict, changes: list) -> dict:
+    """
+    Replans several days concurrently (at most REPLAN_CONCURRENCY LLM calls
+    at a time). Conditions for the same day are combined into one call.
+
+    Args:
+        itinerary (dict): The itinerary, with an ``itinerary`` list of days.
+        changes (list): (day number, new condition) pairs.
+
+    Returns:
+        dict: ``itinerary`` with the replanned days spliced in (the input is
+              not modified) and ``changes``, one structured diff per day.
+
+    Raises:
+        KeyError: If a day number is not in the itinerary.
+        QueueFullError: If the server's LLM queue is full.
+    """
+    updated = copy.deepcopy(itinerary)
+    days = updated.get("itinerary", [])
+    conditions = {}
+    for day_number, condition in changes:
+        conditions.setdefault(_find_day(days, day_number), []).append(condition)
+
+    semaphore = asyncio.Semaphore(REPLAN_CONCURRENCY)
+    tasks = [
+        asyncio.ensure_future(_areplan_one(days, index, "; ".join(texts), semaphore))
+        for index, texts in conditions.items()
+    ]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # The queue is full (or the request was cancelled): don't leave the
+        # other days running for a response that won't be sent.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    for result in results:
+        days[result["index"]] = result["day"]
+    return {"itinerary": updated, "changes": [r["diff"] for r in sorted(results, key=lambda r: r["index"])]}
 
-# --- 2. Itinerary Replanner (Simplified for now) ---
-# A full replanning agent is complex. We'll start with a simplified version.
-# For now, this will be a placeholder, as the main focus is the packing list.
 def replan_day(itinerary: dict, day_to_replan: int, new_condition: str) -> dict:
     """
-    (Placeholder) Re-plans a specific day in the itinerary based on a new condition.
+    Re-plans a specific day in the itinerary based on a new condition, using
+    direct LLM invocation. Use areplan_days for several days or for diffs.
+
+    Returns:
+        dict: An updated copy of the itinerary; the day is left as it was if
+              replanning fails.
+
+    Raises:
+        KeyError: If the day is not in the itinerary.
     """
-    print("Replanning function called, but it's a placeholder for now.")
-    # In a full implementation, this would invoke another agent with a prompt like:
-    # "Given the following itinerary, replan Day {day_to_replan} because {new_condition}.
-    # The new plan should still be budget-conscious and logical."
-    return itinerary
\ No newline at end of file
+    updated = copy.deepcopy(itinerary)
+    days = updated.get("itinerary", [])
+    index = _find_day(days, day_to_replan)
+    llm = get_groq_llm()
+    try:
+        response = (replan_prompt | llm).invoke(
+            _replan_input(days, index, new_condition), config=output_budget(LLM_DAY_OUTPUT_TOKENS)
+        )
+        content = response.content if hasattr(response, 'content') else str(response)
+        new_day = parse_and_repair(content, DAY_SCHEMA, llm, f"Day {day_to_replan} replanned for: {new_condition}")
+        days[index] = _keep_day_identity(days[index], new_day)
+    except Exception as e:
+        print(f"An unexpected error occurred while replanning day {day_to_replan}: {e}")
+    return updated
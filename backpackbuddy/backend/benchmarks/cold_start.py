@@ -0,0 +1,91 @@
+"""
+This module contains the cold-start benchmark: how long a fresh worker takes
+to import the API and, optionally, to answer its first request.
+
+Run from the directory that contains ``backend/``:
+
+    python -m backend.benchmarks.cold_start --runs 10 --serve
+
+The import is measured with GROQ_API_KEY unset, since a worker must be able
+to start (and serve non-LLM endpoints) before its keys are checked.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+IMPORT_SNIPPET = (
+    "import time; start = time.perf_counter(); import backend.main; "
+    "print(time.perf_counter() - start)"
+)
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env.pop("GROQ_API_KEY", None)
+    env["PYTHONPATH"] = os.getcwd() + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+def _summarize(samples: list) -> dict:
+    samples = sorted(samples)
+    return {
+        "runs": len(samples),
+        "median_s": round(statistics.median(samples), 3),
+        "p95_s": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "max_s": round(samples[-1], 3),
+    }
+
+def measure_import(runs: int) -> dict:
+    """Times ``import backend.main`` in ``runs`` fresh interpreters."""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], env=_env(),
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return _summarize(samples)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def measure_first_response(runs: int, timeout: float = 30.0) -> dict:
+    """Times process launch to the first successful ``GET /`` under uvicorn."""
+    samples = []
+    for _ in range(runs):
+        port = _free_port()
+        start = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--log-level", "warning"],
+            env={**_env(), "PDF_WORKERS": "1"}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            while True:
+                if time.perf_counter() - start > timeout:
+                    raise TimeoutError(f"uvicorn did not answer within {timeout}s")
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                        response.read()
+                    break
+                except OSError:
+                    time.sleep(0.01)
+            samples.append(time.perf_counter() - start)
+        finally:
+            server.terminate()
+            server.wait()
+    return _summarize(samples)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure BackpackBuddy worker cold start.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--serve", action="store_true", help="also time the first HTTP response under uvicorn")
+    args = parser.parse_args()
+
+    print("import backend.main:", measure_import(args.runs))
+    if args.serve:
+        print("first GET /:", measure_first_response(args.runs))
@@ -0,0 +1,253 @@
+"""
+This module contains local stand-ins for the APIs the backend calls, served
+from one process so benchmarks measure our code rather than the internet:
+
+- Groq chat completions (``/openai/v1/chat/completions``), with configurable
+  time to first token, generation speed, streaming and error rate. Answers
+  are valid JSON shaped for the prompt that was sent (full itinerary, trip
+  outline, single day, replanned day, packing list).
+- OSRM ``route`` and ``table`` services, from straight-line distances.
+- OpenTripMap ``geoname`` lookups and ``radius`` and ``bbox`` place searches,
+  with deterministic places.
+
+Run it directly and point the backend at it:
+
+    python -m backend.benchmarks.fake_upstreams --port 9100 --latency-ms 400 --tokens-per-second 800
+    GROQ_BASE_URL=http://127.0.0.1:9100 OSRM_API_URL=http://127.0.0.1:9100 \\
+    OPENTRIPMAP_API_URL=http://127.0.0.1:9100 uvicorn backend.main:app
+"""
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import math
+import random
+import re
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+PLACE_KINDS = ("museums", "historic", "cultural", "natural", "foods", "architecture")
+THEMES = ("Old town and markets", "Museums and history", "Parks and viewpoints", "Food crawl",
+          "Temples and architecture", "Day hike", "Neighbourhood walk", "Beach and coast")
+DATE_RANGE = re.compile(r"(\d{4}-\d{2}-\d{2})\s*(?:to|-|–)\s*(\d{4}-\d{2}-\d{2})")
+
+
+def _rng(*parts) -> random.Random:
+    return random.Random(hashlib.sha256("|".join(map(str, parts)).encode()).hexdigest())
+
+def _center(destination: str) -> tuple:
+    rng = _rng("center", destination)
+    return round(rng.uniform(-40, 60), 4), round(rng.uniform(-120, 140), 4)
+
+def _haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((p2 - p1) / 2) ** 2
+         + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 6371.0 * 2 * math.asin(math.sqrt(a))
+
+
+# --- Trip Content ---
+def _field(text: str, label: str, default: str = "") -> str:
+    match = re.search(rf"{label}:\**\s*(.+)", text)
+    return match.group(1).strip() if match else default
+
+def _trip_days(text: str, default_days: int) -> list:
+    """Returns the trip's dates, from a "YYYY-MM-DD to YYYY-MM-DD" range when present."""
+    match = DATE_RANGE.search(text)
+    if match:
+        start, end = (datetime.date.fromisoformat(d) for d in match.groups())
+        count = min(max((end - start).days + 1, 1), 60)
+    else:
+        start, count = datetime.date(2025, 3, 1), default_days
+    return [(start + datetime.timedelta(days=i)).isoformat() for i in range(count)]
+
+def fake_day(destination: str, number: int, date: str, theme: str = None) -> dict:
+    """Builds one deterministic day of four located activities."""
+    rng = _rng("day", destination, number)
+    lat, lon = _center(destination)
+    activities = []
+    for slot, hour in enumerate((9, 11, 14, 17)):
+        place = f"{rng.choice(THEMES).split()[0]} spot {number}.{slot + 1}"
+        activities.append({
+            "time": f"{hour:02d}:00 - {hour + 2:02d}:00",
+            "description": f"Visit {place} in {destination}",
+            "location": {"name": place, "lat": round(lat + rng.uniform(-0.03, 0.03), 5),
+                         "lon": round(lon + rng.uniform(-0.03, 0.03), 5)},
+            "budget_notes": rng.choice(["Free", f"Entry: ~${rng.randint(3, 25)}", f"Meal: ~${rng.randint(5, 15)}"]),
+        })
+    return {"day": number, "date": date, "theme": theme or THEMES[number % len(THEMES)], "activities": activities}
+
+def fake_completion(messages: list, default_days: int) -> str:
+    """Builds the JSON answer a well-behaved model would give to these messages."""
+    system = next((m["content"] for m in messages if m["role"] == "system"), "")
+    user = messages[-1]["content"] if messages else ""
+    destination = _field(user, "Destination", "Somewhere")
+
+    if "You fix malformed JSON" in system:
+        return json.dumps({"value": None})
+    if "Repack Expert" in system:
+        return json.dumps({
+            "packing_list": {
+                "Clothing": ["3x T-shirts", "2x Pants", "1x Light jacket"],
+                "Toiletries": ["Toothbrush", "Toothpaste", "Sunscreen"],
+                "Electronics": ["Phone charger", "Power bank"],
+                "Documents": ["Passport", "Travel insurance"],
+                "Miscellaneous": ["Daypack", "Water bottle"],
+            },
+            "weather_summary": "Mild days and cool evenings.",
+        })
+    if "Replanner" in system:
+        match = re.search(r'"day":\s*(\d+)', user)
+        number = int(match.group(1)) if match else 1
+        return json.dumps(fake_day("replanned", number, "", "Replanned day"))
+    match = re.search(r"\*\*This day:\*\* Day (\d+), ([^ ]*)", user)
+    if match:
+        return json.dumps(fake_day(destination, int(match.group(1)), match.group(2)))
+    dates = _trip_days(user, default_days)
+    if "trip outline" in user:
+        return json.dumps({"days": [
+            {"day": i + 1, "date": date, "theme": THEMES[(i + 1) % len(THEMES)], "area": f"District {i + 1}"}
+            for i, date in enumerate(dates)
+        ]})
+    return json.dumps({"itinerary": [fake_day(destination, i + 1, date) for i, date in enumerate(dates)]})
+
+
+# --- App ---
+def create_app(args) -> FastAPI:
+    """Builds the fake upstream app from the parsed command-line options."""
+    app = FastAPI(title="BackpackBuddy fake upstreams")
+    stats = {"chat_requests": 0, "chat_errors": 0, "osrm_requests": 0, "opentripmap_requests": 0}
+
+    def jittered(ms: float) -> float:
+        return max(0.0, random.gauss(ms, ms * args.jitter)) / 1000
+
+    @app.get("/stats")
+    def get_stats():
+        return stats
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["chat_requests"] += 1
+        await asyncio.sleep(jittered(args.latency_ms))
+        if random.random() < args.error_rate:
+            stats["chat_errors"] += 1
+            return JSONResponse({"error": {"message": "Service overloaded", "type": "server_error"}}, status_code=503)
+
+        content = fake_completion(body.get("messages", []), args.days)
+        prompt_tokens = sum(len(m.get("content") or "") for m in body.get("messages", [])) // 4
+        completion_tokens = len(content) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        model = body.get("model", "fake")
+
+        if not body.get("stream"):
+            await asyncio.sleep(completion_tokens / args.tokens_per_second)
+            return {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        def chunk(delta: dict, finish_reason=None, **extra) -> str:
+            return "data: " + json.dumps({
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra,
+            }) + "\n\n"
+
+        async def events():
+            # Roughly four tokens per chunk, paced at the configured speed.
+            for start in range(0, len(content), 16):
+                yield chunk({"role": "assistant", "content": content[start:start + 16]})
+                await asyncio.sleep(4 / args.tokens_per_second)
+            yield chunk({}, "stop", x_groq={"usage": usage})
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    def parse_coords(coords: str) -> list:
+        return [tuple(float(v) for v in point.split(",")) for point in coords.split(";")]
+
+    def leg(a: tuple, b: tuple) -> tuple:
+        km = _haversine_km(a[1], a[0], b[1], b[0]) * 1.3
+        return km * 1000, km / args.speed_kmh * 3600
+
+    @app.get("/route/v1/{profile}/{coords}")
+    async def osrm_route(profile: str, coords: str):
+        stats["osrm_requests"] += 1
+        await asyncio.sleep(jittered(args.osrm_latency_ms))
+        points = parse_coords(coords)
+        legs = [leg(a, b) for a, b in zip(points, points[1:])]
+        return {"code": "Ok", "routes": [{"distance": sum(d for d, _ in legs), "duration": sum(t for _, t in legs),
+                                          "legs": [{"distance": d, "duration": t} for d, t in legs]}]}
+
+    @app.get("/table/v1/{profile}/{coords}")
+    async def osrm_table(profile: str, coords: str):
+        stats["osrm_requests"] += 1
+        await asyncio.sleep(jittered(args.osrm_latency_ms))
+        points = parse_coords(coords)
+        matrix = [[leg(a, b) for b in points] for a in points]
+        return {"code": "Ok", "durations": [[t for _, t in row] for row in matrix],
+                "distances": [[d for d, _ in row] for row in matrix]}
+
+    def places(lat_min: float, lat_max: float, lon_min: float, lon_max: float, limit: int) -> list:
+        rng = _rng("places", round(lat_min, 3), round(lon_min, 3), round(lat_max, 3), round(lon_max, 3))
+        result = []
+        for i in range(min(limit, args.places_per_query)):
+            lat, lon = rng.uniform(lat_min, lat_max), rng.uniform(lon_min, lon_max)
+            result.append({"xid": f"N{rng.getrandbits(40)}", "name": f"Place {i + 1}",
+                           "kinds": ",".join(rng.sample(PLACE_KINDS, 2)), "rate": rng.randint(1, 7),
+                           "point": {"lon": round(lon, 6), "lat": round(lat, 6)}})
+        return result
+
+    @app.get("/0.1/en/places/bbox")
+    async def opentripmap_bbox(lon_min: float, lon_max: float, lat_min: float, lat_max: float, limit: int = 500):
+        stats["opentripmap_requests"] += 1
+        await asyncio.sleep(jittered(args.otm_latency_ms))
+        return places(lat_min, lat_max, lon_min, lon_max, limit)
+
+    @app.get("/0.1/en/places/geoname")
+    async def opentripmap_geoname(name: str):
+        stats["opentripmap_requests"] += 1
+        await asyncio.sleep(jittered(args.otm_latency_ms))
+        lat, lon = _center(name)
+        return {"name": name, "country": "XX", "lat": lat, "lon": lon, "population": 1000000, "status": "OK"}
+
+    @app.get("/0.1/en/places/radius")
+    async def opentripmap_radius(lon: float, lat: float, radius: float, limit: int = 500):
+        stats["opentripmap_requests"] += 1
+        await asyncio.sleep(jittered(args.otm_latency_ms))
+        dlat = radius / 111_320
+        dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+        found = places(lat - dlat, lat + dlat, lon - dlon, lon + dlon, limit)
+        for place in found:
+            place["dist"] = round(_haversine_km(lat, lon, place["point"]["lat"], place["point"]["lon"]) * 1000, 1)
+        return sorted((p for p in found if p["dist"] <= radius), key=lambda p: p["dist"])
+
+    return app
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Fake Groq, OSRM and OpenTripMap servers for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=300, help="Groq time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=800, help="Groq generation speed")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of Groq calls answered with 503")
+    parser.add_argument("--days", type=int, default=5, help="trip length when the prompt has no date range")
+    parser.add_argument("--osrm-latency-ms", type=float, default=20)
+    parser.add_argument("--otm-latency-ms", type=float, default=30)
+    parser.add_argument("--speed-kmh", type=float, default=25, help="travel speed behind OSRM durations")
+    parser.add_argument("--places-per-query", type=int, default=20)
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative standard deviation of latencies")
+    return parser
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    options = build_parser().parse_args()
+    uvicorn.run(create_app(options), host=options.host, port=options.port, log_level="warning")
@@ -0,0 +1,232 @@
+"""
+This module contains the load test: it starts the fake upstreams and the API
+under uvicorn, drives ``/generate-itinerary``, ``/generate-packing-list``
+and ``/download-itinerary-pdf`` at a given concurrency, and reports
+throughput, p50/p95/p99 latency, errors and the API's memory use.
+
+Run from the directory that contains ``backend/``:
+
+    python -m backend.benchmarks.load_test --concurrency 16 --requests 200 --latency-ms 500
+
+Every request uses a different destination, so the itinerary and PDF caches
+do not turn the run into a cache benchmark. Rate-limit pacing is disabled
+(GROQ_RPM_LIMIT=0, GROQ_TPM_LIMIT=0) since the fake Groq has no limits.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+
+from backend.benchmarks.cold_start import _free_port
+
+ENDPOINTS = ("itinerary", "packing-list", "pdf")
+
+
+# --- Processes ---
+def _tree_pids(pid: int) -> list:
+    """Returns a process and all of its descendants (PDF workers included)."""
+    pids, index = [pid], 0
+    while index < len(pids):
+        try:
+            for task in os.listdir(f"/proc/{pids[index]}/task"):
+                with open(f"/proc/{pids[index]}/task/{task}/children") as f:
+                    pids += [int(child) for child in f.read().split()]
+        except OSError:
+            pass
+        index += 1
+    return pids
+
+def _memory_kb(pid: int, field: str = "VmRSS") -> int:
+    """Sums a /proc status field over the process tree; 0 where /proc is unavailable."""
+    total = 0
+    for process in _tree_pids(pid):
+        try:
+            with open(f"/proc/{process}/status") as f:
+                for line in f:
+                    if line.startswith(field + ":"):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process serving {url} exited with code {process.returncode}")
+        try:
+            httpx.get(url, timeout=1).raise_for_status()
+            return
+        except httpx.HTTPError:
+            time.sleep(0.05)
+    raise TimeoutError(f"{url} did not answer within {timeout}s")
+
+def start_servers(args) -> tuple:
+    """Starts the fake upstreams and the API; returns (fake, api, fake_url, api_url)."""
+    fake_port, api_port = _free_port(), _free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    env = {**os.environ, "PYTHONPATH": os.getcwd() + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "backend.benchmarks.fake_upstreams", "--port", str(fake_port),
+         "--latency-ms", str(args.latency_ms), "--tokens-per-second", str(args.tokens_per_second),
+         "--error-rate", str(args.error_rate)],
+        env=env,
+    )
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(api_port), "--log-level", "warning"],
+        env={
+            **env,
+            "GROQ_API_KEY": "fake", "GROQ_MODEL": env.get("GROQ_MODEL", "llama-3.1-8b-instant"),
+            "GROQ_BASE_URL": fake_url, "OSRM_API_URL": fake_url, "OPENTRIPMAP_API_URL": fake_url,
+            "OPENTRIPMAP_API_KEY": "fake", "ENABLE_OSRM_ROUTING": "true",
+            "GROQ_RPM_LIMIT": "0", "GROQ_TPM_LIMIT": "0",
+        },
+        stdout=None if args.verbose else subprocess.DEVNULL,
+    )
+    try:
+        _wait_ready(f"{fake_url}/stats", fake)
+        _wait_ready(f"http://127.0.0.1:{api_port}/", api)
+    except Exception:
+        stop_servers(fake, api)
+        raise
+    return fake, api, fake_url, f"http://127.0.0.1:{api_port}"
+
+def stop_servers(*processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+# --- Request Bodies ---
+def itinerary_body(n: int, days: int, generation_mode: str = None) -> dict:
+    body = {
+        "destination": f"Benchmark City {n}",
+        "travel_dates": f"2025-03-01 to 2025-03-{days:02d}",
+        "budget_mode": "backpacker",
+        "preferences": "street food, museums, hiking",
+    }
+    if generation_mode:
+        body["generation_mode"] = generation_mode
+    return body
+
+def itinerary_variant(itinerary: dict, n: int) -> dict:
+    """Returns a copy of an itinerary that no cache has seen."""
+    variant = copy.deepcopy(itinerary)
+    variant["destination"] = f"Benchmark City {n}"
+    for day in variant.get("itinerary", []):
+        for activity in day.get("activities", []):
+            activity["description"] = f"{activity.get('description', '')} (variant {n})"
+    return variant
+
+
+# --- Load ---
+def _summarize(latencies: list, statuses: list, wall: float, rss_kb: list) -> dict:
+    ok = sum(1 for s in statuses if 200 <= s < 300)
+    summary = {
+        "requests": len(statuses),
+        "ok": ok,
+        "errors": {str(s): statuses.count(s) for s in sorted(set(statuses)) if not 200 <= s < 300},
+        "throughput_rps": round(ok / wall, 2) if wall else 0.0,
+        "wall_s": round(wall, 2),
+    }
+    if latencies:
+        for p in (50, 95, 99):
+            summary[f"p{p}_ms"] = round(float(np.percentile(latencies, p)) * 1000, 1)
+        summary["max_ms"] = round(max(latencies) * 1000, 1)
+    if rss_kb:
+        summary["rss_mb_peak"] = round(max(rss_kb) / 1024, 1)
+        summary["rss_mb_end"] = round(rss_kb[-1] / 1024, 1)
+    return summary
+
+async def run_load(client: httpx.AsyncClient, path: str, bodies: list, concurrency: int, pid: int) -> dict:
+    """Sends every body to ``path`` with at most ``concurrency`` requests in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses, rss_kb = [], [], []
+
+    async def one(body: dict):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, json=body)
+                await response.aread()
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 0
+            statuses.append(status)
+            if 200 <= status < 300:
+                latencies.append(time.perf_counter() - start)
+
+    async def sample_memory():
+        while True:
+            rss_kb.append(_memory_kb(pid))
+            await asyncio.sleep(0.1)
+
+    sampler = asyncio.create_task(sample_memory())
+    start = time.perf_counter()
+    await asyncio.gather(*(one(body) for body in bodies))
+    wall = time.perf_counter() - start
+    sampler.cancel()
+    rss_kb.append(_memory_kb(pid))
+    return _summarize(latencies, statuses, wall, rss_kb)
+
+async def run(args, fake_url: str, api_url: str, pid: int) -> dict:
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    report = {}
+    async with httpx.AsyncClient(base_url=api_url, timeout=timeout, limits=limits) as client:
+        # One itinerary up front: the follow-up endpoints need one as input,
+        # and it warms the Groq client.
+        response = await client.post("/generate-itinerary", json=itinerary_body(0, args.days, args.generation_mode))
+        response.raise_for_status()
+        base = response.json()
+        report["baseline_rss_mb"] = round(_memory_kb(pid) / 1024, 1)
+
+        for endpoint in args.endpoints:
+            numbers = range(1, args.requests + 1)
+            if endpoint == "itinerary":
+                path = "/generate-itinerary"
+                bodies = [itinerary_body(n, args.days, args.generation_mode) for n in numbers]
+            elif endpoint == "packing-list":
+                path, bodies = "/generate-packing-list", [{"itinerary": itinerary_variant(base, n)} for n in numbers]
+            else:
+                path, bodies = "/download-itinerary-pdf", [{"itinerary": itinerary_variant(base, n)} for n in numbers]
+            report[endpoint] = await run_load(client, path, bodies, args.concurrency, pid)
+            print(f"{endpoint}: {json.dumps(report[endpoint])}")
+
+    report["peak_rss_mb"] = round(_memory_kb(pid, "VmHWM") / 1024, 1)
+    report["upstream_calls"] = httpx.get(f"{fake_url}/stats").json()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the BackpackBuddy API against fake upstreams.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=50, help="requests per endpoint")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--days", type=int, default=5, help="trip length (1-31)")
+    parser.add_argument("--generation-mode", choices=("single", "fanout"))
+    parser.add_argument("--latency-ms", type=float, default=300, help="fake Groq time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=800, help="fake Groq generation speed")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake Groq calls that fail")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout in seconds")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the API's log output")
+    args = parser.parse_args()
+
+    fake, api, fake_url, api_url = start_servers(args)
+    try:
+        report = asyncio.run(run(args, fake_url, api_url, api.pid))
+    finally:
+        stop_servers(fake, api)
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,64 @@
+"""
+This module contains the PDF rendering micro-benchmarks: render time, file
+size and peak Python memory of ``create_itinerary_pdf`` for trips of 1 to
+60 days, in-process and without the worker pool.
+
+Run from the directory that contains ``backend/``:
+
+    python -m backend.benchmarks.pdf_bench --runs 5 --days 1 7 14 30 60
+"""
+import argparse
+import datetime
+import statistics
+import time
+import tracemalloc
+
+from backend.benchmarks.fake_upstreams import fake_day
+from backend.utils.pdf_generator import create_itinerary_pdf, warm_up
+
+
+def sample_itinerary(days: int) -> dict:
+    """Builds an itinerary of ``days`` days shaped like the model's output."""
+    start = datetime.date(2025, 3, 1)
+    return {
+        "destination": "Benchmark City",
+        "travel_dates": f"{start} to {start + datetime.timedelta(days=days - 1)}",
+        "itinerary": [
+            fake_day("Benchmark City", i + 1, (start + datetime.timedelta(days=i)).isoformat()) for i in range(days)
+        ],
+    }
+
+def measure(days: int, runs: int) -> dict:
+    """Renders a ``days``-day itinerary ``runs`` times."""
+    itinerary = sample_itinerary(days)
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        pdf = create_itinerary_pdf(itinerary)
+        samples.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    create_itinerary_pdf(itinerary)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    median = statistics.median(samples)
+    return {
+        "days": days,
+        "median_ms": round(median * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2),
+        "ms_per_day": round(median * 1000 / days, 2),
+        "size_kb": round(len(pdf) / 1024, 1),
+        "peak_alloc_mb": round(peak / 2**20, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark itinerary PDF rendering by trip length.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 7, 14, 30, 60])
+    args = parser.parse_args()
+
+    warm_up()
+    for days in args.days:
+        print(measure(days, args.runs))
@@ -1,18 +1,64 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import List, Optional
+import asyncio
 import json
-import io
+import os
+from contextlib import asynccontextmanager
 
-from backend.agents.itinerary_agent import generate_itinerary
-from backend.agents.repack_agent import generate_packing_list
-from backend.utils.pdf_generator import create_itinerary_pdf
+from backend.agents.itinerary_agent import (
+    ITINERARY_GENERATION_MODE, agenerate_itinerary, agenerate_itinerary_fanout, astream_itinerary
+)
+from backend.agents.budget_agent import arebalance_budget, attach_budget_summary
+from backend.agents.packing_engine import packing_engine
+from backend.agents.repack_agent import areplan_days
+from backend.utils.api_clients import aclose_clients, llm_router_stats, prewarm_clients
+from backend.utils.cache import itinerary_cache, packing_list_cache, itinerary_request_key, content_hash
+from backend.utils.concurrency import llm_limiter, QueueFullError
+from backend.utils.grounding import destination_grounder
+from backend.utils.http_client import http_client
+from backend.utils.job_queue import JOB_MAX_WAIT_SECONDS, JobNotFoundError, job_runner
+from backend.utils.metrics import MetricsMiddleware, registry as metrics_registry
+from backend.utils.maps import (
+    ENABLE_OSRM_ROUTING, aattach_day_legs, aattach_travel_legs, optimize_day_route, optimize_itinerary_routes
+)
+from backend.utils.output_parser import output_parser_stats
+from backend.utils.singleflight import inflight_requests
+from backend.utils.pdf_cache import pdf_cache
+from backend.utils.pdf_service import pdf_service
+from backend.utils.rate_limit import rate_limit_stats
+from backend.utils.trip_store import trip_store, TripNotFoundError
+from backend.utils.tokens import token_meter
+
+# Load the LLM client libraries in the background after startup, so the
+# worker accepts connections first and the first request doesn't pay for it.
+LLM_PREWARM = os.environ.get("LLM_PREWARM", "true").lower() == "true"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Starts and stops the background services owned by this worker."""
+    pdf_service.start()
+    job_runner.start()
+    destination_grounder.start()
+    prewarm = asyncio.create_task(asyncio.to_thread(prewarm_clients)) if LLM_PREWARM else None
+    yield
+    if prewarm is not None:
+        await prewarm
+    await job_runner.aclose()
+    await destination_grounder.aclose()
+    pdf_service.shutdown()
+    await packing_engine.aclose()
+    await http_client.aclose()
+    http_client.close()
+    await aclose_clients()
 
 app = FastAPI(
     title="BackpackBuddy API",
     description="API for BackpackBuddy, the AI-powered travel itinerary planner.",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # CORS (Cross-Origin Resource Sharing)
@@ -28,6 +74,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 # --- Pydantic Models for API Requests ---
 class ItineraryRequest(BaseModel):
@@ -35,9 +82,64 @@ class ItineraryRequest(BaseModel):
     travel_dates: str
     budget_mode: str
     preferences: str
+    # "single" (one LLM call) or "fanout" (skeleton + concurrent per-day calls).
+    generation_mode: Optional[str] = None
 
 class ItineraryData(BaseModel):
-    itinerary: dict
+    """Either a stored trip (trip_id, optional trip_version) or a full itinerary."""
+    itinerary: Optional[dict] = None
+    trip_id: Optional[str] = None
+    trip_version: Optional[int] = None
+
+class ReplanChange(BaseModel):
+    day: int
+    condition: str
+
+class ReplanRequest(ItineraryData):
+    """A trip (or itinerary) plus the days to replan and why."""
+    changes: List[ReplanChange]
+
+class BudgetRequest(ItineraryData):
+    budget_mode: str
+
+class BatchItineraryRequest(BaseModel):
+    requests: List[ItineraryRequest]
+
+class ItineraryJobRequest(ItineraryRequest):
+    """An itinerary request run as a background job, with optional follow-up stages."""
+    packing_list: bool = True
+    pdf: bool = True
+
+# --- Trip Helpers ---
+TRIP_FIELDS = ("trip_id", "trip_version")
+
+def _save_trip(itinerary: dict) -> dict:
+    """
+    Persists a generated itinerary and returns it with its trip ID attached.
+    Partial itineraries (some days failed) are returned as they are, unsaved.
+    """
+    if itinerary.get("partial"):
+        return itinerary
+    record = trip_store.save(itinerary)
+    return {**itinerary, "trip_id": record["trip_id"], "trip_version": record["version"]}
+
+def _resolve_itinerary(request: ItineraryData) -> tuple:
+    """
+    Returns (itinerary, content hash) for a follow-up request, loading the
+    itinerary from the trip store when a trip ID is given.
+    """
+    if request.trip_id:
+        try:
+            record = trip_store.get(request.trip_id, request.trip_version)
+        except TripNotFoundError:
+            raise HTTPException(status_code=404, detail=f"Trip not found: {request.trip_id}")
+        return record["itinerary"], record["content_hash"]
+    if request.itinerary is not None:
+        # Clients may echo back the trip fields we added; they are not part
+        # of the itinerary itself.
+        itinerary = {k: v for k, v in request.itinerary.items() if k not in TRIP_FIELDS}
+        return itinerary, content_hash(itinerary)
+    raise HTTPException(status_code=422, detail="Provide either a trip_id or an itinerary.")
 
 # --- API Endpoints ---
 @app.get("/")
@@ -45,73 +147,551 @@ def read_root():
     """Root endpoint to check if the API is running."""
     return {"message": "Welcome to the BackpackBuddy API! 🎒"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Returns stage timings, token counts and upstream latencies in the Prometheus text format."""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+def _collect_service_metrics() -> list:
+    """Exposes the counters the services already keep alongside the histograms."""
+    limiter = llm_limiter.stats()
+    jobs = job_runner.stats()
+    return [
+        ("backpackbuddy_llm_requests_active", "gauge", "LLM generations running in this worker.",
+         [({}, limiter["active"])]),
+        ("backpackbuddy_llm_requests_waiting", "gauge", "LLM generations waiting for a slot.",
+         [({}, limiter["waiting"])]),
+        ("backpackbuddy_jobs_queued", "gauge", "Background jobs waiting for a worker.", [({}, jobs["queued"])]),
+        ("backpackbuddy_jobs_finished_total", "counter", "Background jobs finished, by outcome.",
+         [({"outcome": "succeeded"}, jobs["completed"]), ({"outcome": "failed"}, jobs["failed"])]),
+        ("backpackbuddy_pdf_renders_pending", "gauge", "PDF renders queued or running.",
+         [({}, pdf_service.stats()["pending"])]),
+        ("backpackbuddy_cache_lookups_total", "counter", "Response cache lookups, by cache and result.",
+         [({"cache": name, "result": result}, cache.stats()[key])
+          for name, cache in (("itinerary", itinerary_cache), ("packing_list", packing_list_cache))
+          for result, key in (("hit", "hits"), ("miss", "misses"))]),
+        ("backpackbuddy_output_parser_total", "counter", "LLM responses by parsing outcome.",
+         [({"outcome": outcome}, count) for outcome, count in output_parser_stats().items()]),
+        ("backpackbuddy_groq_tokens_available", "gauge", "Tokens left in each model's TPM budget.",
+         [({"model": model}, stats["tokens_available"]) for model, stats in rate_limit_stats().items()]),
+    ]
+
+metrics_registry.register_collector(_collect_service_metrics)
+
+@app.get("/cache-stats")
+def cache_stats():
+    """Returns hit/miss counters for the agent response caches."""
+    return {
+        "itinerary": itinerary_cache.stats(),
+        "packing_list": packing_list_cache.stats(),
+        "packing_engine": packing_engine.stats(),
+        "jobs": job_runner.stats(),
+        "grounding": destination_grounder.stats(),
+    }
+
+@app.get("/upstream-stats")
+def upstream_stats():
+    """Returns latency and error stats for the travel API upstreams, and Groq rate budgets and routing."""
+    return {**http_client.stats(), "groq": rate_limit_stats(), "llm_router": llm_router_stats()}
+
+@app.get("/token-stats")
+def token_stats():
+    """Returns the prompt tokens sent to the LLM, per prompt type."""
+    return token_meter.stats()
+
+@app.get("/trips/{trip_id}")
+def get_trip_endpoint(trip_id: str, version: Optional[int] = None):
+    """Returns a stored trip (latest version unless one is requested)."""
+    try:
+        record = trip_store.get(trip_id, version)
+    except TripNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Trip not found: {trip_id}")
+    return {**record["itinerary"], "trip_id": record["trip_id"], "trip_version": record["version"]}
+
+async def _agenerate_itinerary_json(request: ItineraryRequest) -> dict:
+    """
+    Generates (or loads from the cache) the itinerary for a request, with
+    routes and budget attached. Failures from the agent are returned as an
+    ``error`` dict; the trip is not saved.
+    """
+    mode = request.generation_mode or ITINERARY_GENERATION_MODE
+    if mode not in ("single", "fanout"):
+        raise HTTPException(status_code=422, detail=f"Unknown generation_mode: {mode}")
+    # The mode is part of the key, so the cache and in-flight sharing never
+    # hand a fan-out request a single-call result or the other way round.
+    cache_key = itinerary_request_key(
+        request.destination, request.travel_dates, request.budget_mode, request.preferences, mode
+    )
+    cached = itinerary_cache.get(cache_key)
+    if cached is not None:
+        print(f"Serving cached itinerary for: {request.destination}")
+        return cached
+
+    agent = agenerate_itinerary_fanout if mode == "fanout" else agenerate_itinerary
+
+    async def generate():
+        print(f"Generating itinerary for: {request.destination} ({mode})")
+        async with llm_limiter.slot():
+            result = await agent(
+                destination=request.destination,
+                travel_dates=request.travel_dates,
+                budget_mode=request.budget_mode,
+                preferences=request.preferences,
+            )
+        if isinstance(result, dict) and "error" not in result:
+            # Kept with the trip so follow-up agents know where and when it is.
+            result.setdefault("destination", request.destination)
+            result.setdefault("travel_dates", request.travel_dates)
+            optimize_itinerary_routes(result)
+            attach_budget_summary(result, request.budget_mode)
+            if ENABLE_OSRM_ROUTING:
+                await aattach_travel_legs(result)
+        return result
+
+    # Identical requests arriving while this one is generating share its result.
+    itinerary_result = await inflight_requests.do(cache_key, generate)
+
+    if isinstance(itinerary_result, str):
+        try:
+            itinerary_json = json.loads(itinerary_result)
+        except json.JSONDecodeError:
+            print(f"Failed to parse JSON: {itinerary_result}")
+            raise HTTPException(status_code=500, detail="Agent returned a non-JSON string.")
+    elif isinstance(itinerary_result, dict):
+        itinerary_json = itinerary_result
+    else:
+        print(f"Unknown data type returned: {type(itinerary_result)}")
+        raise HTTPException(status_code=500, detail="Agent returned an unknown data type.")
+
+    if itinerary_json.get("partial"):
+        # Failed days are often transient; the next request tries again.
+        print(f"Itinerary generated without days {itinerary_json.get('failed_days')}; not caching it")
+    elif "error" not in itinerary_json:
+        itinerary_cache.set(cache_key, itinerary_json)
+        print("Itinerary generated successfully")
+    return itinerary_json
+
 @app.post("/generate-itinerary")
 async def generate_itinerary_endpoint(request: ItineraryRequest):
     """Endpoint to generate a new travel itinerary."""
     try:
-        print(f"Generating itinerary for: {request.destination}")
-        itinerary_result = generate_itinerary(
-            destination=request.destination,
-            travel_dates=request.travel_dates,
-            budget_mode=request.budget_mode,
-            preferences=request.preferences,
-        )
-
-        if isinstance(itinerary_result, str):
-            try:
-                itinerary_json = json.loads(itinerary_result)
-            except json.JSONDecodeError:
-                print(f"Failed to parse JSON: {itinerary_result}")
-                raise HTTPException(status_code=500, detail="Agent returned a non-JSON string.")
-        elif isinstance(itinerary_result, dict):
-            itinerary_json = itinerary_result
-        else:
-            print(f"Unknown data type returned: {type(itinerary_result)}")
-            raise HTTPException(status_code=500, detail="Agent returned an unknown data type.")
-
-        print("Itinerary generated successfully")
-        return itinerary_json
+        itinerary_json = await _agenerate_itinerary_json(request)
+        if "error" in itinerary_json:
+            return itinerary_json
+        return _save_trip(itinerary_json)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=f"Server is busy: {str(e)}")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in generate_itinerary_endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"An internal error occurred: {str(e)}")
 
+@app.post("/generate-itinerary/stream")
+async def generate_itinerary_stream_endpoint(request: ItineraryRequest):
+    """
+    Streaming variant of /generate-itinerary. Responds with NDJSON: one
+    {"type": "day"} event per completed day, then a {"type": "done"} event
+    with the trip's budget summary (or {"type": "error"} if generation fails
+    midway).
+    """
+    # The stream is one model call, so it shares the "single" mode's entries.
+    cache_key = itinerary_request_key(
+        request.destination, request.travel_dates, request.budget_mode, request.preferences, "single"
+    )
+    cached = itinerary_cache.get(cache_key)
+    if cached is not None and isinstance(cached.get("itinerary"), list):
+        async def cached_stream():
+            for day in cached["itinerary"]:
+                yield json.dumps({"type": "day", "data": day}) + "\n"
+            record = trip_store.save(cached)
+            yield json.dumps({
+                "type": "done", "days": len(cached["itinerary"]), "budget_summary": cached.get("budget_summary"),
+                "trip_id": record["trip_id"], "trip_version": record["version"],
+            }) + "\n"
+
+        return StreamingResponse(cached_stream(), media_type="application/x-ndjson")
+
+    # Check the LLM limiter before the response starts so a saturated worker
+    # can still answer with a proper 429 status. The slot itself is taken
+    # inside the generator, which is always closed, even if the client
+    # disconnects before the body is sent.
+    if llm_limiter.is_full():
+        raise HTTPException(status_code=429, detail="Server is busy: the LLM queue is full; try again later.")
+
+    async def event_stream():
+        days = []
+        try:
+            async with llm_limiter.slot():
+                print(f"Streaming itinerary for: {request.destination}")
+                async for day in astream_itinerary(
+                    destination=request.destination,
+                    travel_dates=request.travel_dates,
+                    budget_mode=request.budget_mode,
+                    preferences=request.preferences,
+                ):
+                    optimize_day_route(day)
+                    if ENABLE_OSRM_ROUTING:
+                        await aattach_day_legs(day)
+                    days.append(day)
+                    yield json.dumps({"type": "day", "data": day}) + "\n"
+            itinerary = {
+                "destination": request.destination, "travel_dates": request.travel_dates, "itinerary": days,
+            }
+            # Routes and legs were added per day; the budget summary needs the
+            # whole trip. The cached entry then matches /generate-itinerary's.
+            attach_budget_summary(itinerary, request.budget_mode)
+            itinerary_cache.set(cache_key, itinerary)
+            record = trip_store.save(itinerary)
+            yield json.dumps({
+                "type": "done", "days": len(days), "budget_summary": itinerary["budget_summary"],
+                "trip_id": record["trip_id"], "trip_version": record["version"],
+            }) + "\n"
+        except Exception as e:
+            print(f"Error in generate_itinerary_stream_endpoint: {str(e)}")
+            yield json.dumps({"type": "error", "detail": str(e)}) + "\n"
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+# --- Batch Generation ---
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "500"))
+# Items generated at once; the Groq rate scheduler does the actual pacing.
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+BATCH_BUSY_RETRY_SECONDS = float(os.environ.get("BATCH_BUSY_RETRY_SECONDS", "5"))
+
+async def _agenerate_batch_item(index: int, request: ItineraryRequest, semaphore: asyncio.Semaphore) -> dict:
+    """Generates one batch item, waiting and retrying while the LLM budget is exhausted."""
+    async with semaphore:
+        while True:
+            try:
+                itinerary = await _agenerate_itinerary_json(request)
+                break
+            except QueueFullError:
+                await asyncio.sleep(BATCH_BUSY_RETRY_SECONDS)
+            except HTTPException as e:
+                return {"type": "error", "index": index, "detail": e.detail}
+            except Exception as e:
+                print(f"Error in batch item {index}: {str(e)}")
+                return {"type": "error", "index": index, "detail": str(e)}
+    if "error" in itinerary:
+        return {"type": "error", "index": index, "detail": itinerary["error"]}
+    return {"type": "result", "index": index, "data": _save_trip(itinerary)}
+
+@app.post("/generate-itinerary/batch")
+async def generate_itinerary_batch_endpoint(request: BatchItineraryRequest):
+    """
+    Generates many itineraries in one request, paced under the Groq rate
+    limits. Responds with NDJSON: a {"type": "result"} (or {"type":
+    "error"}) event per item as it finishes, tagged with the item's
+    ``index``, then a {"type": "done"} summary.
+    """
+    if not request.requests:
+        raise HTTPException(status_code=422, detail="Provide at least one itinerary request.")
+    if len(request.requests) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"A batch can hold at most {BATCH_MAX_ITEMS} requests.")
+
+    async def event_stream():
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+        tasks = [
+            asyncio.ensure_future(_agenerate_batch_item(index, item, semaphore))
+            for index, item in enumerate(request.requests)
+        ]
+        succeeded = 0
+        try:
+            print(f"Generating a batch of {len(tasks)} itineraries")
+            for next_done in asyncio.as_completed(tasks):
+                event = await next_done
+                succeeded += event["type"] == "result"
+                yield json.dumps(event) + "\n"
+            yield json.dumps({"type": "done", "succeeded": succeeded, "failed": len(tasks) - succeeded}) + "\n"
+        finally:
+            # Stop generating if the client went away.
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+# --- PDF Delivery ---
+PDF_CHUNK_SIZE = 64 * 1024
+PDF_FILENAME = "BackpackBuddy_Itinerary.pdf"
+
+def _parse_byte_range(range_header: str, size: int):
+    """
+    Parses a single ``bytes=`` range. Returns (start, end) inclusive, None
+    to serve the whole file, or "invalid" if the range can't be satisfied.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text == "":
+            length = int(end_text)
+            if length <= 0:
+                return "invalid"
+            return max(size - length, 0), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return "invalid"
+    return start, min(end, size - 1)
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses weak comparison: W/"x" matches "x".
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+def _iter_file(f, start: int, length: int):
+    # Takes an open file so the PDF can be evicted from the spool meanwhile.
+    with f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(PDF_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def _pdf_response(http_request: Request, artifact, conditional: bool = True) -> Response:
+    """
+    Builds the PDF response with ETag, If-None-Match (304, only if
+    ``conditional``) and single-range (206) support. Spooled PDFs are
+    streamed from disk in chunks.
+
+    Raises:
+        FileNotFoundError: If a spooled PDF was evicted since it was looked up.
+    """
+    headers = {
+        "ETag": artifact.etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=86400",
+        "Content-Location": f"/itinerary-pdf/{artifact.digest}",
+        "Content-Disposition": f"attachment; filename={PDF_FILENAME}",
+    }
+
+    if conditional and _etag_matches(http_request.headers.get("if-none-match", ""), artifact.etag):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = _parse_byte_range(http_request.headers.get("range"), artifact.size)
+    if byte_range == "invalid":
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{artifact.size}"})
+
+    status_code = 200
+    start, end = 0, artifact.size - 1
+    if byte_range is not None:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{artifact.size}"
+    length = end - start + 1
+    headers["Content-Length"] = str(length)
+
+    if artifact.data is not None:
+        return Response(artifact.data[start:end + 1], status_code=status_code,
+                        media_type="application/pdf", headers=headers)
+    pdf_file = open(artifact.path, "rb")
+    return StreamingResponse(_iter_file(pdf_file, start, length), status_code=status_code,
+                             media_type="application/pdf", headers=headers)
+
+async def _aget_pdf_artifact(itinerary: dict, digest: str):
+    """Returns the cached PDF for an itinerary, rendering it if needed."""
+    artifact = await pdf_cache.aget(digest)
+    if artifact is None:
+        async def render():
+            pdf_bytes = await pdf_service.render(itinerary)
+            return await asyncio.to_thread(pdf_cache.put, digest, pdf_bytes)
+
+        # Render in the PDF process pool; concurrent downloads of the same
+        # itinerary share one render.
+        artifact = await inflight_requests.do(f"pdf:{digest}", render)
+    return artifact
+
 @app.post("/download-itinerary-pdf")
-async def download_itinerary_pdf_endpoint(request: ItineraryData):
+async def download_itinerary_pdf_endpoint(request: ItineraryData, http_request: Request):
     """Endpoint to generate and download an itinerary as a PDF."""
+    itinerary, digest = _resolve_itinerary(request)
     try:
-        pdf_bytes = create_itinerary_pdf(request.itinerary)
-
-        return StreamingResponse(
-            io.BytesIO(pdf_bytes),
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": "attachment; filename=BackpackBuddy_Itinerary.pdf"
-            }
-        )
+        # A POST is never answered with 304; conditional requests go to the
+        # GET route in Content-Location.
+        artifact = await _aget_pdf_artifact(itinerary, digest)
+        try:
+            return _pdf_response(http_request, artifact, conditional=False)
+        except FileNotFoundError:
+            # Evicted from the spool after the lookup: the next lookup misses
+            # and renders it again.
+            artifact = await _aget_pdf_artifact(itinerary, digest)
+            return _pdf_response(http_request, artifact, conditional=False)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=f"Server is busy: {str(e)}")
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out while generating the PDF.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate PDF: {str(e)}")
 
+@app.get("/itinerary-pdf/{digest}")
+async def get_itinerary_pdf_endpoint(digest: str, http_request: Request):
+    """Serves a previously rendered PDF by its content address (see the ETag)."""
+    artifact = await pdf_cache.aget(digest) if digest.isalnum() else None
+    try:
+        if artifact is not None:
+            return _pdf_response(http_request, artifact)
+    except FileNotFoundError:
+        pass
+    raise HTTPException(status_code=404, detail="PDF not found; request it via /download-itinerary-pdf.")
+
 @app.post("/generate-packing-list")
 async def generate_packing_list_endpoint(request: ItineraryData):
-    """Endpoint to generate a packing list for a given itinerary."""
+    """
+    Endpoint to generate a packing list for a given itinerary. Lists are
+    shared between similar trips; a trip with no cached list gets a
+    rule-built one immediately while the LLM enriches it in the background.
+    No LLM call is made while the request waits, so there is no ``usage``
+    report; enrichment prompts are counted in /token-stats.
+    """
+    itinerary, _ = _resolve_itinerary(request)
     try:
-        print("Generating packing list...")
-        packing_list_result = generate_packing_list(request.itinerary)
-
-        if isinstance(packing_list_result, str):
-            try:
-                packing_list_json = json.loads(packing_list_result)
-            except json.JSONDecodeError:
-                print(f"Failed to parse packing list JSON: {packing_list_result}")
-                raise HTTPException(status_code=500, detail="Agent returned a non-JSON string for packing list.")
-        elif isinstance(packing_list_result, dict):
-            packing_list_json = packing_list_result
-        else:
-            print(f"Unknown packing list data type: {type(packing_list_result)}")
-            raise HTTPException(status_code=500, detail="Agent returned an unknown data type for packing list.")
-
-        print("Packing list generated successfully")
+        packing_list_json = packing_engine.get(itinerary)
+        print(f"Packing list served from: {packing_list_json.get('source')}")
         return packing_list_json
     except Exception as e:
         print(f"Error in generate_packing_list_endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"An internal error occurred while generating packing list: {str(e)}")
+
+@app.post("/replan")
+async def replan_endpoint(request: ReplanRequest):
+    """
+    Replans only the affected days of a trip (e.g. rain on day 2, a museum
+    closed on day 3) and returns the updated itinerary with a per-day diff.
+    Stored trips get a new version when a day was replanned.
+    """
+    itinerary, _ = _resolve_itinerary(request)
+    if not request.changes:
+        raise HTTPException(status_code=422, detail="Provide at least one change to replan.")
+    try:
+        print(f"Replanning days: {[change.day for change in request.changes]}")
+        # Each day's LLM call takes its own llm_limiter slot.
+        result = await areplan_days(itinerary, [(change.day, change.condition) for change in request.changes])
+
+        updated = result["itinerary"]
+        replanned = {diff["day"] for diff in result["changes"] if "error" not in diff}
+        for day in updated.get("itinerary", []):
+            if day.get("day") in replanned:
+                optimize_day_route(day)
+                if ENABLE_OSRM_ROUTING:
+                    await aattach_day_legs(day)
+
+        if request.trip_id and replanned:
+            record = trip_store.save(updated, request.trip_id)
+            updated = {**updated, "trip_id": record["trip_id"], "trip_version": record["version"]}
+        elif request.trip_id:
+            # No day was replanned: the stored trip is unchanged.
+            updated = {**updated, "trip_id": request.trip_id, "trip_version": request.trip_version}
+        return {**updated, "changes": result["changes"]}
+    except TripNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Trip not found: {request.trip_id}")
+    except KeyError as e:
+        raise HTTPException(status_code=422, detail=str(e).strip("'\""))
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=f"Server is busy: {str(e)}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in replan_endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"An internal error occurred while replanning: {str(e)}")
+
+@app.post("/rebalance-budget")
+async def rebalance_budget_endpoint(request: BudgetRequest):
+    """
+    Checks a trip against its budget mode locally and replans only the days
+    that go over it. Stored trips get a new version when anything changed.
+    """
+    itinerary, _ = _resolve_itinerary(request)
+    try:
+        # The budget check is local; only the replans of over-budget days
+        # take llm_limiter slots (one per day).
+        result = await arebalance_budget(itinerary, request.budget_mode)
+
+        updated = result["itinerary"]
+        replanned = {diff["day"] for diff in result["changes"] if "error" not in diff}
+        for day in updated.get("itinerary", []):
+            if day.get("day") in replanned:
+                optimize_day_route(day)
+
+        if request.trip_id and replanned:
+            record = trip_store.save(updated, request.trip_id)
+            updated = {**updated, "trip_id": record["trip_id"], "trip_version": record["version"]}
+        elif request.trip_id:
+            updated = {**updated, "trip_id": request.trip_id, "trip_version": request.trip_version}
+        return {**updated, "changes": result["changes"], "budget": result["budget"]}
+    except TripNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Trip not found: {request.trip_id}")
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=f"Server is busy: {str(e)}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in rebalance_budget_endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"An internal error occurred while rebalancing the budget: {str(e)}")
+
+# --- Background Jobs ---
+async def _run_itinerary_job(job: dict, progress) -> dict:
+    """
+    Runs an itinerary job: the itinerary, then the packing list and PDF.
+    The job fails only if the itinerary does; a failed follow-up stage is
+    reported as an ``error`` entry in its place.
+    """
+    request = ItineraryJobRequest(**job["payload"])
+    progress("itinerary")
+    itinerary = await _agenerate_itinerary_json(request)
+    if "error" in itinerary:
+        raise RuntimeError(itinerary["error"])
+    trip = _save_trip(itinerary)
+    result = {"trip_id": trip.get("trip_id"), "trip_version": trip.get("trip_version"), "itinerary": trip}
+
+    if request.packing_list:
+        progress("packing_list", **result)
+        try:
+            result["packing_list"] = packing_engine.get(itinerary)
+        except Exception as e:
+            result["packing_list"] = {"error": str(e)}
+
+    if request.pdf:
+        progress("pdf", **result)
+        try:
+            artifact = await _aget_pdf_artifact(itinerary, content_hash(itinerary))
+            result["pdf"] = {"url": f"/itinerary-pdf/{artifact.digest}", "etag": artifact.etag, "size": artifact.size}
+        except Exception as e:
+            result["pdf"] = {"error": str(e) or type(e).__name__}
+    return result
+
+job_runner.register("itinerary", _run_itinerary_job)
+
+@app.post("/jobs/itinerary", status_code=202)
+async def submit_itinerary_job_endpoint(request: ItineraryJobRequest):
+    """
+    Queues an itinerary (plus packing list and PDF) for background
+    generation and returns the job at once. Poll ``GET /jobs/{job_id}``.
+    """
+    mode = request.generation_mode or ITINERARY_GENERATION_MODE
+    if mode not in ("single", "fanout"):
+        raise HTTPException(status_code=422, detail=f"Unknown generation_mode: {mode}")
+    try:
+        job = job_runner.submit("itinerary", request.model_dump())
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=f"Server is busy: {str(e)}")
+    print(f"Queued itinerary job {job['job_id']} for: {request.destination}")
+    return {"job_id": job["job_id"], "status": job["status"], "poll_url": f"/jobs/{job['job_id']}"}
+
+@app.get("/jobs/{job_id}")
+async def get_job_endpoint(job_id: str, wait: float = 0):
+    """
+    Returns a job's status, current stage and (partial) result. With
+    ``wait`` > 0 the request long-polls: it returns as soon as the job
+    finishes, or after ``wait`` seconds (at most JOB_MAX_WAIT_SECONDS).
+    """
+    try:
+        job = await job_runner.wait(job_id, min(max(wait, 0), JOB_MAX_WAIT_SECONDS))
+    except JobNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return {key: value for key, value in job.items() if key != "payload"}
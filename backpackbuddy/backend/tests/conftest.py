@@ -0,0 +1,8 @@
+"""
+Shared pytest setup. The backend is imported as the ``backend`` package, so
+the directory above it must be importable when pytest runs from ``backend/``.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -0,0 +1,96 @@
+import asyncio
+
+import httpx
+import pytest
+
+from backend import main
+from backend.agents import repack_agent
+from backend.agents.budget_agent import analyze_budget, parse_cost
+from backend.utils.concurrency import ConcurrencyLimiter
+
+
+@pytest.mark.parametrize("note, expected", [
+    ("Entry fee: ~500 THB ($15)", (500.0, "THB")),
+    ("Cost: $10-$20", (20.0, "USD")),
+    ("10-20 EUR", (20.0, "EUR")),
+    ("$5 to $8", (8.0, "USD")),
+    ("USD 10 - USD 25", (25.0, "USD")),
+    ("Price 1,999 baht", (1999.0, "THB")),
+    ("Taxi 2000 VND", (2000.0, "VND")),
+    ("In Jan 2025 prices: 45 NOK", (45.0, "NOK")),
+    ("Free entry", (0.0, "USD")),
+    # Times, counts and line numbers are not prices when the note has one.
+    ("Opens 9:00, entry 200 THB", (200.0, "THB")),
+    ("Lunch at 12:30 ~150 THB", (150.0, "THB")),
+    ("Line 2 metro: 40 THB", (40.0, "THB")),
+    ("Entry for 2: 300 THB", (300.0, "THB")),
+    ("Top 10 views, free", (0.0, "USD")),
+    ("9am-5pm, 100 baht", (100.0, "THB")),
+    # "." separates thousands in currencies without a minor unit.
+    ("Tickets 1.500 ISK", (1500.0, "ISK")),
+    ("Street food 1.500.000 VND", (1500000.0, "VND")),
+    ("Taxi 2.50 EUR", (2.5, "EUR")),
+    ("Entry 200 THB ($6) + audio guide 100 THB", (300.0, "THB")),
+])
+def test_parse_cost(note, expected):
+    assert parse_cost(note) == expected
+
+
+@pytest.mark.parametrize("note", ["", "2 hours walk", "Day 3", "Open since 2019", "Top 10 views", None])
+def test_parse_cost_without_a_price(note):
+    assert parse_cost(note) is None
+
+
+def test_parse_cost_uses_default_currency():
+    assert parse_cost("Dinner about 12", default_currency="EUR") == (12.0, "EUR")
+
+
+def test_parse_cost_falls_back_to_parentheses():
+    assert parse_cost("Bus ticket (about $3)") == (3.0, "USD")
+
+
+def test_analyze_budget_flags_days_over_the_limit():
+    itinerary = {"itinerary": [
+        {"day": 1, "activities": [{"budget_notes": "$30"}, {"budget_notes": "$20"}]},
+        {"day": 2, "activities": [{"budget_notes": "Free"}, {"budget_notes": "see the view"}]},
+    ]}
+    report = analyze_budget(itinerary, "Strict")
+    assert report["days"] == [
+        {"day": 1, "total_usd": 50.0, "unpriced": 0},
+        {"day": 2, "total_usd": 0.0, "unpriced": 1},
+    ]
+    assert report["trip_total_usd"] == 50.0
+    assert report["over_budget_days"] == [1]
+
+
+def test_analyze_budget_ignores_opening_times():
+    day = {"activities": [{"budget_notes": "Opens 9:00, entry 200 THB"}]}
+    report = analyze_budget({"itinerary": [{"day": 1, **day}, {"day": 2, **day}]}, "Strict")
+    assert report["trip_total_usd"] == pytest.approx(2 * 200 * 0.028)
+
+
+# --- Endpoint ---
+def _rebalance(itinerary: dict) -> httpx.Response:
+    async def send():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            return await client.post("/rebalance-budget", json={"itinerary": itinerary, "budget_mode": "Strict"})
+
+    return asyncio.run(send())
+
+
+@pytest.fixture
+def busy_llm(monkeypatch):
+    # Every LLM slot is taken and nobody may queue.
+    monkeypatch.setattr(repack_agent, "llm_limiter", ConcurrencyLimiter(max_concurrency=0, max_queue=0))
+
+
+def test_rebalance_within_budget_needs_no_llm_slot(busy_llm):
+    response = _rebalance({"itinerary": [{"day": 1, "activities": [{"budget_notes": "$10"}]}]})
+    assert response.status_code == 200
+    assert response.json()["changes"] == []
+    assert response.json()["budget"]["over_budget_days"] == []
+
+
+def test_rebalance_over_budget_needs_an_llm_slot(busy_llm):
+    response = _rebalance({"itinerary": [{"day": 1, "activities": [{"budget_notes": "$100"}]}]})
+    assert response.status_code == 429
@@ -0,0 +1,177 @@
+import asyncio
+import time
+
+import pytest
+
+from backend.utils import grounding
+from backend.utils.cache import ResponseCache
+from backend.utils.grounding import DestinationGrounder, summarize_context
+
+
+def _place(name: str, rate="1", dist: float = 100.0, kinds: str = "museums,cultural") -> dict:
+    return {"name": name, "rate": rate, "dist": dist, "kinds": kinds, "point": {"lat": 38.71234, "lon": -9.13456}}
+
+
+# --- Summaries ---
+def test_summarize_context():
+    places = [
+        _place("Tram 28 stop", rate="0", dist=10),
+        _place("Jeronimos Monastery", rate="3h", dist=5000, kinds="monasteries,religion"),
+        _place("Castelo de Sao Jorge", rate="3", dist=800, kinds="fortifications"),
+        _place("castelo de sao jorge", rate="2"),
+        _place("", rate="3"),
+        {"name": "No point", "rate": "3"},
+    ]
+    results = {
+        "knowledgeGraph": {"description": "Lisbon is the capital of Portugal."},
+        "organic": [{"title": "Lisbon tips", "snippet": "Buy a  Viva Viagem\ncard."}, {"title": "No snippet"}],
+    }
+    assert summarize_context(places, results) == (
+        "Places (name @ lat,lon):\n"
+        # Highest rated first (nearest first on a tie); duplicates and unnamed places dropped.
+        "- Castelo de Sao Jorge @ 38.7123,-9.1346 (fortifications)\n"
+        "- Jeronimos Monastery @ 38.7123,-9.1346 (monasteries, religion)\n"
+        "- Tram 28 stop @ 38.7123,-9.1346 (museums, cultural)\n"
+        "Web notes:\n"
+        "- Lisbon is the capital of Portugal.\n"
+        "- Lisbon tips: Buy a Viva Viagem card."
+    )
+
+
+def test_summarize_context_without_results():
+    assert summarize_context([], {}) == ""
+    assert summarize_context([], {"answerBox": {"answer": "Sunny"}}) == "Web notes:\n- Sunny"
+
+
+def test_summarize_context_is_capped_at_whole_lines(monkeypatch):
+    monkeypatch.setattr(grounding, "GROUNDING_MAX_CHARS", 120)
+    text = summarize_context([_place(f"Place number {i}", dist=i) for i in range(10)], {})
+    assert len(text) <= 120
+    assert text.endswith("(museums, cultural)")
+
+
+# --- Grounder ---
+class FakeFetch:
+    """Stands in for DestinationGrounder.afetch; takes ``delay`` seconds."""
+
+    def __init__(self, delay: float = 0.0, summary: str = "Places: ..."):
+        self.delay = delay
+        self.summary = summary
+        self.calls = []
+
+    async def __call__(self, destination: str) -> dict:
+        self.calls.append(destination)
+        await asyncio.sleep(self.delay)
+        summary = f"{self.summary} {destination}" if self.summary else ""
+        return {"summary": summary, "fetched_at": time.time()}
+
+
+def _grounder(fetch: FakeFetch, wait_seconds: float = 1.0) -> DestinationGrounder:
+    grounder = DestinationGrounder(cache=ResponseCache(), wait_seconds=wait_seconds)
+    grounder.enabled = True
+    grounder.afetch = fetch
+    return grounder
+
+
+def test_aget_fetches_once_then_serves_the_cache():
+    fetch = FakeFetch()
+    grounder = _grounder(fetch)
+
+    async def scenario():
+        first = await asyncio.gather(grounder.aget("Lisbon"), grounder.aget(" lisbon "))
+        return first, await grounder.aget("LISBON")
+
+    (first, second), third = asyncio.run(scenario())
+    assert first == second == third == "Places: ... Lisbon"
+    assert fetch.calls == ["Lisbon"]
+    assert grounder.stats()["hits"] == 1 and grounder.stats()["misses"] == 2
+
+
+def test_aget_timeout_returns_nothing_while_the_fetch_fills_the_cache():
+    fetch = FakeFetch(delay=0.1)
+    grounder = _grounder(fetch, wait_seconds=0.02)
+
+    async def scenario():
+        started = time.perf_counter()
+        summary = await grounder.aget("Hanoi")
+        waited = time.perf_counter() - started
+        await asyncio.sleep(0.15)
+        return summary, waited
+
+    summary, waited = asyncio.run(scenario())
+    assert summary == "" and waited < 0.08
+    assert grounder.stats()["timeouts"] == 1
+    assert grounder.get_cached("Hanoi") == "Places: ... Hanoi"
+    assert fetch.calls == ["Hanoi"]
+
+
+def test_aget_without_waiting_refreshes_in_the_background():
+    grounder = _grounder(FakeFetch(), wait_seconds=0)
+
+    async def scenario():
+        summary = await grounder.aget("Hanoi")
+        await asyncio.sleep(0.01)
+        return summary
+
+    assert asyncio.run(scenario()) == ""
+    assert grounder.get_cached("Hanoi") == "Places: ... Hanoi"
+
+
+def test_aget_returns_nothing_when_the_fetch_fails():
+    async def failing(destination):
+        raise RuntimeError("Serper is down")
+
+    grounder = _grounder(FakeFetch())
+    grounder.afetch = failing
+    assert asyncio.run(grounder.aget("Hanoi")) == ""
+    assert grounder.stats()["fetch_failures"] == 1
+
+
+def test_empty_summaries_expire_sooner(monkeypatch):
+    monkeypatch.setattr(grounding, "GROUNDING_EMPTY_TTL_SECONDS", 0.01)
+    fetch = FakeFetch()
+    grounder = _grounder(fetch)
+    fetch.summary = ""
+    asyncio.run(grounder.aget("Nowhere"))
+    time.sleep(0.02)
+    asyncio.run(grounder.aget("Nowhere"))
+    assert fetch.calls == ["Nowhere", "Nowhere"]
+
+
+def test_disabled_grounder_never_fetches():
+    fetch = FakeFetch()
+    grounder = _grounder(fetch)
+    grounder.enabled = False
+    assert asyncio.run(grounder.aget("Lisbon")) == ""
+    assert fetch.calls == []
+
+
+# --- Pre-warming ---
+@pytest.fixture
+def refresh_timing(monkeypatch):
+    # Entries are refreshed when they would expire within two refresh rounds:
+    # here, once they are older than 1000 - 2 * 100 = 800 seconds.
+    monkeypatch.setattr(grounding, "GROUNDING_TTL_SECONDS", 1000)
+    monkeypatch.setattr(grounding, "GROUNDING_REFRESH_SECONDS", 100)
+
+
+def test_aprewarm_fetches_missing_and_stale_destinations(refresh_timing):
+    fetch = FakeFetch()
+    grounder = _grounder(fetch)
+    now = time.time()
+    grounder.cache.set(grounder._key("Fresh"), {"summary": "fresh", "fetched_at": now - 700})
+    grounder.cache.set(grounder._key("Stale"), {"summary": "stale", "fetched_at": now - 900})
+    asyncio.run(grounder.aprewarm(["Fresh", "Stale", "Missing"]))
+    assert sorted(fetch.calls) == ["Missing", "Stale"]
+    assert grounder.get_cached("Stale") == "Places: ... Stale"
+    assert grounder.get_cached("Fresh") == "fresh"
+    assert grounder.stats()["prewarmed"] == 2
+
+
+def test_popular_destinations(monkeypatch):
+    monkeypatch.setattr(grounding, "GROUNDING_PREWARM_DESTINATIONS", ["Kyoto, Japan"])
+    monkeypatch.setattr(grounding, "GROUNDING_PREWARM_TOP", 2)
+    grounder = _grounder(FakeFetch())
+    for destination in ["Hanoi", "Lisbon", "hanoi", "Kyoto,  japan", "Cusco", "Lisbon", "Hanoi"]:
+        grounder._record_request(destination)
+    assert grounder.popular_destinations() == ["Kyoto, Japan", "Hanoi", "Lisbon"]
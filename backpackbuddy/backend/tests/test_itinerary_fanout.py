@@ -0,0 +1,160 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable
+
+from backend import main
+from backend.agents import itinerary_agent
+from backend.agents.itinerary_agent import agenerate_itinerary_fanout
+from backend.benchmarks.fake_upstreams import fake_completion
+from backend.utils.cache import ResponseCache, itinerary_request_key
+from backend.utils.grounding import destination_grounder
+from backend.utils.trip_store import InMemoryTripStore
+
+TRIP = {"destination": "Porto", "travel_dates": "2025-03-01 to 2025-03-03",
+        "budget_mode": "Standard", "preferences": "food"}
+ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+class FakeLLM(Runnable):
+    """Answers like the fake upstream model; fails the day calls in ``fail_days``."""
+
+    def __init__(self, fail_days=(), outline: str = None):
+        self.fail_days = set(fail_days)
+        self.outline = outline
+        self.day_calls = []
+
+    def invoke(self, input, config=None, **kwargs):
+        messages = [{"role": ROLES[m.type], "content": m.content} for m in input.to_messages()]
+        user = messages[-1]["content"]
+        if "trip outline" in user and self.outline is not None:
+            return AIMessage(content=self.outline)
+        for number in range(1, 10):
+            if f"**This day:** Day {number}," in user:
+                self.day_calls.append(number)
+                if number in self.fail_days:
+                    raise RuntimeError(f"day {number} timed out")
+        return AIMessage(content=fake_completion(messages, default_days=3))
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return self.invoke(input, config, **kwargs)
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    async def no_grounding(destination):
+        return ""
+
+    def install(**kwargs):
+        llm = FakeLLM(**kwargs)
+        monkeypatch.setattr(itinerary_agent, "get_groq_llm", lambda: llm)
+        return llm
+
+    monkeypatch.setattr(destination_grounder, "aget", no_grounding)
+    return install
+
+
+def _fanout(**trip) -> dict:
+    return asyncio.run(agenerate_itinerary_fanout(**{**TRIP, **trip}))
+
+
+# --- Agent ---
+def test_fanout_generates_each_skeleton_day(fake_llm):
+    llm = fake_llm()
+    result = _fanout()
+    assert sorted(llm.day_calls) == [1, 2, 3]
+    days = result["itinerary"]
+    assert [day["day"] for day in days] == [1, 2, 3]
+    assert [day["date"] for day in days] == ["2025-03-01", "2025-03-02", "2025-03-03"]
+    assert all(day["activities"] for day in days)
+    assert "partial" not in result
+
+
+def test_fanout_takes_day_fields_from_the_skeleton(fake_llm):
+    outline = json.dumps({"days": [
+        {"day": 1, "date": "2025-03-01", "theme": "Riverside", "area": "Ribeira"},
+        {"day": 2, "date": "2025-03-02", "theme": "Port cellars", "area": "Gaia"},
+    ]})
+    fake_llm(outline="Outline:\n```json\n" + outline + "\n```")
+    days = _fanout()["itinerary"]
+    assert [(day["day"], day["theme"]) for day in days] == [(1, "Riverside"), (2, "Port cellars")]
+
+
+def test_fanout_marks_the_trip_partial_when_some_days_fail(fake_llm):
+    fake_llm(fail_days={2})
+    result = _fanout()
+    assert result["partial"] is True
+    assert result["failed_days"] == [2]
+    days = {day["day"]: day for day in result["itinerary"]}
+    assert sorted(days) == [1, 2, 3]
+    assert days[2]["activities"] == []
+    assert days[1]["activities"] and days[3]["activities"]
+
+
+def test_fanout_returns_an_error_when_every_day_fails(fake_llm):
+    fake_llm(fail_days={1, 2, 3})
+    result = _fanout()
+    assert "itinerary" not in result
+    assert "day 1 timed out" in result["error"]
+
+
+def test_fanout_returns_an_error_for_an_unparseable_skeleton(fake_llm):
+    llm = fake_llm(outline="Sorry, I can't help with that.")
+    result = _fanout()
+    assert "error" in result
+    assert llm.day_calls == []
+
+
+# --- Endpoint ---
+@pytest.fixture
+def fresh_stores(monkeypatch):
+    cache, store = ResponseCache(), InMemoryTripStore()
+    monkeypatch.setattr(main, "itinerary_cache", cache)
+    monkeypatch.setattr(main, "trip_store", store)
+    return cache, store
+
+
+def _generate(**overrides) -> dict:
+    async def send():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            response = await client.post("/generate-itinerary", json={**TRIP, **overrides})
+            response.raise_for_status()
+            return response.json()
+
+    return asyncio.run(send())
+
+
+def _key(mode: str) -> str:
+    return itinerary_request_key(TRIP["destination"], TRIP["travel_dates"], TRIP["budget_mode"],
+                                 TRIP["preferences"], mode)
+
+
+def test_complete_fanout_trip_is_cached_and_saved(fake_llm, fresh_stores):
+    cache, store = fresh_stores
+    fake_llm()
+    result = _generate(generation_mode="fanout")
+    assert "partial" not in result
+    assert store.get(result["trip_id"])["version"] == 1
+    assert cache.get(_key("fanout")) is not None
+
+
+def test_partial_fanout_trip_is_neither_cached_nor_saved(fake_llm, fresh_stores):
+    cache, store = fresh_stores
+    fake_llm(fail_days={3})
+    result = _generate(generation_mode="fanout")
+    assert result["partial"] is True
+    assert result["failed_days"] == [3]
+    assert "trip_id" not in result
+    assert cache.get(_key("fanout")) is None
+    assert not store._trips
+
+
+def test_generation_modes_are_cached_separately(fake_llm, fresh_stores):
+    cache, _ = fresh_stores
+    fake_llm()
+    _generate(generation_mode="fanout")
+    assert _key("fanout") != _key("single")
+    assert cache.get(_key("single")) is None
@@ -0,0 +1,201 @@
+import asyncio
+import time
+
+import pytest
+
+from backend.utils import job_queue
+from backend.utils.concurrency import QueueFullError
+from backend.utils.job_queue import (
+    FAILED, QUEUED, RUNNING, SUCCEEDED, InMemoryJobStore, JobNotFoundError, JobRunner, SQLiteJobStore
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteJobStore(str(tmp_path / "jobs.db"))
+    return InMemoryJobStore()
+
+
+# --- Stores ---
+def test_store_lifecycle(store):
+    job = store.create("trip", {"destination": "Lisbon"})
+    assert job["status"] == QUEUED
+    assert store.queued() == [job["job_id"]]
+
+    claimed = store.claim(job["job_id"])
+    assert claimed["status"] == RUNNING
+    assert store.claim(job["job_id"]) is None
+    assert store.queued() == []
+
+    store.update(job["job_id"], status=SUCCEEDED, result={"days": 3})
+    loaded = store.get(job["job_id"])
+    assert (loaded["status"], loaded["result"], loaded["payload"]) == (SUCCEEDED, {"days": 3}, {"destination": "Lisbon"})
+
+
+def test_store_unknown_job(store):
+    with pytest.raises(JobNotFoundError):
+        store.get("missing")
+    with pytest.raises(JobNotFoundError):
+        store.update("missing", status=FAILED)
+
+
+def test_store_requeues_only_stale_running_jobs(store):
+    stale, fresh, done = (store.create("trip", {}) for _ in range(3))
+    store.claim(stale["job_id"])
+    store.update(stale["job_id"], stage="outline")
+    time.sleep(0.01)
+    cutoff = time.time()
+    for job in (fresh, done):
+        store.claim(job["job_id"])
+    store.update(done["job_id"], status=SUCCEEDED)
+
+    assert store.requeue_running(updated_before=cutoff) == [stale["job_id"]]
+    assert store.get(stale["job_id"])["status"] == QUEUED
+    assert store.get(stale["job_id"])["stage"] is None
+    assert store.get(fresh["job_id"])["status"] == RUNNING
+    assert store.get(done["job_id"])["status"] == SUCCEEDED
+
+
+def test_memory_store_drops_the_oldest_finished_jobs():
+    store = InMemoryJobStore(max_jobs=2)
+    first = store.create("trip", {})
+    store.update(first["job_id"], status=SUCCEEDED)
+    store.create("trip", {})
+    store.create("trip", {})
+    with pytest.raises(JobNotFoundError):
+        store.get(first["job_id"])
+
+
+# --- Runner ---
+def test_runner_records_progress_and_result(store):
+    async def handler(job, progress):
+        progress("outline", outline=["day 1"])
+        return {"itinerary": {"days": 1}}
+
+    async def main():
+        runner = JobRunner(store, workers=1)
+        runner.register("trip", handler)
+        job = runner.submit("trip", {})
+        finished = await runner.wait(job["job_id"], timeout=2)
+        await runner.aclose()
+        return finished, runner.stats()
+
+    finished, stats = asyncio.run(main())
+    assert finished["status"] == SUCCEEDED
+    assert finished["result"] == {"outline": ["day 1"], "itinerary": {"days": 1}}
+    assert stats["completed"] == 1
+
+
+def test_runner_fails_a_job_whose_handler_raises(store):
+    async def handler(job, progress):
+        raise RuntimeError("no days")
+
+    async def main():
+        runner = JobRunner(store, workers=1)
+        runner.register("trip", handler)
+        job = runner.submit("trip", {})
+        finished = await runner.wait(job["job_id"], timeout=2)
+        await runner.aclose()
+        return finished
+
+    finished = asyncio.run(main())
+    assert (finished["status"], finished["error"]) == (FAILED, "no days")
+
+
+def test_runner_rejects_unknown_kinds_and_a_full_queue(store):
+    async def main():
+        runner = JobRunner(store, workers=0, max_pending=1)
+        runner.register("trip", None)
+        with pytest.raises(ValueError):
+            runner.submit("flight", {})
+        runner.submit("trip", {})
+        with pytest.raises(QueueFullError):
+            runner.submit("trip", {})
+        await runner.aclose()
+
+    asyncio.run(main())
+
+
+def test_shutdown_puts_a_running_job_back_in_the_queue(store):
+    async def main():
+        started = asyncio.Event()
+
+        async def slow(job, progress):
+            progress("outline")
+            started.set()
+            await asyncio.sleep(30)
+
+        runner = JobRunner(store, workers=1)
+        runner.register("trip", slow)
+        job = runner.submit("trip", {})
+        await started.wait()
+        await runner.aclose()
+        return job["job_id"]
+
+    job_id = asyncio.run(main())
+    assert store.get(job_id)["status"] == QUEUED
+    assert store.queued() == [job_id]
+
+
+def test_start_recovers_jobs_left_running_by_a_crash(store):
+    job = store.create("trip", {})
+    store.claim(job["job_id"])
+
+    async def handler(job, progress):
+        return {"ok": True}
+
+    async def main():
+        runner = JobRunner(store, workers=1)
+        runner.register("trip", handler)
+        runner.start()
+        finished = await runner.wait(job["job_id"], timeout=2)
+        await runner.aclose()
+        return finished, runner.stats()
+
+    finished, stats = asyncio.run(main())
+    assert finished["status"] == SUCCEEDED
+    assert stats["recovered"] == 1
+
+
+def test_busy_retries_are_capped(store, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_BUSY_RETRY_SECONDS", 0.01)
+    monkeypatch.setattr(job_queue, "JOB_BUSY_MAX_RETRIES", 3)
+    calls = []
+
+    async def busy(job, progress):
+        calls.append(job["job_id"])
+        raise QueueFullError("LLM limiter is full")
+
+    async def main():
+        runner = JobRunner(store, workers=1)
+        runner.register("trip", busy)
+        job = runner.submit("trip", {})
+        finished = await runner.wait(job["job_id"], timeout=2)
+        await runner.aclose()
+        return finished
+
+    finished = asyncio.run(main())
+    assert finished["status"] == FAILED
+    assert len(calls) == 4
+
+
+def test_a_busy_job_succeeds_once_the_limiter_frees_up(store, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_BUSY_RETRY_SECONDS", 0.01)
+    attempts = []
+
+    async def flaky(job, progress):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise QueueFullError("LLM limiter is full")
+        return {"ok": True}
+
+    async def main():
+        runner = JobRunner(store, workers=1)
+        runner.register("trip", flaky)
+        job = runner.submit("trip", {})
+        finished = await runner.wait(job["job_id"], timeout=2)
+        await runner.aclose()
+        return finished
+
+    assert asyncio.run(main())["status"] == SUCCEEDED
@@ -0,0 +1,164 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable
+
+from backend.utils import llm_router
+from backend.utils.concurrency import QueueFullError
+from backend.utils.llm_router import CircuitBreaker, LLMRoute, LLMRouter, LLMUnavailableError
+from backend.utils.rate_limit import LLMScheduler
+from backend.utils.scheduled_llm import ScheduledLLM
+
+
+class FakeLLM(Runnable):
+    """Answers after ``delay`` seconds with ``content``, or raises ``error``."""
+
+    def __init__(self, content: str = "ok", delay: float = 0.0, error: Exception = None):
+        self.content = content
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+
+    def invoke(self, input, config=None, **kwargs):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return AIMessage(content=self.content)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        return AIMessage(content=self.content)
+
+
+def _route(name: str, llm) -> LLMRoute:
+    return LLMRoute(name, lambda: llm)
+
+
+@pytest.fixture
+def fast_hedging(monkeypatch):
+    # Hedge after 50ms instead of waiting for latency samples.
+    monkeypatch.setattr(llm_router, "LLM_HEDGE_INITIAL_DELAY", 0.05)
+
+
+# --- Circuit breaker ---
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failures=3, reset_seconds=60)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failures=2, reset_seconds=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_lets_one_probe_through_when_half_open():
+    breaker = CircuitBreaker(failures=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_reopens_when_the_probe_fails():
+    breaker = CircuitBreaker(failures=5, reset_seconds=0)
+    for _ in range(5):
+        breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+# --- Fallback ---
+def test_invoke_falls_back_to_the_next_route():
+    broken, backup = FakeLLM(error=RuntimeError("down")), FakeLLM("from backup")
+    router = LLMRouter([_route("a", broken), _route("b", backup)], hedging=False)
+    assert router.invoke("hi").content == "from backup"
+    assert router.routes[0].breaker.failures == 1
+
+
+def test_ainvoke_falls_back_on_an_empty_response():
+    router = LLMRouter([_route("a", FakeLLM("  ")), _route("b", FakeLLM("fine"))], hedging=False)
+    assert asyncio.run(router.ainvoke("hi")).content == "fine"
+
+
+def test_rate_limit_rejections_do_not_trip_the_breaker():
+    router = LLMRouter([_route("a", FakeLLM(error=QueueFullError("busy"))), _route("b", FakeLLM())], hedging=False)
+    for _ in range(10):
+        asyncio.run(router.ainvoke("hi"))
+    assert router.routes[0].breaker.state == CircuitBreaker.CLOSED
+    assert router.routes[0].breaker.failures == 0
+
+
+def test_open_routes_are_skipped():
+    broken, backup = FakeLLM(error=RuntimeError("down")), FakeLLM()
+    router = LLMRouter([_route("a", broken), _route("b", backup)], hedging=False)
+    router.routes[0].breaker = CircuitBreaker(failures=2, reset_seconds=60)
+    for _ in range(5):
+        asyncio.run(router.ainvoke("hi"))
+    assert broken.calls == 2
+
+
+def test_every_route_open_raises_unavailable():
+    router = LLMRouter([_route("a", FakeLLM())], hedging=False)
+    router.routes[0].breaker = CircuitBreaker(failures=1, reset_seconds=60)
+    router.routes[0].breaker.record_failure()
+    with pytest.raises(LLMUnavailableError):
+        asyncio.run(router.ainvoke("hi"))
+
+
+# --- Hedging ---
+def test_slow_primary_is_hedged_to_the_next_route(fast_hedging):
+    slow, fast = FakeLLM("slow", delay=2), FakeLLM("fast")
+    router = LLMRouter([_route("a", slow), _route("b", fast)])
+    assert asyncio.run(router.ainvoke("hi")).content == "fast"
+    assert (router.hedges, router.hedge_wins) == (1, 1)
+    # The losing call is cancelled, not left running.
+    assert slow.cancelled == 1
+
+
+def test_fast_primary_is_not_hedged(fast_hedging):
+    router = LLMRouter([_route("a", FakeLLM("quick")), _route("b", FakeLLM())])
+    assert asyncio.run(router.ainvoke("hi")).content == "quick"
+    assert router.hedges == 0
+
+
+def test_no_hedge_to_a_route_sharing_the_rate_budget(fast_hedging):
+    scheduler = LLMScheduler(rpm=600, tpm=0)
+    slow = ScheduledLLM(FakeLLM("slow", delay=0.3), scheduler, name="a")
+    other = ScheduledLLM(FakeLLM("other"), scheduler, name="a-endpoint-2")
+    router = LLMRouter([_route("a", slow), _route("b", other)])
+    assert asyncio.run(router.ainvoke("hi")).content == "slow"
+    assert router.hedges == 0
+
+
+def test_hedge_clock_starts_after_the_rate_scheduler(fast_hedging):
+    scheduler = LLMScheduler(rpm=60, tpm=0, headroom=1.0)
+    for _ in range(60):
+        scheduler.reserve(0)
+    # The primary waits ~1s for budget, then answers at once.
+    primary = ScheduledLLM(FakeLLM("primary"), scheduler, name="a")
+    router = LLMRouter([_route("a", primary), _route("b", FakeLLM("hedge"))])
+    assert asyncio.run(router.ainvoke("hi")).content == "primary"
+    assert router.hedges == 0
+    # Only the time after the call was sent counts as its latency.
+    assert router.routes[0].latencies["invoke"][0] < 0.5
@@ -0,0 +1,171 @@
+import asyncio
+
+import httpx
+import numpy as np
+import pytest
+
+from backend.utils import maps
+from backend.utils.cache import ResponseCache
+
+
+def _activity(lon: float, lat: float, time: str = None) -> dict:
+    return {"time": time, "description": f"Visit {lon},{lat}", "location": {"name": f"{lon},{lat}", "lat": lat, "lon": lon}}
+
+
+# --- OSRM day legs ---
+class FakeOSRM:
+    """Answers table requests with durations of 5 minutes and 1 km per index step."""
+
+    def __init__(self, error: Exception = None, code: str = "Ok"):
+        self.error = error
+        self.code = code
+        self.urls = []
+
+    def get_json(self, upstream: str, url: str, params: dict = None):
+        assert upstream == "osrm" and params == {"annotations": "duration,distance"}
+        self.urls.append(url)
+        if self.error is not None:
+            raise self.error
+        n = len(url.rsplit("/", 1)[1].split(";"))
+        return {"code": self.code, "message": "Too many coordinates",
+                "durations": [[300.0 * abs(i - j) for j in range(n)] for i in range(n)],
+                "distances": [[1000.0 * abs(i - j) for j in range(n)] for i in range(n)]}
+
+    async def aget_json(self, upstream: str, url: str, params: dict = None):
+        return self.get_json(upstream, url, params)
+
+
+@pytest.fixture
+def osrm(monkeypatch):
+    fake = FakeOSRM()
+    monkeypatch.setattr(maps, "http_client", fake)
+    monkeypatch.setattr(maps, "_leg_cache", ResponseCache(max_entries=100))
+    return fake
+
+
+def _itinerary() -> dict:
+    return {"itinerary": [
+        {"day": 1, "activities": [_activity(-9.14, 38.71), {"description": "Lunch"}, _activity(-9.15, 38.72),
+                                  _activity(-9.16, 38.69)]},
+        {"day": 2, "activities": [_activity(-8.61, 41.14), _activity(-8.62, 41.15)]},
+    ]}
+
+
+def test_each_day_is_routed_with_one_table_request(osrm):
+    itinerary = maps.attach_travel_legs(_itinerary())
+    assert len(osrm.urls) == 2
+    assert osrm.urls[0].endswith("/table/v1/driving/-9.14,38.71;-9.15,38.72;-9.16,38.69")
+    first_day = itinerary["itinerary"][0]["activities"]
+    assert "travel_from_previous" not in first_day[0] and "travel_from_previous" not in first_day[1]
+    assert first_day[2]["travel_from_previous"] == {"duration_min": 5.0, "distance_km": 1.0, "source": "osrm"}
+    assert first_day[3]["travel_from_previous"]["duration_min"] == 5.0
+
+
+def test_routed_legs_are_served_from_the_cache(osrm):
+    maps.attach_travel_legs(_itinerary())
+    maps.attach_travel_legs(_itinerary())
+    assert len(osrm.urls) == 2
+    # Every pair of the matrix was stored, so the reversed day needs no request either.
+    assert [leg["source"] for leg in maps.get_day_legs([(-9.16, 38.69), (-9.14, 38.71)])] == ["osrm"]
+    assert len(osrm.urls) == 2
+
+
+def test_async_days_are_routed_with_one_table_request_each(osrm):
+    itinerary = asyncio.run(maps.aattach_travel_legs(_itinerary()))
+    assert len(osrm.urls) == 2
+    assert itinerary["itinerary"][1]["activities"][1]["travel_from_previous"]["source"] == "osrm"
+
+
+def test_a_day_with_one_place_needs_no_request(osrm):
+    assert maps.get_day_legs([(-9.14, 38.71)]) == []
+    assert osrm.urls == []
+
+
+@pytest.mark.parametrize("fake", [FakeOSRM(error=httpx.ConnectError("refused")), FakeOSRM(code="TooBig")],
+                         ids=["unreachable", "error-code"])
+def test_osrm_failures_leave_the_day_without_legs(osrm, monkeypatch, fake):
+    monkeypatch.setattr(maps, "http_client", fake)
+    itinerary = maps.attach_travel_legs(_itinerary())
+    assert all("travel_from_previous" not in a for day in itinerary["itinerary"] for a in day["activities"])
+    assert asyncio.run(maps.aget_day_legs([(-9.14, 38.71), (-9.15, 38.72)])) == []
+
+
+# --- Offline geo engine ---
+def test_haversine_matrix():
+    dist = maps.haversine_matrix([(2.3522, 48.8566), (-0.1278, 51.5074), (0.0, 0.0), (1.0, 0.0)])
+    assert dist.shape == (4, 4)
+    assert (dist.diagonal() == 0).all()
+    assert (dist == dist.T).all()
+    assert dist[0, 1] == pytest.approx(343.5, abs=0.5)  # Paris - London
+    assert dist[2, 3] == pytest.approx(111.2, abs=0.1)  # one degree along the equator
+
+
+def _line(*lons) -> list:
+    return [(lon, 0.0) for lon in lons]
+
+
+def test_two_opt_uncrosses_a_path():
+    dist = maps.haversine_matrix(_line(0, 1, 2, 3, 4))
+    assert maps._two_opt([0, 3, 2, 1, 4], dist) == [0, 1, 2, 3, 4]
+
+
+def test_shortest_visit_order_finds_the_straight_path():
+    dist = maps.haversine_matrix(_line(0.3, 0.0, 0.4, 0.1, 0.2))
+    order = maps.shortest_visit_order(dist)
+    assert order in ([1, 3, 4, 0, 2], [2, 0, 4, 3, 1])
+
+
+def test_shortest_visit_order_is_no_longer_than_any_nearest_neighbour_path():
+    rng = np.random.default_rng(7)
+    dist = maps.haversine_matrix(rng.uniform(0, 0.1, size=(9, 2)))
+    order = maps.shortest_visit_order(dist)
+    assert sorted(order) == list(range(9))
+    best_greedy = min(maps._path_length(maps._nearest_neighbour(s, dist), dist) for s in range(9))
+    assert maps._path_length(order, dist) <= best_greedy + 1e-9
+
+
+def _zigzag_day() -> dict:
+    activities = [_activity(lon, 0.0, f"{hour:02d}:00") for lon, hour in ((0.0, 9), (0.2, 11), (0.01, 13))]
+    activities.insert(2, {"time": "12:00", "description": "Lunch"})
+    activities.extend(_activity(lon, 0.0, f"{hour:02d}:00") for lon, hour in ((0.21, 15), (0.02, 17)))
+    return {"day": 1, "activities": activities}
+
+
+def test_optimize_day_route_reorders_activities_into_the_same_time_slots():
+    day = maps.optimize_day_route(_zigzag_day())
+    activities = day["activities"]
+    assert [a.get("location", {}).get("lon") for a in activities] == [0.0, 0.01, None, 0.02, 0.2, 0.21]
+    assert [a["time"] for a in activities] == ["09:00", "11:00", "12:00", "13:00", "15:00", "17:00"]
+    assert "travel_from_previous" not in activities[0] and "travel_from_previous" not in activities[2]
+    assert activities[1]["travel_from_previous"]["source"] == "estimate"
+    summary = day["route_summary"]
+    assert summary["reordered"] is True
+    assert summary["unrealistic"] is False
+    assert summary["total_distance_km"] == pytest.approx(0.21 * 111.2 * maps.GEO_DETOUR_FACTOR, rel=0.01)
+
+
+@pytest.mark.parametrize("lons, reordered", [
+    ((0.0, 0.02, 0.01, 0.03), True),   # 0.05 -> 0.03 degrees: saves 40%
+    ((0.0, 0.1, 0.095, 0.2), False),   # 0.21 -> 0.20 degrees: saves 5%
+])
+def test_optimize_day_route_reorders_only_for_a_large_enough_saving(lons, reordered):
+    day = maps.optimize_day_route({"day": 1, "activities": [_activity(lon, 0.0) for lon in lons]})
+    assert day["route_summary"]["reordered"] is reordered
+    if not reordered:
+        assert [a["location"]["lon"] for a in day["activities"]] == list(lons)
+
+
+def test_optimize_day_route_flags_unrealistic_days():
+    day = maps.optimize_day_route({"day": 1, "activities": [_activity(0.0, 0.0), _activity(1.0, 0.0)]})
+    assert day["route_summary"]["unrealistic"] is True
+    assert day["activities"][1]["travel_from_previous"]["distance_km"] == pytest.approx(111.2 * 1.3, abs=0.5)
+
+
+def test_optimize_itinerary_routes_slices_the_trip_matrix_per_day():
+    itinerary = {"itinerary": [_zigzag_day(), {"day": 2, "activities": [_activity(10.0, 50.0), _activity(10.01, 50.0)]},
+                               {"day": 3, "activities": []}]}
+    maps.optimize_itinerary_routes(itinerary)
+    one_by_one = maps.optimize_day_route(_zigzag_day())
+    assert itinerary["itinerary"][0] == one_by_one
+    assert itinerary["itinerary"][1]["route_summary"]["total_distance_km"] < 1.0
+    assert itinerary["itinerary"][2]["route_summary"]["total_distance_km"] == 0.0
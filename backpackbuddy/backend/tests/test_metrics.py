@@ -0,0 +1,169 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from backend import main
+from backend.utils.metrics import (
+    STAGE_ERRORS, STAGE_SECONDS, Counter, Histogram, MetricsMiddleware, MetricsRegistry, timed
+)
+
+
+def _stage(name: str) -> tuple:
+    """Returns (observations, total seconds, errors) recorded for a stage."""
+    counts, total, count = STAGE_SECONDS._series.get((name,), ([], 0.0, 0))
+    return count, total, STAGE_ERRORS._values.get((name,), 0)
+
+
+# --- Prometheus text ---
+def test_counter_render():
+    counter = Counter("requests_total", "Requests served.", ("route", "status"))
+    counter.inc(route="/trips", status=200)
+    counter.inc(2, route="/trips", status=200)
+    counter.inc(0.5, route='/say "hi"\n', status=500)
+    assert counter.render() == [
+        "# HELP requests_total Requests served.",
+        "# TYPE requests_total counter",
+        'requests_total{route="/say \\"hi\\"\\n",status="500"} 0.5',
+        'requests_total{route="/trips",status="200"} 3',
+    ]
+
+
+def test_histogram_render_is_cumulative():
+    histogram = Histogram("call_seconds", "Call duration.", ("model",), buckets=(1.0, 0.1, 0.5))
+    for value in (0.05, 0.1, 0.3, 2.0):
+        histogram.observe(value, model="a")
+    assert histogram.render() == [
+        "# HELP call_seconds Call duration.",
+        "# TYPE call_seconds histogram",
+        # A value on a bound counts in that bucket (le is "less or equal").
+        'call_seconds_bucket{model="a",le="0.1"} 2',
+        'call_seconds_bucket{model="a",le="0.5"} 3',
+        'call_seconds_bucket{model="a",le="1"} 3',
+        'call_seconds_bucket{model="a",le="+Inf"} 4',
+        'call_seconds_sum{model="a"} 2.45',
+        'call_seconds_count{model="a"} 4',
+    ]
+
+
+def test_histogram_without_labels():
+    histogram = Histogram("render_seconds", "Render time.", buckets=(1.0,))
+    histogram.observe(3)
+    assert histogram.render()[2:] == ['render_seconds_bucket{le="1"} 0', 'render_seconds_bucket{le="+Inf"} 1',
+                                      "render_seconds_sum 3", "render_seconds_count 1"]
+
+
+def test_registry_renders_metrics_and_collectors():
+    registry = MetricsRegistry()
+    registry.counter("jobs_total", "Jobs.").inc()
+    registry.register_collector(lambda: [("queue_depth", "gauge", "Jobs waiting.",
+                                          [({"queue": "llm"}, 3), ({"queue": "pdf"}, None)])])
+    registry.register_collector(lambda: 1 / 0)
+    assert registry.render() == (
+        "# HELP jobs_total Jobs.\n# TYPE jobs_total counter\njobs_total 1\n"
+        "# HELP queue_depth Jobs waiting.\n# TYPE queue_depth gauge\nqueue_depth{queue=\"llm\"} 3\n"
+    )
+
+
+def test_metrics_endpoint():
+    async def get():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            return await client.get("/metrics")
+
+    response = asyncio.run(get())
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE backpackbuddy_stage_seconds histogram" in response.text
+
+
+# --- timed ---
+def test_timed_function_and_context_manager():
+    @timed("test_sync")
+    def work(fail: bool = False):
+        if fail:
+            raise ValueError("bad input")
+        return "done"
+
+    assert work() == "done"
+    with pytest.raises(ValueError):
+        work(fail=True)
+    with timed("test_sync"):
+        pass
+    assert _stage("test_sync")[0] == 3
+    assert _stage("test_sync")[2] == 1
+
+
+def test_timed_coroutine():
+    @timed("test_coroutine")
+    async def work():
+        await asyncio.sleep(0.02)
+        return 42
+
+    assert asyncio.run(work()) == 42
+    count, total, errors = _stage("test_coroutine")
+    assert count == 1 and total >= 0.02 and errors == 0
+
+
+def test_timed_async_generator_covers_the_whole_iteration():
+    @timed("test_agen")
+    async def days():
+        for day in range(3):
+            await asyncio.sleep(0.01)
+            yield day
+
+    async def consume():
+        return [day async for day in days()]
+
+    assert asyncio.run(consume()) == [0, 1, 2]
+    count, total, errors = _stage("test_agen")
+    # One observation for the whole stream, not one per item.
+    assert count == 1 and total >= 0.03 and errors == 0
+
+
+def test_timed_async_generator_errors_and_early_close():
+    @timed("test_agen_errors")
+    async def days(fail: bool):
+        yield 1
+        if fail:
+            raise RuntimeError("stream cut off")
+        yield 2
+
+    async def consume():
+        with pytest.raises(RuntimeError):
+            async for _ in days(fail=True):
+                pass
+        # A client that stops reading closes the generator: not an error.
+        stream = days(fail=False)
+        assert await stream.__anext__() == 1
+        await stream.aclose()
+
+    asyncio.run(consume())
+    count, _, errors = _stage("test_agen_errors")
+    assert count == 2 and errors == 1
+
+
+# --- Middleware ---
+def test_middleware_traces_stages_and_echoes_the_request_id(capsys):
+    app = FastAPI()
+
+    @app.get("/work")
+    async def work():
+        with timed("test_traced"):
+            await asyncio.sleep(0.01)
+        return {"ok": True}
+
+    async def get(headers: dict):
+        transport = httpx.ASGITransport(app=MetricsMiddleware(app, trace_requests=True))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/work", headers=headers)
+
+    response = asyncio.run(get({"X-Request-ID": "abc123"}))
+    assert response.headers["x-request-id"] == "abc123"
+    trace = json.loads(capsys.readouterr().out.strip().split("trace ", 1)[1])
+    assert trace["request_id"] == "abc123" and trace["path"] == "/work" and trace["status"] == 200
+    assert [stage["stage"] for stage in trace["stages"]] == ["test_traced"]
+    assert trace["stages"][0]["ms"] >= 10
+
+    assert len(asyncio.run(get({})).headers["x-request-id"]) == 16
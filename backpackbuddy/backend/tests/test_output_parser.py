@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable
+
+from backend.utils.output_parser import (
+    DAY_SCHEMA, ITINERARY_SCHEMA, OutputParseError, aparse_and_repair, parse_and_repair, parse_output
+)
+
+
+class FakeLLM(Runnable):
+    """Answers repair prompts with canned responses and records the prompts."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.prompts = []
+
+    def invoke(self, input, config=None, **kwargs):
+        self.prompts.append(input.to_string())
+        return AIMessage(content=self.responses.pop(0))
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return self.invoke(input, config, **kwargs)
+
+
+def _day(number: int) -> dict:
+    return {"day": number, "date": f"2025-03-0{number}", "theme": "Old town",
+            "activities": [{"time": "09:00", "description": "Walk", "location": {"name": "Square", "lat": 1, "lon": 2}}]}
+
+def _days(parsed_or_data) -> list:
+    return [day["day"] for day in parsed_or_data["itinerary"]]
+
+
+def test_parse_output_accepts_a_clean_response():
+    parsed = parse_output(json.dumps({"itinerary": [_day(1), _day(2)]}), ITINERARY_SCHEMA)
+    assert parsed.ok
+    assert _days(parsed.data) == [1, 2]
+
+
+def test_parse_output_fixes_fences_and_trailing_commas_locally():
+    content = "Here you go:\n```json\n" + json.dumps({"itinerary": [_day(1)]})[:-2] + ",],}\n```"
+    parsed = parse_output(content, ITINERARY_SCHEMA)
+    assert parsed.ok
+    assert _days(parsed.data) == [1]
+
+
+def test_parse_output_keeps_complete_days_of_a_truncated_response():
+    content = json.dumps({"itinerary": [_day(1), _day(2), _day(3)]})
+    parsed = parse_output(content[:content.rindex('"Walk"')], ITINERARY_SCHEMA)
+    assert _days(parsed.data) == [1, 2]
+    assert [e.path for e in parsed.errors] == [("itinerary", 2)]
+
+
+def test_parse_output_reports_the_malformed_day():
+    bad = {"day": 2, "theme": "No activities"}
+    parsed = parse_output(json.dumps({"itinerary": [_day(1), bad, _day(3)]}), ITINERARY_SCHEMA)
+    assert _days(parsed.data) == [1, 3]
+    assert [e.path for e in parsed.errors] == [("itinerary", 1)]
+    assert "activities" in parsed.errors[0].message
+
+
+def test_parse_output_without_json():
+    parsed = parse_output("Sorry, I can't help with that.", ITINERARY_SCHEMA)
+    assert parsed.root_error is not None
+
+
+def test_aparse_and_repair_reprompts_only_the_bad_fragment():
+    content = json.dumps({"itinerary": [_day(1), {"day": 2, "theme": "No activities"}, _day(3)]})
+    llm = FakeLLM(json.dumps({"value": _day(2)}))
+    data = asyncio.run(aparse_and_repair(content, ITINERARY_SCHEMA, llm, "A trip to Lisbon"))
+    assert _days(data) == [1, 2, 3]
+    assert len(llm.prompts) == 1
+    assert "itinerary.1" in llm.prompts[0] and "No activities" in llm.prompts[0]
+
+
+def test_aparse_and_repair_drops_unrepairable_days():
+    # A day that is still invalid after the repair is dropped silently; the
+    # rest of the trip is returned.
+    content = json.dumps({"itinerary": [_day(1), {"day": 2}, _day(3)]})
+    llm = FakeLLM("still not JSON")
+    data = asyncio.run(aparse_and_repair(content, ITINERARY_SCHEMA, llm))
+    assert _days(data) == [1, 3]
+
+
+def test_aparse_and_repair_fails_when_no_day_survives():
+    content = json.dumps({"itinerary": [{"day": 1}]})
+    with pytest.raises(OutputParseError):
+        asyncio.run(aparse_and_repair(content, ITINERARY_SCHEMA, FakeLLM("{}")))
+
+
+def test_aparse_and_repair_does_not_reprompt_a_whole_itinerary():
+    with pytest.raises(OutputParseError):
+        asyncio.run(aparse_and_repair("no JSON here", ITINERARY_SCHEMA, FakeLLM()))
+
+
+def test_parse_and_repair_repairs_a_field_of_a_single_day():
+    llm = FakeLLM(json.dumps({"value": _day(4)["activities"]}))
+    data = parse_and_repair('{"day": 4, "activities": "see the sights"}', DAY_SCHEMA, llm)
+    assert data["day"] == 4
+    assert data["activities"][0]["description"] == "Walk"
+    assert "activities" in llm.prompts[0]
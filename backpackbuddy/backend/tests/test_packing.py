@@ -0,0 +1,184 @@
+import asyncio
+
+import pytest
+
+from backend.agents import packing_engine as engine_module
+from backend.agents.packing_engine import PackingListEngine
+from backend.agents.packing_rules import (
+    build_rule_packing_list, climate_zone, destination_region, extract_trip_features, length_bucket,
+    packing_feature_key, trip_season
+)
+from backend.utils.cache import ResponseCache
+
+
+def _trip(destination: str, start_day: int = 1, days: int = 5, month: int = 7, lat: float = 38.7,
+          activities=("Hike to the waterfall", "Evening at a rooftop bar")) -> dict:
+    return {
+        "destination": destination,
+        "itinerary": [
+            {"day": i + 1, "date": f"2025-{month:02d}-{start_day + i:02d}", "theme": "Explore",
+             "activities": [{"description": text, "location": {"name": f"Place {i}.{j}", "lat": lat, "lon": -9.1}}
+                            for j, text in enumerate(activities)]}
+            for i in range(days)
+        ],
+    }
+
+
+# --- Features ---
+def test_extract_trip_features():
+    features = extract_trip_features(_trip("Lisbon, Portugal", days=3))
+    assert features["destination"] == "Lisbon, Portugal"
+    assert features["months"] == ["July"]
+    assert features["days"] == 3
+    assert features["categories"] == ["hiking", "nightlife"]
+    assert features["latitude"] == 38.7
+    # Places are only sent when the destination has to be inferred.
+    assert features["places"] == []
+
+
+def test_extract_trip_features_matches_whole_words():
+    features = extract_trip_features(_trip("Lisbon", activities=("Bargain hunting", "Walks along the river")))
+    assert features["categories"] == ["boat trips"]
+
+
+def test_extract_trip_features_without_dates_or_destination():
+    itinerary = {"travel_dates": "Dec 20 - Jan 3", "itinerary": [
+        {"day": 1, "activities": [{"description": "Temple visit", "location": {"name": "Wat Pho"}}]},
+    ]}
+    features = extract_trip_features(itinerary)
+    assert features["months"] == ["December", "January"]
+    assert features["places"] == ["Wat Pho"]
+    assert features["latitude"] is None
+
+
+# --- Feature key ---
+@pytest.mark.parametrize("latitude, zone", [
+    (None, "unknown"), (13.7, "tropical"), (-23.4, "tropical"), (30.0, "subtropical"),
+    (38.7, "temperate"), (-41.3, "temperate"), (64.1, "cold"),
+])
+def test_climate_zone(latitude, zone):
+    assert climate_zone(latitude) == zone
+
+
+@pytest.mark.parametrize("features, season", [
+    ({"latitude": 38.7, "months": ["July"]}, "summer"),
+    ({"latitude": -41.3, "months": ["July"]}, "winter"),
+    ({"latitude": 13.7, "months": ["July"]}, "tropical"),
+    ({"latitude": 38.7, "months": []}, "any"),
+    ({"latitude": None, "months": ["October"]}, "autumn"),
+])
+def test_trip_season(features, season):
+    assert trip_season(features) == season
+
+
+@pytest.mark.parametrize("days, bucket", [(1, "short"), (3, "short"), (4, "week"), (7, "week"),
+                                          (10, "two-weeks"), (30, "long")])
+def test_length_bucket(days, bucket):
+    assert length_bucket(days) == bucket
+
+
+def test_destination_region():
+    assert destination_region({"destination": "Porto,  PORTUGAL "}) == "portugal"
+    assert destination_region({"destination": None, "latitude": 38.7, "longitude": -9.1}) == "grid:40,-10"
+    assert destination_region({}) == "unknown"
+
+
+def _key(itinerary: dict) -> str:
+    return packing_feature_key(extract_trip_features(itinerary))
+
+
+def test_similar_trips_share_a_key():
+    # Another city in the same country, a few days later and a day longer.
+    assert _key(_trip("Lisbon, Portugal", days=5)) == _key(_trip("Porto, Portugal", start_day=10, days=6))
+
+
+@pytest.mark.parametrize("other", [
+    _trip("Lisbon, Portugal", month=1),
+    _trip("Lisbon, Portugal", days=10),
+    _trip("Lisbon, Portugal", activities=("Hike to the waterfall", "Evening at a rooftop bar", "Beach day")),
+    _trip("Madrid, Spain"),
+], ids=["season", "length", "tags", "region"])
+def test_different_trips_get_different_keys(other):
+    assert _key(_trip("Lisbon, Portugal")) != _key(other)
+
+
+# --- Rules ---
+def test_rule_packing_list():
+    result = build_rule_packing_list(extract_trip_features(_trip("Lisbon, Portugal", days=12)))
+    assert result["source"] == "rules"
+    clothing = result["packing_list"]["Clothing"]
+    # Quantities assume laundry once a week.
+    assert clothing[:3] == ["7x T-shirts", "7x Underwear", "7x Socks"]
+    assert "Shorts" in clothing and "Hiking shoes" in clothing and "One smarter outfit" in clothing
+    assert "Headlamp" in result["packing_list"]["Miscellaneous"]
+    for items in result["packing_list"].values():
+        assert len(items) == len(set(items))
+
+
+# --- Engine ---
+class FakeEnrichment:
+    """Stands in for agenerate_packing_list; calls wait until ``release`` is set."""
+
+    def __init__(self, result: dict = None):
+        self.result = result or {"packing_list": {"Clothing": ["LLM shirt"]}, "weather_summary": "Sunny.",
+                                 "usage": {"prompt_tokens": 120}}
+        self.calls = 0
+        self.release = None
+
+    async def __call__(self, itinerary):
+        self.calls += 1
+        await self.release.wait()
+        return dict(self.result)
+
+
+@pytest.fixture
+def enrichment(monkeypatch):
+    fake = FakeEnrichment()
+    monkeypatch.setattr(engine_module, "agenerate_packing_list", fake)
+    return fake
+
+
+def test_engine_miss_returns_rules_without_waiting_on_the_llm(enrichment):
+    engine = PackingListEngine(cache=ResponseCache())
+
+    async def scenario():
+        enrichment.release = asyncio.Event()
+        first = engine.get(_trip("Lisbon, Portugal"))
+        # A similar trip arrives while the LLM is still working: no second call.
+        second = engine.get(_trip("Porto, Portugal", days=6))
+        assert engine.stats()["enriching"] == 1
+        enrichment.release.set()
+        await asyncio.sleep(0.01)
+        return first, second, engine.get(_trip("Porto, Portugal", days=4))
+
+    first, second, later = asyncio.run(scenario())
+    assert first["source"] == "rules" and second["source"] == "rules"
+    assert enrichment.calls == 1
+    assert later["source"] == "llm"
+    assert later["packing_list"] == {"Clothing": ["LLM shirt"]}
+    # The usage of the enrichment call is not shared with other trips.
+    assert "usage" not in later
+    assert engine.stats() == {"cache_hits": 1, "rule_lists": 2, "enriched": 1, "enrich_failures": 0,
+                              "enriching": 0}
+
+
+def test_engine_does_not_retry_a_failed_key_right_away(enrichment):
+    enrichment.result = {"error": "model unavailable"}
+    engine = PackingListEngine(cache=ResponseCache(), retry_seconds=60)
+
+    async def scenario():
+        enrichment.release = asyncio.Event()
+        enrichment.release.set()
+        engine.get(_trip("Lisbon, Portugal"))
+        await asyncio.sleep(0.01)
+        return engine.get(_trip("Lisbon, Portugal"))
+
+    assert asyncio.run(scenario())["source"] == "rules"
+    assert enrichment.calls == 1
+    assert engine.stats()["enrich_failures"] == 1
+
+
+def test_engine_without_enrichment_only_uses_rules(enrichment):
+    engine = PackingListEngine(cache=ResponseCache(), enrich=False)
+    assert engine.get(_trip("Lisbon, Portugal"))["source"] == "rules"
+    assert enrichment.calls == 0
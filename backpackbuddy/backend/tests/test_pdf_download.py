@@ -0,0 +1,109 @@
+import asyncio
+
+import httpx
+import pytest
+
+from backend import main
+from backend.main import ItineraryData, _parse_byte_range, _resolve_itinerary, app
+from backend.utils.pdf_cache import PDFArtifactCache
+
+PDF = bytes(range(256)) * 40  # 10240 bytes
+ITINERARY = {"destination": "Lisbon", "itinerary": [{"day": 1, "activities": []}]}
+
+
+@pytest.fixture(params=["memory", "disk"])
+def cached_pdf(request, tmp_path, monkeypatch):
+    """Puts PDF in a fresh cache as the rendering of ITINERARY; returns its digest."""
+    item_max = 0 if request.param == "disk" else len(PDF)
+    cache = PDFArtifactCache(spool_dir=str(tmp_path), memory_item_max_bytes=item_max)
+    monkeypatch.setattr(main, "pdf_cache", cache)
+    _, digest = _resolve_itinerary(ItineraryData(itinerary=ITINERARY))
+    cache.put(digest, PDF)
+    return digest
+
+
+def _send(method: str, url: str, **kwargs) -> httpx.Response:
+    async def send():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.request(method, url, **kwargs)
+
+    return asyncio.run(send())
+
+
+# --- Range parsing ---
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 1023)),
+    ("bytes=1000-5000", (1000, 1023)),
+    ("bytes=-100", (924, 1023)),
+    ("bytes=-5000", (0, 1023)),
+    ("bytes=-0", "invalid"),
+    ("bytes=2000-", "invalid"),
+    ("bytes=50-10", "invalid"),
+    ("bytes=0-1,5-9", None),
+    ("items=0-10", None),
+    ("bytes=a-b", None),
+])
+def test_parse_byte_range(header, expected):
+    assert _parse_byte_range(header, 1024) == expected
+
+
+# --- GET /itinerary-pdf/{digest} ---
+def test_get_serves_the_whole_pdf(cached_pdf):
+    response = _send("GET", f"/itinerary-pdf/{cached_pdf}")
+    assert response.status_code == 200
+    assert response.content == PDF
+    assert response.headers["etag"] == f'"{cached_pdf}"'
+    assert response.headers["accept-ranges"] == "bytes"
+
+
+def test_get_serves_a_suffix_range(cached_pdf):
+    response = _send("GET", f"/itinerary-pdf/{cached_pdf}", headers={"Range": "bytes=-100"})
+    assert response.status_code == 206
+    assert response.content == PDF[-100:]
+    assert response.headers["content-range"] == f"bytes {len(PDF) - 100}-{len(PDF) - 1}/{len(PDF)}"
+
+
+def test_get_serves_an_open_ended_range(cached_pdf):
+    response = _send("GET", f"/itinerary-pdf/{cached_pdf}", headers={"Range": "bytes=10000-"})
+    assert response.status_code == 206
+    assert response.content == PDF[10000:]
+
+
+def test_get_rejects_an_unsatisfiable_range(cached_pdf):
+    response = _send("GET", f"/itinerary-pdf/{cached_pdf}", headers={"Range": f"bytes={len(PDF)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(PDF)}"
+
+
+def test_get_serves_the_whole_pdf_for_multiple_ranges(cached_pdf):
+    response = _send("GET", f"/itinerary-pdf/{cached_pdf}", headers={"Range": "bytes=0-9,20-29"})
+    assert response.status_code == 200
+    assert response.content == PDF
+
+
+@pytest.mark.parametrize("if_none_match", ['"{}"', 'W/"{}"', '"other", W/"{}"', "*"])
+def test_get_answers_a_matching_etag_with_304(cached_pdf, if_none_match):
+    response = _send("GET", f"/itinerary-pdf/{cached_pdf}", headers={"If-None-Match": if_none_match.format(cached_pdf)})
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_get_ignores_a_different_etag(cached_pdf):
+    response = _send("GET", f"/itinerary-pdf/{cached_pdf}", headers={"If-None-Match": 'W/"other"'})
+    assert response.status_code == 200
+
+
+def test_get_unknown_pdf_is_404(cached_pdf):
+    assert _send("GET", "/itinerary-pdf/missing").status_code == 404
+    assert _send("GET", "/itinerary-pdf/not..alnum").status_code == 404
+
+
+# --- POST /download-itinerary-pdf ---
+def test_post_never_answers_304(cached_pdf):
+    response = _send("POST", "/download-itinerary-pdf", json={"itinerary": ITINERARY},
+                     headers={"If-None-Match": f'"{cached_pdf}"'})
+    assert response.status_code == 200
+    assert response.content == PDF
+    assert response.headers["content-location"] == f"/itinerary-pdf/{cached_pdf}"
@@ -0,0 +1,146 @@
+import asyncio
+import itertools
+
+import numpy as np
+import pytest
+
+from backend.utils import poi_cache
+from backend.utils.cache import ResponseCache
+from backend.utils.poi_cache import (
+    _filter_features, aplaces_in_radius, covering_cells, geohash_bounds, geohash_encode, places_in_radius
+)
+
+
+def _feature(name: str, lon: float, lat: float) -> dict:
+    return {"xid": name, "name": name, "point": {"lon": lon, "lat": lat}, "dist": 0}
+
+
+# --- Geohash ---
+def test_geohash_encode_known_value():
+    assert geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+
+
+def test_geohash_bounds_contain_the_encoded_point():
+    lat_min, lat_max, lon_min, lon_max = geohash_bounds(geohash_encode(38.7223, -9.1393, 6))
+    assert lat_min <= 38.7223 < lat_max and lon_min <= -9.1393 < lon_max
+    assert geohash_encode((lat_min + lat_max) / 2, (lon_min + lon_max) / 2, 6) == geohash_encode(38.7223, -9.1393, 6)
+
+
+def _assert_covers(lon: float, lat: float, radius: float, precision: int):
+    """Every point of the circle's bounding box lies in one of the covering cells."""
+    cells = set(covering_cells(lon, lat, radius, precision))
+    dlat = radius / 111320.0
+    dlon = dlat / np.cos(np.radians(lat))
+    for plat, plon in itertools.product(np.linspace(lat - dlat, lat + dlat, 25), np.linspace(lon - dlon, lon + dlon, 25)):
+        assert geohash_encode(plat, plon, precision) in cells
+
+
+@pytest.mark.parametrize("lon, lat, radius, precision", [
+    (-9.1393, 38.7223, 1000, 5),
+    (100.5018, 13.7563, 5000, 5),
+    (174.7762, -41.2865, 300, 6),
+])
+def test_covering_cells_cover_the_search_circle(lon, lat, radius, precision):
+    _assert_covers(lon, lat, radius, precision)
+
+
+def test_covering_cells_at_a_cell_edge_latitude():
+    # Center the search exactly on the southern edge of a cell: the cells on
+    # both sides of the edge are needed.
+    lat_min, _, lon_min, lon_max = geohash_bounds(geohash_encode(38.7223, -9.1393, 5))
+    lon = (lon_min + lon_max) / 2
+    cells = covering_cells(lon, lat_min, 200, 5)
+    assert geohash_encode(lat_min + 1e-9, lon, 5) in cells
+    assert geohash_encode(lat_min - 1e-9, lon, 5) in cells
+    _assert_covers(lon, lat_min, 200, 5)
+
+
+def test_plan_cells_coarsens_large_searches(monkeypatch):
+    monkeypatch.setattr(poi_cache, "POI_MAX_CELLS", 16)
+    small = poi_cache._plan_cells(-9.1393, 38.7223, 500)
+    large = poi_cache._plan_cells(-9.1393, 38.7223, 50000)
+    assert len(small[0]) == poi_cache.POI_GEOHASH_PRECISION
+    assert len(large) <= 16 and len(large[0]) < len(small[0])
+
+
+# --- Local filtering ---
+def test_filter_features_keeps_the_circle_nearest_first():
+    features = [
+        _feature("far", -9.1393, 38.7223 + 0.02),   # ~2.2 km north
+        _feature("near", -9.1393, 38.7223 + 0.005),  # ~560 m north
+        _feature("center", -9.1393, 38.7223),
+        {"xid": "no-point", "name": "no point"},
+    ]
+    results = _filter_features(features, -9.1393, 38.7223, 1000, limit=10)
+    assert [f["name"] for f in results] == ["center", "near"]
+    assert results[0]["dist"] == 0
+    assert results[1]["dist"] == pytest.approx(556, abs=2)
+    assert [f["name"] for f in _filter_features(features, -9.1393, 38.7223, 5000, limit=2)] == ["center", "near"]
+
+
+# --- Cached queries ---
+class FakeFetch:
+    """Returns a fixed set of places that fall inside the requested box."""
+
+    def __init__(self, places: list, fail: bool = False):
+        self.places = places
+        self.fail = fail
+        self.boxes = []
+
+    def _in_box(self, lat_min, lat_max, lon_min, lon_max, kinds):
+        self.boxes.append((lat_min, lat_max, lon_min, lon_max, kinds))
+        if self.fail:
+            raise RuntimeError("OpenTripMap is down")
+        return [p for p in self.places if lat_min <= p["point"]["lat"] < lat_max and lon_min <= p["point"]["lon"] < lon_max]
+
+    def __call__(self, *box):
+        return self._in_box(*box)
+
+    async def afetch(self, *box):
+        await asyncio.sleep(0.01)
+        return self._in_box(*box)
+
+
+PLACES = [_feature("Se", -9.1335, 38.7097), _feature("Castelo", -9.1334, 38.7139), _feature("Belem", -9.2160, 38.6916)]
+
+
+@pytest.fixture(autouse=True)
+def cell_cache(monkeypatch):
+    cache = ResponseCache()
+    monkeypatch.setattr(poi_cache, "_cell_cache", cache)
+    return cache
+
+
+def test_places_in_radius_fetches_each_cell_once():
+    fetch = FakeFetch(PLACES)
+    results = places_in_radius(-9.1335, 38.7097, 1000, "museums", fetch)
+    assert [f["name"] for f in results] == ["Se", "Castelo"]
+    cells = len(fetch.boxes)
+    assert cells == len(poi_cache._plan_cells(-9.1335, 38.7097, 1000))
+
+    # A nearby search reuses the cached cells; another kinds filter doesn't.
+    assert [f["name"] for f in places_in_radius(-9.1334, 38.7139, 600, "museums", fetch)] == ["Castelo", "Se"]
+    assert len(fetch.boxes) == cells + len(set(poi_cache._plan_cells(-9.1334, 38.7139, 600))
+                                           - set(poi_cache._plan_cells(-9.1335, 38.7097, 1000)))
+    places_in_radius(-9.1335, 38.7097, 1000, "churches", fetch)
+    assert {box[4] for box in fetch.boxes} == {"museums", "churches"}
+
+
+def test_places_in_radius_skips_cells_that_fail():
+    assert places_in_radius(-9.1335, 38.7097, 1000, "museums", FakeFetch(PLACES, fail=True)) == []
+    # Failures are not cached.
+    assert [f["name"] for f in places_in_radius(-9.1335, 38.7097, 1000, "museums", FakeFetch(PLACES))] == ["Se", "Castelo"]
+
+
+def test_aplaces_in_radius_coalesces_concurrent_cell_fetches():
+    fetch = FakeFetch(PLACES)
+
+    async def two_searches():
+        return await asyncio.gather(
+            aplaces_in_radius(-9.1335, 38.7097, 1000, "museums", fetch.afetch),
+            aplaces_in_radius(-9.1335, 38.7097, 1000, "museums", fetch.afetch),
+        )
+
+    first, second = asyncio.run(two_searches())
+    assert [f["name"] for f in first] == [f["name"] for f in second] == ["Se", "Castelo"]
+    assert len(fetch.boxes) == len(poi_cache._plan_cells(-9.1335, 38.7097, 1000))
@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable
+
+from backend.utils.concurrency import QueueFullError
+from backend.utils.rate_limit import LLMScheduler, expected_output_tokens, output_budget
+from backend.utils.scheduled_llm import ScheduledLLM
+
+
+class SlowLLM(Runnable):
+    def __init__(self, delay: float = 0.0, total_tokens: int = None, error: Exception = None):
+        self.delay = delay
+        self.total_tokens = total_tokens
+        self.error = error
+
+    def invoke(self, input, config=None, **kwargs):
+        if self.error is not None:
+            raise self.error
+        usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": self.total_tokens}
+        return AIMessage(content="ok", usage_metadata=usage if self.total_tokens else None)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        await asyncio.sleep(self.delay)
+        return self.invoke(input, config, **kwargs)
+
+
+def test_reserve_is_free_within_the_budget():
+    scheduler = LLMScheduler(rpm=60, tpm=6000, headroom=1.0)
+    assert scheduler.reserve(1000) == 0.0
+    assert scheduler.stats()["calls"] == 1
+
+
+def test_reserve_paces_once_a_budget_runs_dry():
+    scheduler = LLMScheduler(rpm=60, tpm=0, headroom=1.0)
+    for _ in range(60):
+        assert scheduler.reserve(10) == 0.0
+    # One request per second refills; the next caller waits about that long.
+    assert scheduler.reserve(10) == pytest.approx(1.0, abs=0.05)
+    assert scheduler.reserve(10) == pytest.approx(2.0, abs=0.05)
+    assert scheduler.stats()["delayed_calls"] == 2
+
+
+def test_reserve_rejects_waits_beyond_max_wait_without_reserving():
+    scheduler = LLMScheduler(rpm=0, tpm=600, headroom=1.0, max_wait=5)
+    scheduler.reserve(600)
+    with pytest.raises(QueueFullError):
+        scheduler.reserve(600)
+    stats = scheduler.stats()
+    assert stats["rejected_calls"] == 1
+    assert stats["calls"] == 1
+    # Nothing was kept for the rejected call: a small one still fits in max_wait.
+    assert 0 < scheduler.reserve(10) < 5
+
+
+def test_settle_returns_an_over_estimate():
+    scheduler = LLMScheduler(rpm=0, tpm=1000, headroom=1.0)
+    scheduler.reserve(800)
+    scheduler.settle(800, 300)
+    assert scheduler.stats()["tokens_available"] == pytest.approx(700, abs=2)
+    assert scheduler.stats()["actual_tokens"] == 300
+
+
+def test_release_gives_a_reservation_back():
+    scheduler = LLMScheduler(rpm=60, tpm=1000, headroom=1.0)
+    scheduler.reserve(500)
+    scheduler.release(500)
+    stats = scheduler.stats()
+    assert stats["requests_available"] == pytest.approx(60, abs=0.1)
+    assert stats["tokens_available"] == pytest.approx(1000, abs=1)
+    assert stats["released_calls"] == 1
+
+
+def test_disabled_budgets_never_wait():
+    scheduler = LLMScheduler(rpm=0, tpm=0)
+    assert all(scheduler.reserve(10**6) == 0.0 for _ in range(100))
+
+
+def test_output_budget_sets_the_reservation():
+    assert expected_output_tokens(output_budget(350)) == 350
+    assert expected_output_tokens(None, default=1000) == 1000
+
+
+def test_scheduled_llm_settles_with_reported_usage():
+    scheduler = LLMScheduler(rpm=0, tpm=10000, headroom=1.0)
+    llm = ScheduledLLM(SlowLLM(total_tokens=120), scheduler, expected_output_tokens=1000)
+    asyncio.run(llm.ainvoke("hello"))
+    stats = scheduler.stats()
+    assert stats["actual_tokens"] == 120
+    assert stats["tokens_available"] == pytest.approx(10000 - 120, abs=2)
+
+
+def test_scheduled_llm_uses_the_per_call_output_budget():
+    scheduler = LLMScheduler(rpm=0, tpm=10000, headroom=1.0)
+    llm = ScheduledLLM(SlowLLM(), scheduler, expected_output_tokens=1000)
+    asyncio.run(llm.ainvoke("hello", config=output_budget(350)))
+    assert scheduler.stats()["estimated_tokens"] == llm.estimate_tokens("hello", output_budget(350))
+    assert llm.estimate_tokens("hello", output_budget(350)) < llm.estimate_tokens("hello")
+
+
+def test_scheduled_llm_refunds_a_call_cancelled_while_waiting():
+    scheduler = LLMScheduler(rpm=60, tpm=0, headroom=1.0)
+    for _ in range(60):
+        scheduler.reserve(0)
+    llm = ScheduledLLM(SlowLLM(), scheduler)
+
+    async def cancel_while_waiting():
+        task = asyncio.ensure_future(llm.ainvoke("hello"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    before = scheduler.stats()["requests_available"]
+    asyncio.run(cancel_while_waiting())
+    stats = scheduler.stats()
+    assert stats["released_calls"] == 1
+    # Only the refill of the last 50ms is gained; the queued request was returned.
+    assert stats["requests_available"] == pytest.approx(before, abs=0.2)
+
+
+async def _drain(stream):
+    return [chunk async for chunk in stream]
+
+@pytest.mark.parametrize("call", [
+    lambda llm: llm.invoke("hello", config=output_budget(500)),
+    lambda llm: asyncio.run(llm.ainvoke("hello", config=output_budget(500))),
+    lambda llm: list(llm.stream("hello", config=output_budget(500))),
+    lambda llm: asyncio.run(_drain(llm.astream("hello", config=output_budget(500)))),
+], ids=["invoke", "ainvoke", "stream", "astream"])
+def test_scheduled_llm_releases_the_output_reservation_of_a_failed_call(call):
+    scheduler = LLMScheduler(rpm=0, tpm=10000, headroom=1.0)
+    llm = ScheduledLLM(SlowLLM(error=RuntimeError("503 Service Unavailable")), scheduler)
+    with pytest.raises(RuntimeError, match="503"):
+        call(llm)
+    stats = scheduler.stats()
+    assert stats["released_calls"] == 1
+    # The prompt was sent and stays counted; the 500 output tokens come back.
+    assert stats["estimated_tokens"] == llm.estimate_tokens("hello", output_budget(500)) - 500
+    assert stats["tokens_available"] == pytest.approx(10000 - stats["estimated_tokens"], abs=2)
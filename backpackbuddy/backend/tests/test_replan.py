@@ -0,0 +1,216 @@
+import asyncio
+import copy
+
+import httpx
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable
+
+from backend import main
+from backend.agents import repack_agent
+from backend.agents.repack_agent import areplan_days, diff_day, replan_day
+from backend.benchmarks.fake_upstreams import fake_completion
+from backend.utils.concurrency import ConcurrencyLimiter
+from backend.utils.trip_store import InMemoryTripStore
+
+ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+def _activity(time: str, place: str, notes: str = "Free") -> dict:
+    return {"time": time, "description": f"Visit {place}", "location": {"name": place, "lat": 1.0, "lon": 2.0},
+            "budget_notes": notes}
+
+def _day(number: int) -> dict:
+    return {"day": number, "date": f"2025-03-0{number}", "theme": "Old town",
+            "activities": [_activity("09:00", f"Market {number}"), _activity("14:00", f"Museum {number}")]}
+
+ITINERARY = {"destination": "Porto", "itinerary": [_day(1), _day(2), _day(3)]}
+
+
+class FakeLLM(Runnable):
+    """Replans like the fake upstream model; fails the days in ``fail_days``."""
+
+    def __init__(self, fail_days=(), delay: float = 0.0):
+        self.fail_days = set(fail_days)
+        self.delay = delay
+        self.running = 0
+        self.max_running = 0
+        self.conditions = []
+
+    def invoke(self, input, config=None, **kwargs):
+        messages = [{"role": ROLES[m.type], "content": m.content} for m in input.to_messages()]
+        user = messages[-1]["content"]
+        self.conditions.append(user.split("**New condition:**")[1].split("\n")[0].strip())
+        for number in self.fail_days:
+            if f'"day":{number},' in user:
+                raise RuntimeError(f"day {number} timed out")
+        return AIMessage(content=fake_completion(messages, default_days=3))
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+            return self.invoke(input, config, **kwargs)
+        finally:
+            self.running -= 1
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    def install(**kwargs):
+        llm = FakeLLM(**kwargs)
+        monkeypatch.setattr(repack_agent, "get_groq_llm", lambda: llm)
+        return llm
+
+    return install
+
+
+# --- diff_day ---
+def test_diff_day_matches_activities_by_time_slot_and_place():
+    old = _day(1)
+    new = copy.deepcopy(old)
+    new["activities"][0]["budget_notes"] = "Entry: ~$5"
+    new["activities"][1] = _activity("14:00", "Botanical garden")
+    diff = diff_day(old, new)
+    assert diff["day"] == 1
+    assert [a["location"]["name"] for a in diff["added"]] == ["Botanical garden"]
+    assert [a["location"]["name"] for a in diff["removed"]] == ["Museum 1"]
+    assert diff["changed"] == [{"activity": "Visit Market 1",
+                                "fields": {"budget_notes": {"before": "Free", "after": "Entry: ~$5"}}}]
+    assert diff["unchanged"] == 0
+
+
+def test_diff_day_reports_a_moved_activity_as_removed_and_added():
+    old = _day(1)
+    new = copy.deepcopy(old)
+    new["activities"][1]["time"] = "16:00"
+    diff = diff_day(old, new)
+    assert [a["time"] for a in diff["removed"]] == ["14:00"]
+    assert [a["time"] for a in diff["added"]] == ["16:00"]
+    assert diff["unchanged"] == 1
+
+
+def test_diff_day_keeps_two_visits_to_the_same_place_apart():
+    old = {"day": 1, "activities": [_activity("", "Beach"), _activity("", "Beach")]}
+    new = copy.deepcopy(old)
+    new["activities"][1]["budget_notes"] = "Sunbed: ~$4"
+    diff = diff_day(old, new)
+    assert len(diff["changed"]) == 1
+    assert diff["unchanged"] == 1
+    assert diff["added"] == [] and diff["removed"] == []
+
+    new["activities"].pop()
+    diff = diff_day(old, new)
+    assert len(diff["removed"]) == 1
+    assert diff["unchanged"] == 1
+
+
+# --- areplan_days ---
+def test_areplan_days_splices_in_new_days_without_modifying_the_input(fake_llm):
+    fake_llm()
+    original = copy.deepcopy(ITINERARY)
+    result = asyncio.run(areplan_days(ITINERARY, [(2, "rain all day")]))
+    assert ITINERARY == original
+    days = result["itinerary"]["itinerary"]
+    assert days[0] == ITINERARY["itinerary"][0] and days[2] == ITINERARY["itinerary"][2]
+    # The model's day number and date are not trusted.
+    assert days[1]["day"] == 2
+    assert days[1]["theme"] == "Replanned day"
+    assert [(c["day"], c["condition"]) for c in result["changes"]] == [(2, "rain all day")]
+    assert len(result["changes"][0]["removed"]) == 2
+
+
+def test_areplan_days_combines_conditions_for_the_same_day(fake_llm):
+    llm = fake_llm()
+    result = asyncio.run(areplan_days(ITINERARY, [(3, "rain"), (1, "museum closed"), (3, "tired")]))
+    assert sorted(llm.conditions) == ["museum closed", "rain; tired"]
+    assert [c["day"] for c in result["changes"]] == [1, 3]
+
+
+def test_areplan_days_keeps_a_day_that_fails(fake_llm):
+    fake_llm(fail_days={1})
+    result = asyncio.run(areplan_days(ITINERARY, [(1, "rain"), (2, "rain")]))
+    assert result["itinerary"]["itinerary"][0] == ITINERARY["itinerary"][0]
+    assert "day 1 timed out" in result["changes"][0]["error"]
+    assert "error" not in result["changes"][1]
+
+
+def test_areplan_days_rejects_an_unknown_day(fake_llm):
+    llm = fake_llm()
+    with pytest.raises(KeyError, match="Day 9"):
+        asyncio.run(areplan_days(ITINERARY, [(1, "rain"), (9, "rain")]))
+    assert llm.conditions == []
+
+
+def test_areplan_days_takes_an_llm_slot_per_call(fake_llm, monkeypatch):
+    llm = fake_llm(delay=0.02)
+    monkeypatch.setattr(repack_agent, "llm_limiter", ConcurrencyLimiter(max_concurrency=1, max_queue=8))
+    result = asyncio.run(areplan_days(ITINERARY, [(1, "rain"), (2, "rain"), (3, "rain")]))
+    assert all("error" not in c for c in result["changes"])
+    assert llm.max_running == 1
+
+
+# --- replan_day ---
+def test_replan_day_returns_an_updated_copy(fake_llm):
+    fake_llm()
+    original = copy.deepcopy(ITINERARY)
+    updated = replan_day(ITINERARY, 3, "rain")
+    assert ITINERARY == original
+    assert updated["itinerary"][2]["theme"] == "Replanned day"
+    assert updated["itinerary"][2]["day"] == 3
+    assert updated["itinerary"][:2] == ITINERARY["itinerary"][:2]
+
+
+def test_replan_day_leaves_the_day_on_failure(fake_llm):
+    fake_llm(fail_days={3})
+    assert replan_day(ITINERARY, 3, "rain") == ITINERARY
+
+
+def test_replan_day_rejects_an_unknown_day(fake_llm):
+    fake_llm()
+    with pytest.raises(KeyError):
+        replan_day(ITINERARY, 7, "rain")
+
+
+# --- Endpoint ---
+@pytest.fixture
+def store(monkeypatch):
+    store = InMemoryTripStore()
+    monkeypatch.setattr(main, "trip_store", store)
+    return store
+
+
+def _replan(**body) -> httpx.Response:
+    async def send():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            return await client.post("/replan", json=body)
+
+    return asyncio.run(send())
+
+
+def test_replan_endpoint_rejects_an_unknown_day(fake_llm):
+    fake_llm()
+    response = _replan(itinerary=ITINERARY, changes=[{"day": 5, "condition": "rain"}])
+    assert response.status_code == 422
+    assert response.json()["detail"] == "Day 5 is not in the itinerary."
+
+
+def test_replan_endpoint_saves_a_new_trip_version(fake_llm, store):
+    fake_llm()
+    trip_id = store.save(ITINERARY)["trip_id"]
+    response = _replan(trip_id=trip_id, changes=[{"day": 1, "condition": "rain"}])
+    assert response.status_code == 200
+    assert response.json()["trip_version"] == 2
+    assert store.get(trip_id)["itinerary"]["itinerary"][0]["theme"] == "Replanned day"
+
+
+def test_replan_endpoint_does_not_save_when_no_day_was_replanned(fake_llm, store):
+    fake_llm(fail_days={1})
+    trip_id = store.save(ITINERARY)["trip_id"]
+    response = _replan(trip_id=trip_id, changes=[{"day": 1, "condition": "rain"}])
+    assert response.status_code == 200
+    body = response.json()
+    assert "error" in body["changes"][0]
+    assert body["trip_id"] == trip_id
+    assert store.get(trip_id)["version"] == 1
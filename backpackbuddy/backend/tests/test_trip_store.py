@@ -0,0 +1,129 @@
+import asyncio
+
+import httpx
+import pytest
+
+from backend import main
+from backend.agents.packing_engine import PackingListEngine
+from backend.main import ItineraryData, _resolve_itinerary
+from backend.utils.cache import ResponseCache, content_hash
+from backend.utils.trip_store import InMemoryTripStore, SQLiteTripStore, TripNotFoundError
+
+ITINERARY = {"destination": "Hanoi, Vietnam", "travel_dates": "2025-03-01 to 2025-03-02", "itinerary": [
+    {"day": 1, "date": "2025-03-01", "theme": "Old Quarter",
+     "activities": [{"time": "09:00", "description": "Walk around Hoan Kiem Lake", "budget_notes": "Free"}]},
+]}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteTripStore(str(tmp_path / "trips.db"))
+    return InMemoryTripStore()
+
+
+# --- Stores ---
+def test_save_creates_a_trip(store):
+    record = store.save(ITINERARY)
+    assert record["version"] == 1
+    assert record["content_hash"] == content_hash(ITINERARY)
+    loaded = store.get(record["trip_id"])
+    assert loaded["itinerary"] == ITINERARY
+    assert loaded["version"] == 1
+
+
+def test_saving_a_trip_again_adds_a_version(store):
+    trip_id = store.save(ITINERARY)["trip_id"]
+    changed = {**ITINERARY, "travel_dates": "2025-03-02 to 2025-03-03"}
+    assert store.save(changed, trip_id)["version"] == 2
+    assert store.get(trip_id)["itinerary"] == changed
+    assert store.get(trip_id, 1)["itinerary"] == ITINERARY
+    assert store.get(trip_id, 2)["content_hash"] == content_hash(changed)
+
+
+@pytest.mark.parametrize("trip_id, version", [("missing", None), ("missing", 1), (None, 3)])
+def test_unknown_trips_and_versions_raise(store, trip_id, version):
+    known = store.save(ITINERARY)["trip_id"]
+    with pytest.raises(TripNotFoundError):
+        store.get(trip_id or known, version)
+
+
+def test_saving_a_version_of_an_unknown_trip_raises(store):
+    with pytest.raises(TripNotFoundError):
+        store.save(ITINERARY, "missing")
+
+
+def test_stored_trips_are_copies(store):
+    itinerary = {"itinerary": [{"day": 1, "activities": []}]}
+    trip_id = store.save(itinerary)["trip_id"]
+    itinerary["itinerary"].append({"day": 2})
+    store.get(trip_id)["itinerary"]["itinerary"].clear()
+    assert store.get(trip_id)["itinerary"] == {"itinerary": [{"day": 1, "activities": []}]}
+
+
+def test_sqlite_trips_survive_a_restart(tmp_path):
+    path = str(tmp_path / "trips.db")
+    trip_id = SQLiteTripStore(path).save(ITINERARY)["trip_id"]
+    assert SQLiteTripStore(path).get(trip_id)["itinerary"] == ITINERARY
+
+
+def test_memory_store_drops_the_least_recently_used_trip():
+    store = InMemoryTripStore(max_trips=2)
+    first, second = store.save(ITINERARY)["trip_id"], store.save(ITINERARY)["trip_id"]
+    store.get(first)
+    store.save(ITINERARY)
+    assert store.get(first)["trip_id"] == first
+    with pytest.raises(TripNotFoundError):
+        store.get(second)
+
+
+# --- Endpoints ---
+@pytest.fixture
+def app_store(monkeypatch):
+    store = InMemoryTripStore()
+    monkeypatch.setattr(main, "trip_store", store)
+    monkeypatch.setattr(main, "packing_engine", PackingListEngine(cache=ResponseCache(), enrich=False))
+    return store
+
+
+def _request(method: str, url: str, **kwargs) -> httpx.Response:
+    async def send():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            return await client.request(method, url, **kwargs)
+
+    return asyncio.run(send())
+
+
+def test_get_trip_endpoint(app_store):
+    trip_id = app_store.save(ITINERARY)["trip_id"]
+    app_store.save(ITINERARY, trip_id)
+    body = _request("GET", f"/trips/{trip_id}").json()
+    assert body["trip_id"] == trip_id and body["trip_version"] == 2
+    assert _request("GET", f"/trips/{trip_id}", params={"version": 1}).json()["trip_version"] == 1
+    assert _request("GET", "/trips/missing").status_code == 404
+    assert _request("GET", f"/trips/{trip_id}", params={"version": 5}).status_code == 404
+
+
+def test_unknown_trip_is_a_404_and_the_full_itinerary_still_works(app_store):
+    # What the results page does after a restart lost the in-memory store.
+    response = _request("POST", "/generate-packing-list", json={"trip_id": "lost", "trip_version": 1})
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Trip not found: lost"
+
+    echoed = {**ITINERARY, "trip_id": "lost", "trip_version": 1}
+    response = _request("POST", "/generate-packing-list", json={"itinerary": echoed})
+    assert response.status_code == 200
+    assert response.json()["source"] == "rules"
+
+
+def test_a_trip_reference_and_its_full_itinerary_resolve_alike(app_store):
+    record = app_store.save(ITINERARY)
+    by_reference = _resolve_itinerary(ItineraryData(trip_id=record["trip_id"]))
+    echoed = {**ITINERARY, "trip_id": record["trip_id"], "trip_version": record["version"]}
+    # The same content hash, so cached PDFs are shared between both forms.
+    assert _resolve_itinerary(ItineraryData(itinerary=echoed)) == by_reference
+    assert by_reference == (ITINERARY, record["content_hash"])
+
+
+def test_a_request_without_a_trip_is_rejected(app_store):
+    assert _request("POST", "/generate-packing-list", json={}).status_code == 422
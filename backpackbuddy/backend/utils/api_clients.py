@@ -1,54 +1,225 @@
 """
 This module contains functions to interact with external APIs like
 Groq, Serper, OpenTripMap, etc.
+
+LLM and search clients are created on first use and shared by the whole
+process, so importing the API stays fast and works without API keys.
 """
+import asyncio
 import os
-import requests
-from dotenv import load_dotenv
+import threading
 
-from langchain_groq import ChatGroq
-from langchain_community.utilities import GoogleSerperAPIWrapper
+import httpx
+from dotenv import load_dotenv
 
-# Load environment variables from .env file
+# Load environment variables from .env file (before the modules below read
+# their settings)
 load_dotenv()
 
+from backend.utils.http_client import http_client
+from backend.utils.metrics import timed
+from backend.utils.poi_cache import places_in_radius, aplaces_in_radius
+from backend.utils.rate_limit import get_llm_scheduler
+
 # --- API Key Checks ---
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
 SERPER_API_KEY = os.environ.get("SERPER_API_KEY")
 OPENTRIPMAP_API_KEY = os.environ.get("OPENTRIPMAP_API_KEY")
 OSRM_API_URL = os.environ.get("OSRM_API_URL", "http://router.project-osrm.org")
+OPENTRIPMAP_API_URL = os.environ.get("OPENTRIPMAP_API_URL", "https://api.opentripmap.com")
+GROQ_MODEL = os.environ.get("GROQ_MODEL")
+# Optional Groq-compatible endpoint (a proxy, or a local fake in benchmarks).
+GROQ_BASE_URL = os.environ.get("GROQ_BASE_URL") or None
+# Models tried after GROQ_MODEL for hedged and fallback calls, comma-separated.
+# Each may name its own endpoint as "model@base_url".
+GROQ_FALLBACK_MODELS = [m.strip() for m in os.environ.get("GROQ_FALLBACK_MODELS", "").split(",") if m.strip()]
+# Retries inside the Groq SDK; with fallback models the router moves on instead.
+GROQ_MAX_RETRIES = int(os.environ.get("GROQ_MAX_RETRIES", "0" if GROQ_FALLBACK_MODELS else "2"))
+GROQ_MAX_CONNECTIONS = int(os.environ.get("GROQ_MAX_CONNECTIONS", "100"))
+GROQ_TIMEOUT = float(os.environ.get("GROQ_TIMEOUT", "60"))
+
+# --- Client Registry ---
+_clients = {}
+_clients_lock = threading.Lock()
+_groq_http = None
+
+def _groq_http_clients() -> tuple:
+    """One sync and one async connection pool shared by every Groq client."""
+    global _groq_http
+    if _groq_http is None:
+        limits = httpx.Limits(max_connections=GROQ_MAX_CONNECTIONS, max_keepalive_connections=GROQ_MAX_CONNECTIONS)
+        timeout = httpx.Timeout(GROQ_TIMEOUT, connect=5.0)
+        _groq_http = (httpx.Client(limits=limits, timeout=timeout),
+                      httpx.AsyncClient(limits=limits, timeout=timeout))
+    return _groq_http
+
+def register_client(name: str, client):
+    """
+    Installs a client under a registry name, replacing any existing one
+    (e.g. a fake LLM in benchmarks, or a router in front of several models).
+    """
+    with _clients_lock:
+        _clients[name] = client
+
+def _get_client(name: str, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+async def aclose_clients():
+    """Closes the shared Groq connection pools."""
+    global _groq_http
+    if _groq_http is not None:
+        sync_client, async_client = _groq_http
+        _groq_http = None
+        sync_client.close()
+        await async_client.aclose()
 
 # --- LLM Client ---
-def get_groq_llm() -> ChatGroq:
+def get_groq_llm(model: str = None):
     """
-    Initializes and returns the Groq LLM client.
+    Returns the process-wide LLM client, creating it on first use.
+
+    Without a model this is the router over GROQ_MODEL and
+    GROQ_FALLBACK_MODELS (hedging, fallback and circuit breaking), which is
+    what the agents use. With a model it is that model's own client.
+
+    Args:
+        model (str): A Groq model name, optionally as "model@base_url".
 
     Raises:
         ValueError: If the GROQ_API_KEY is not set.
 
     Returns:
-        ChatGroq: An instance of the ChatGroq client.
+        LLMRouter or ScheduledLLM: The shared router, or the model's ChatGroq
+                                   client paced under its rate limits (or
+                                   whatever was registered under
+                                   ``llm`` / ``llm:<model>``).
     """
-    if not GROQ_API_KEY:
-        raise ValueError("GROQ_API_KEY environment variable not set.")
-    return ChatGroq(api_key=GROQ_API_KEY, model_name=os.environ.get("GROQ_MODEL"))
+    if model is None:
+        return _get_client("llm", _create_llm_router)
+
+    def create():
+        if not GROQ_API_KEY:
+            raise ValueError("GROQ_API_KEY environment variable not set.")
+        from langchain_groq import ChatGroq
+        from backend.utils.scheduled_llm import ScheduledLLM
+
+        model_name, _, base_url = model.partition("@")
+        sync_client, async_client = _groq_http_clients()
+        llm = ChatGroq(api_key=GROQ_API_KEY, model_name=model_name, base_url=base_url or GROQ_BASE_URL,
+                       max_retries=GROQ_MAX_RETRIES,
+                       http_client=sync_client, http_async_client=async_client)
+        return ScheduledLLM(llm, get_llm_scheduler(model), name=model)
+
+    return _get_client(f"llm:{model}", create)
+
+def _create_llm_router():
+    from backend.utils.llm_router import LLMRoute, LLMRouter
+
+    models = [GROQ_MODEL] + [m for m in GROQ_FALLBACK_MODELS if m != GROQ_MODEL]
+    # Routes look their client up on every call, so register_client() can
+    # still replace a model after the router exists.
+    return LLMRouter([LLMRoute(m, lambda m=m: get_groq_llm(m)) for m in models])
+
+def llm_router_stats() -> dict:
+    """Returns the router's per-route stats, if the router is in use."""
+    router = _clients.get("llm")
+    return router.stats() if hasattr(router, "stats") else {}
 
 # --- Search Tool ---
-def get_serper_tool() -> GoogleSerperAPIWrapper:
+def get_serper_tool():
     """
-    Initializes and returns the Serper (Google Search) API wrapper.
+    Returns the process-wide Serper (Google Search) API wrapper.
 
     Raises:
         ValueError: If the SERPER_API_KEY is not set.
 
     Returns:
-        GoogleSerperAPIWrapper: An instance of the GoogleSerperAPIWrapper.
+        GoogleSerperAPIWrapper: The shared GoogleSerperAPIWrapper.
+    """
+    def create():
+        if not SERPER_API_KEY:
+            raise ValueError("SERPER_API_KEY environment variable not set.")
+        from langchain_community.utilities import GoogleSerperAPIWrapper
+
+        return GoogleSerperAPIWrapper(serper_api_key=SERPER_API_KEY)
+
+    return _get_client("serper", create)
+
+@timed("web_search")
+async def asearch_web(query: str) -> dict:
+    """
+    Runs a Serper search without blocking the event loop.
+
+    Returns:
+        dict: Serper's raw results (``organic``, ``knowledgeGraph``, ...),
+              or an empty dict if the key is missing or an error occurs.
     """
     if not SERPER_API_KEY:
-        raise ValueError("SERPER_API_KEY environment variable not set.")
-    return GoogleSerperAPIWrapper(serper_api_key=SERPER_API_KEY)
+        print("Warning: SERPER_API_KEY not set. Skipping web search.")
+        return {}
+    try:
+        return await asyncio.to_thread(get_serper_tool().results, query)
+    except Exception as e:
+        print(f"Error searching the web for '{query}': {e}")
+        return {}
+
+def prewarm_clients():
+    """
+    Imports the LLM client libraries and creates the default LLM client
+    ahead of the first request. Meant to run in a background thread once
+    the worker is already serving.
+    """
+    try:
+        from langchain_core.prompts import ChatPromptTemplate  # noqa: F401
+        if GROQ_API_KEY:
+            get_groq_llm()
+            get_groq_llm(GROQ_MODEL)
+        else:
+            import langchain_groq  # noqa: F401
+    except Exception as e:
+        print(f"Client prewarm failed: {e}")
 
 # --- Travel APIs ---
+OPENTRIPMAP_BBOX_URL = f"{OPENTRIPMAP_API_URL}/0.1/en/places/bbox"
+OPENTRIPMAP_GEONAME_URL = f"{OPENTRIPMAP_API_URL}/0.1/en/places/geoname"
+OPENTRIPMAP_CELL_LIMIT = int(os.environ.get("OPENTRIPMAP_CELL_LIMIT", "500"))
+
+def _bbox_params(lat_min: float, lat_max: float, lon_min: float, lon_max: float, kinds: str) -> dict:
+    return {
+        "lon_min": lon_min,
+        "lon_max": lon_max,
+        "lat_min": lat_min,
+        "lat_max": lat_max,
+        "kinds": kinds,
+        "apikey": OPENTRIPMAP_API_KEY,
+        "format": "json",
+        "limit": OPENTRIPMAP_CELL_LIMIT,
+    }
+
+def _fetch_places_cell(lat_min: float, lat_max: float, lon_min: float, lon_max: float, kinds: str) -> list:
+    return http_client.get_json("opentripmap", OPENTRIPMAP_BBOX_URL, _bbox_params(lat_min, lat_max, lon_min, lon_max, kinds))
+
+async def _afetch_places_cell(lat_min: float, lat_max: float, lon_min: float, lon_max: float, kinds: str) -> list:
+    return await http_client.aget_json("opentripmap", OPENTRIPMAP_BBOX_URL, _bbox_params(lat_min, lat_max, lon_min, lon_max, kinds))
+
+def _route_url(start_lon: float, start_lat: float, end_lon: float, end_lat: float) -> str:
+    return f"{OSRM_API_URL}/route/v1/driving/{start_lon},{start_lat};{end_lon},{end_lat}?overview=false"
+
+def _route_from_response(data: dict) -> dict:
+    if data.get("code") == "Ok":
+        return data.get("routes", [{}])[0]
+    else:
+        print(f"OSRM API returned an error: {data.get('message')}")
+        return {}
+
+@timed("get_places_of_interest")
 def get_places_of_interest(lon: float, lat: float, radius: int = 5000, kinds: str = "interesting_places") -> list:
     """
     Fetches a list of places of interest from OpenTripMap.
@@ -60,30 +231,50 @@ def get_places_of_interest(lon: float, lat: float, radius: int = 5000, kinds: st
         kinds (str): Comma-separated list of kinds of places to search for.
 
     Returns:
-        list: A list of features (places), or an empty list if an error occurs.
+        list: Up to 20 features (places) nearest to the center, or an empty
+              list if an error occurs.
     """
     if not OPENTRIPMAP_API_KEY:
         print("Warning: OPENTRIPMAP_API_KEY not set. Skipping place search.")
         return []
 
-    base_url = "https://api.opentripmap.com/0.1/en/places/radius"
-    params = {
-        "radius": radius,
-        "lon": lon,
-        "lat": lat,
-        "kinds": kinds,
-        "apikey": OPENTRIPMAP_API_KEY,
-        "format": "json",
-        "limit": 20,
-    }
-    try:
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching data from OpenTripMap: {e}")
+    # Served from the geohash tile cache; only uncached cells hit the API.
+    return places_in_radius(lon, lat, radius, kinds, _fetch_places_cell)
+
+@timed("get_places_of_interest")
+async def aget_places_of_interest(lon: float, lat: float, radius: int = 5000, kinds: str = "interesting_places") -> list:
+    """
+    Async version of get_places_of_interest.
+    """
+    if not OPENTRIPMAP_API_KEY:
+        print("Warning: OPENTRIPMAP_API_KEY not set. Skipping place search.")
         return []
 
+    return await aplaces_in_radius(lon, lat, radius, kinds, _afetch_places_cell)
+
+@timed("geocode")
+async def ageocode_destination(name: str):
+    """
+    Looks up a destination's coordinates with OpenTripMap's geoname service.
+
+    Args:
+        name (str): A place name, e.g. "Chiang Mai, Thailand".
+
+    Returns:
+        tuple: (lon, lat), or None if the place is unknown or an error occurs.
+    """
+    if not OPENTRIPMAP_API_KEY:
+        print("Warning: OPENTRIPMAP_API_KEY not set. Skipping geocoding.")
+        return None
+    try:
+        data = await http_client.aget_json("opentripmap", OPENTRIPMAP_GEONAME_URL,
+                                           {"name": name, "apikey": OPENTRIPMAP_API_KEY})
+        return float(data["lon"]), float(data["lat"])
+    except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+        print(f"Error geocoding '{name}': {e}")
+        return None
+
+@timed("get_route")
 def get_route(start_lon: float, start_lat: float, end_lon: float, end_lat: float) -> dict:
     """
     Fetches a route from the OSRM API.
@@ -97,16 +288,21 @@ def get_route(start_lon: float, start_lat: float, end_lon: float, end_lat: float
     Returns:
         dict: The route information from OSRM, or an empty dict if an error occurs.
     """
-    url = f"{OSRM_API_URL}/route/v1/driving/{start_lon},{start_lat};{end_lon},{end_lat}?overview=false"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        if data.get("code") == "Ok":
-            return data.get("routes", [{}])[0]
-        else:
-            print(f"OSRM API returned an error: {data.get('message')}")
-            return {}
-    except requests.exceptions.RequestException as e:
+        data = http_client.get_json("osrm", _route_url(start_lon, start_lat, end_lon, end_lat))
+        return _route_from_response(data)
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Error fetching data from OSRM: {e}")
+        return {}
+
+@timed("get_route")
+async def aget_route(start_lon: float, start_lat: float, end_lon: float, end_lat: float) -> dict:
+    """
+    Async version of get_route.
+    """
+    try:
+        data = await http_client.aget_json("osrm", _route_url(start_lon, start_lat, end_lon, end_lat))
+        return _route_from_response(data)
+    except (httpx.HTTPError, ValueError) as e:
         print(f"Error fetching data from OSRM: {e}")
         return {}
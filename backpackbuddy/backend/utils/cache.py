@@ -0,0 +1,202 @@
+"""
+This module contains the response cache used in front of the LLM agents.
+It has an in-process LRU tier and an optional on-disk SQLite tier so that
+hot entries survive worker restarts.
+"""
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "512"))
+CACHE_TTL_SECONDS = float(os.environ.get("CACHE_TTL_SECONDS", "86400"))
+CACHE_SQLITE_PATH = os.environ.get("CACHE_SQLITE_PATH", "")
+CACHE_MAX_DISK_ENTRIES = int(os.environ.get("CACHE_MAX_DISK_ENTRIES", "10000"))
+
+
+# --- Key Helpers ---
+def normalize_text(value: str) -> str:
+    """Lower-cases a string and collapses all runs of whitespace."""
+    return " ".join(str(value).split()).lower()
+
+def content_hash(payload) -> str:
+    """
+    Returns the sha256 hex digest of a payload's canonical JSON, so that
+    logically equal payloads (e.g. with reordered dict keys) share a hash.
+    """
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def make_cache_key(namespace: str, payload) -> str:
+    """
+    Builds a stable cache key from any JSON-serializable payload.
+
+    Args:
+        namespace (str): Prefix separating different kinds of entries.
+        payload: The data identifying the entry.
+
+    Returns:
+        str: A key of the form ``"<namespace>:<content hash>"``.
+    """
+    return f"{namespace}:{content_hash(payload)}"
+
+def itinerary_request_key(destination: str, travel_dates: str, budget_mode: str, preferences: str,
+                          generation_mode: str = "single") -> str:
+    """
+    Returns the cache key for an itinerary request, ignoring case and
+    whitespace. Each generation mode is cached separately.
+    """
+    return make_cache_key("itinerary", {
+        "destination": normalize_text(destination),
+        "travel_dates": normalize_text(travel_dates),
+        "budget_mode": normalize_text(budget_mode),
+        "preferences": normalize_text(preferences),
+        "generation_mode": generation_mode,
+    })
+
+
+# --- Cache ---
+class ResponseCache:
+    """
+    Two-tier TTL cache for JSON-serializable values.
+
+    The memory tier is an LRU bounded by ``max_entries``. When ``sqlite_path``
+    is set, entries are also written to a SQLite table bounded by
+    ``max_disk_entries`` (least recently used rows are dropped first), and
+    memory misses are served from disk.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl_seconds: float = CACHE_TTL_SECONDS,
+                 sqlite_path: str = "", max_disk_entries: int = CACHE_MAX_DISK_ENTRIES,
+                 table: str = "cache"):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._table = table
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if sqlite_path:
+            self._conn = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_access ON {table} (last_access)")
+            self._conn.commit()
+
+    def get(self, key: str):
+        """
+        Looks up a key in memory, then on disk.
+
+        Returns:
+            The cached value, or None if missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    f"SELECT value, expires_at FROM {self._table} WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    if row[1] > now:
+                        self._conn.execute(f"UPDATE {self._table} SET last_access = ? WHERE key = ?", (now, key))
+                        self._conn.commit()
+                        value = json.loads(row[0])
+                        self._store_in_memory(key, value, row[1])
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return copy.deepcopy(value)
+                    self._conn.execute(f"DELETE FROM {self._table} WHERE key = ?", (key,))
+                    self._conn.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value, ttl_seconds: float = None):
+        """
+        Stores a value in both tiers.
+
+        Args:
+            key (str): The cache key.
+            value: Any JSON-serializable value.
+            ttl_seconds (float): Overrides the cache-wide TTL for this entry.
+        """
+        now = time.time()
+        expires_at = now + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with self._lock:
+            self._store_in_memory(key, copy.deepcopy(value), expires_at)
+            if self._conn is not None:
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO {self._table} (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), expires_at, now),
+                )
+                self._evict_disk(now)
+                self._conn.commit()
+
+    def delete(self, key: str):
+        """Removes a key from both tiers."""
+        with self._lock:
+            self._entries.pop(key, None)
+            if self._conn is not None:
+                self._conn.execute(f"DELETE FROM {self._table} WHERE key = ?", (key,))
+                self._conn.commit()
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters and current tier sizes."""
+        with self._lock:
+            disk_entries = None
+            if self._conn is not None:
+                disk_entries = self._conn.execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._entries),
+                "disk_entries": disk_entries,
+            }
+
+    def _store_in_memory(self, key: str, value, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _evict_disk(self, now: float):
+        self._conn.execute(f"DELETE FROM {self._table} WHERE expires_at <= ?", (now,))
+        overflow = self._conn.execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()[0] - self.max_disk_entries
+        if overflow > 0:
+            self._conn.execute(
+                f"DELETE FROM {self._table} WHERE key IN (SELECT key FROM {self._table} ORDER BY last_access LIMIT ?)",
+                (overflow,),
+            )
+            self.evictions += overflow
+
+
+# Shared caches for the agents. Both use the same SQLite file when enabled,
+# each in its own table so their size caps are independent.
+itinerary_cache = ResponseCache(sqlite_path=CACHE_SQLITE_PATH, table="itinerary_cache")
+packing_list_cache = ResponseCache(sqlite_path=CACHE_SQLITE_PATH, table="packing_list_cache")
@@ -0,0 +1,72 @@
+"""
+This module contains helpers for bounding concurrent work inside the
+async API, such as in-flight LLM generations.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "64"))
+
+
+class QueueFullError(Exception):
+    """Raised when a limiter is saturated and its wait queue is full."""
+
+
+class ConcurrencyLimiter:
+    """
+    Caps the number of concurrently running tasks and the number of tasks
+    allowed to wait for a free slot. Callers beyond the queue depth are
+    rejected immediately instead of piling up on the event loop.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._active = 0
+
+    def is_full(self) -> bool:
+        """Returns True if a new caller of ``slot()`` would be rejected right now."""
+        return self._semaphore.locked() and self._waiting >= self.max_queue
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Acquires a slot for the duration of the ``async with`` block.
+
+        Raises:
+            QueueFullError: If all slots are busy and the wait queue is full.
+        """
+        if self.is_full():
+            raise QueueFullError(
+                f"{self._active} tasks running and {self._waiting} waiting; try again later."
+            )
+
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        self._active += 1
+        try:
+            yield
+        finally:
+            self._active -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        """Returns the current number of running and waiting tasks."""
+        return {
+            "active": self._active,
+            "waiting": self._waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+        }
+
+
+# Shared limiter for all LLM-backed endpoints in this worker.
+llm_limiter = ConcurrencyLimiter(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE)
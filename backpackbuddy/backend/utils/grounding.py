@@ -0,0 +1,296 @@
+"""
+This module contains the destination grounding stage. Before an itinerary
+is generated, web search results (Serper) and points of interest
+(OpenTripMap) for the destination are fetched concurrently, condensed into
+a short text block and injected into the prompt, so the model plans around
+real places and coordinates instead of guessing them.
+
+Summaries are cached per destination with a TTL. A background loop keeps
+the configured and the most requested destinations warm, so for popular
+trips grounding is a cache hit and adds no latency to the request.
+"""
+import asyncio
+import os
+import time
+from collections import Counter
+
+from backend.utils.api_clients import (
+    OPENTRIPMAP_API_KEY, SERPER_API_KEY, aget_places_of_interest, ageocode_destination, asearch_web
+)
+from backend.utils.cache import CACHE_SQLITE_PATH, ResponseCache, make_cache_key, normalize_text
+from backend.utils.metrics import timed
+from backend.utils.singleflight import inflight_requests
+
+GROUNDING_ENABLED = os.environ.get("GROUNDING_ENABLED", "true").lower() == "true"
+GROUNDING_TTL_SECONDS = float(os.environ.get("GROUNDING_TTL_SECONDS", "86400"))
+# Destinations where both sources came back empty are retried sooner.
+GROUNDING_EMPTY_TTL_SECONDS = float(os.environ.get("GROUNDING_EMPTY_TTL_SECONDS", "600"))
+# How long a request waits for a cold destination before generating without
+# grounding (the fetch still completes and fills the cache); 0 never waits.
+GROUNDING_WAIT_SECONDS = float(os.environ.get("GROUNDING_WAIT_SECONDS", "2.0"))
+# Destinations kept warm from startup, separated by ";" (names contain commas).
+# None by default: every one costs Serper and OpenTripMap calls per refresh.
+GROUNDING_PREWARM_DESTINATIONS = [
+    d.strip() for d in os.environ.get("GROUNDING_PREWARM_DESTINATIONS", "").split(";") if d.strip()
+]
+# The most requested destinations are kept warm as well.
+GROUNDING_PREWARM_TOP = int(os.environ.get("GROUNDING_PREWARM_TOP", "20"))
+GROUNDING_REFRESH_SECONDS = float(os.environ.get("GROUNDING_REFRESH_SECONDS", "600"))
+GROUNDING_RADIUS_METERS = int(os.environ.get("GROUNDING_RADIUS_METERS", "10000"))
+GROUNDING_MAX_PLACES = int(os.environ.get("GROUNDING_MAX_PLACES", "12"))
+GROUNDING_MAX_SNIPPETS = 4
+GROUNDING_MAX_CHARS = 1500
+GROUNDING_PREWARM_CONCURRENCY = 2
+
+NO_GROUNDING = "None available."
+
+_grounding_cache = ResponseCache(
+    max_entries=1024,
+    ttl_seconds=GROUNDING_TTL_SECONDS,
+    sqlite_path=CACHE_SQLITE_PATH,
+    table="grounding_cache",
+)
+
+
+# --- Summaries ---
+def _rating(place: dict) -> int:
+    # OpenTripMap rates places 0-3, with an "h" suffix for heritage sites.
+    try:
+        return int(str(place.get("rate", 0)).rstrip("h") or 0)
+    except ValueError:
+        return 0
+
+def _place_lines(places: list) -> list:
+    named = [p for p in places if (p.get("name") or "").strip() and isinstance(p.get("point"), dict)]
+    named.sort(key=lambda p: (-_rating(p), p.get("dist", 0)))
+    lines, seen = [], set()
+    for place in named:
+        name = place["name"].strip()
+        if name.lower() in seen:
+            continue
+        seen.add(name.lower())
+        kinds = ", ".join(k.replace("_", " ") for k in (place.get("kinds") or "").split(",")[:2] if k)
+        point = place["point"]
+        lines.append(f"- {name} @ {point['lat']:.4f},{point['lon']:.4f}" + (f" ({kinds})" if kinds else ""))
+        if len(lines) >= GROUNDING_MAX_PLACES:
+            break
+    return lines
+
+def _snippet_lines(results: dict) -> list:
+    snippets = []
+    graph = results.get("knowledgeGraph") or {}
+    if graph.get("description"):
+        snippets.append(graph["description"])
+    answer = results.get("answerBox") or {}
+    if answer.get("snippet") or answer.get("answer"):
+        snippets.append(answer.get("snippet") or answer.get("answer"))
+    for item in results.get("organic") or []:
+        if item.get("snippet"):
+            snippets.append(f"{item.get('title', '')}: {item['snippet']}".strip(": "))
+    return [f"- {' '.join(s.split())}" for s in snippets[:GROUNDING_MAX_SNIPPETS]]
+
+def summarize_context(places: list, search_results: dict) -> str:
+    """
+    Condenses OpenTripMap places and Serper results into the prompt block.
+
+    Returns:
+        str: At most GROUNDING_MAX_CHARS characters, or "" if there is nothing to say.
+    """
+    sections = []
+    place_lines = _place_lines(places)
+    if place_lines:
+        sections.append("Places (name @ lat,lon):\n" + "\n".join(place_lines))
+    snippet_lines = _snippet_lines(search_results)
+    if snippet_lines:
+        sections.append("Web notes:\n" + "\n".join(snippet_lines))
+    text = "\n".join(sections)
+    if len(text) > GROUNDING_MAX_CHARS:
+        text = text[:GROUNDING_MAX_CHARS].rsplit("\n", 1)[0]
+    return text
+
+
+# --- Grounder ---
+class DestinationGrounder:
+    """
+    Fetches, caches and pre-warms destination summaries.
+
+    Concurrent fetches for one destination are coalesced, and a fetch that
+    outlives a request's wait keeps running in the background.
+    """
+
+    def __init__(self, cache=_grounding_cache, enabled: bool = GROUNDING_ENABLED,
+                 wait_seconds: float = GROUNDING_WAIT_SECONDS):
+        self.cache = cache
+        # Without either key there is nothing to fetch.
+        self.enabled = enabled and bool(SERPER_API_KEY or OPENTRIPMAP_API_KEY)
+        self.wait_seconds = wait_seconds
+        self._requested = Counter()
+        self._names = {}
+        self._prewarm_task = None
+        # Strong references to background tasks; the event loop only keeps
+        # weak ones, so an unreferenced task can be collected mid-run.
+        self._tasks = set()
+        self.hits = 0
+        self.misses = 0
+        self.timeouts = 0
+        self.fetches = 0
+        self.fetch_failures = 0
+        self.prewarmed = 0
+
+    @staticmethod
+    def _key(destination: str) -> str:
+        return make_cache_key("grounding", normalize_text(destination))
+
+    def get_cached(self, destination: str) -> str:
+        """Returns the cached summary for a destination, or "" without fetching."""
+        if not self.enabled:
+            return ""
+        entry = self.cache.get(self._key(destination))
+        return entry["summary"] if entry else ""
+
+    async def aget(self, destination: str) -> str:
+        """
+        Returns the summary for a destination, fetching it on a miss for at
+        most ``wait_seconds``.
+
+        Returns:
+            str: The summary, or "" if none is available in time.
+        """
+        if not self.enabled:
+            return ""
+        self._record_request(destination)
+        entry = self.cache.get(self._key(destination))
+        if entry is not None:
+            self.hits += 1
+            return entry["summary"]
+
+        self.misses += 1
+        if self.wait_seconds <= 0:
+            self._refresh_in_background(destination)
+            return ""
+        try:
+            entry = await asyncio.wait_for(self._refresh(destination), self.wait_seconds)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return ""
+        except Exception as e:
+            print(f"Grounding failed for {destination}: {e}")
+            return ""
+        return entry["summary"]
+
+    @timed("grounding_fetch")
+    async def afetch(self, destination: str) -> dict:
+        """Fetches web results and places for a destination concurrently and summarizes them."""
+        async def places():
+            coords = await ageocode_destination(destination)
+            if coords is None:
+                return []
+            return await aget_places_of_interest(*coords, radius=GROUNDING_RADIUS_METERS)
+
+        search_results, found_places = await asyncio.gather(
+            asearch_web(f"{destination} top sights and local tips for backpackers"),
+            places(),
+        )
+        return {"summary": summarize_context(found_places, search_results), "fetched_at": time.time()}
+
+    async def _refresh(self, destination: str) -> dict:
+        """Fetches a destination once among concurrent callers and stores it."""
+        async def fetch():
+            self.fetches += 1
+            try:
+                entry = await self.afetch(destination)
+            except Exception:
+                self.fetch_failures += 1
+                raise
+            ttl = GROUNDING_TTL_SECONDS if entry["summary"] else GROUNDING_EMPTY_TTL_SECONDS
+            self.cache.set(self._key(destination), entry, ttl_seconds=ttl)
+            return entry
+
+        return await inflight_requests.do(self._key(destination), fetch)
+
+    def _refresh_in_background(self, destination: str):
+        async def refresh():
+            try:
+                await self._refresh(destination)
+            except Exception as e:
+                print(f"Grounding failed for {destination}: {e}")
+
+        self._spawn(refresh())
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _record_request(self, destination: str):
+        normalized = normalize_text(destination)
+        self._requested[normalized] += 1
+        self._names.setdefault(normalized, destination)
+        if len(self._requested) > 10 * max(GROUNDING_PREWARM_TOP, 100):
+            # Keep the counts bounded; only the top destinations matter.
+            self._requested = Counter(dict(self._requested.most_common(GROUNDING_PREWARM_TOP * 5)))
+            self._names = {k: self._names[k] for k in self._requested}
+
+    # --- Pre-warming ---
+    def popular_destinations(self) -> list:
+        """Returns the configured destinations followed by the most requested ones."""
+        destinations = {normalize_text(d): d for d in GROUNDING_PREWARM_DESTINATIONS}
+        for normalized, _ in self._requested.most_common(GROUNDING_PREWARM_TOP):
+            destinations.setdefault(normalized, self._names[normalized])
+        return list(destinations.values())
+
+    async def aprewarm(self, destinations: list):
+        """
+        Fetches the destinations that are missing or will expire before the
+        next refresh round.
+        """
+        semaphore = asyncio.Semaphore(GROUNDING_PREWARM_CONCURRENCY)
+        stale_after = GROUNDING_TTL_SECONDS - 2 * GROUNDING_REFRESH_SECONDS
+
+        async def warm(destination: str):
+            entry = self.cache.get(self._key(destination))
+            if entry is not None and time.time() - entry["fetched_at"] < stale_after:
+                return
+            async with semaphore:
+                try:
+                    await self._refresh(destination)
+                    self.prewarmed += 1
+                except Exception as e:
+                    print(f"Grounding pre-warm failed for {destination}: {e}")
+
+        await asyncio.gather(*(warm(d) for d in destinations))
+
+    async def _prewarm_loop(self):
+        while True:
+            await self.aprewarm(self.popular_destinations())
+            await asyncio.sleep(GROUNDING_REFRESH_SECONDS)
+
+    def start(self):
+        """Starts the background pre-warm loop (call from the event loop)."""
+        if self.enabled and self._prewarm_task is None:
+            self._prewarm_task = self._spawn(self._prewarm_loop())
+
+    async def aclose(self):
+        """Stops the pre-warm loop and any background refreshes."""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._prewarm_task = None
+
+    def stats(self) -> dict:
+        """Returns lookup and fetch counters, and the cache's own stats."""
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "timeouts": self.timeouts,
+            "fetches": self.fetches,
+            "fetch_failures": self.fetch_failures,
+            "prewarmed": self.prewarmed,
+            "cache": self.cache.stats(),
+        }
+
+
+destination_grounder = DestinationGrounder()
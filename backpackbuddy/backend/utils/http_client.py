@@ -0,0 +1,255 @@
+"""
+This module contains the shared, connection-pooled HTTP client used for
+calls to the travel APIs (OpenTripMap, OSRM). It offers the same request
+path in sync and async flavours with keep-alive, per-host connection
+limits, explicit timeouts and jittered retries on 429/5xx responses.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import httpx
+
+from backend.utils.metrics import UPSTREAM_SECONDS, trace_event
+
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "10"))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE = float(os.environ.get("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.environ.get("HTTP_BACKOFF_MAX", "8"))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", "10"))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# --- Latency Stats ---
+class UpstreamStats:
+    """Keeps call counts and a window of recent latencies for one upstream."""
+
+    def __init__(self, window: int = 500):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_seconds = 0.0
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool, retries: int):
+        with self._lock:
+            self.requests += 1
+            self.retries += retries
+            self.total_seconds += seconds
+            self._samples.append(seconds)
+            if not ok:
+                self.errors += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = sorted(self._samples)
+            requests = self.requests
+
+            def percentile(p):
+                if not samples:
+                    return 0.0
+                return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 2)
+
+            return {
+                "requests": requests,
+                "errors": self.errors,
+                "retries": self.retries,
+                "avg_ms": round(self.total_seconds / requests * 1000, 2) if requests else 0.0,
+                "p50_ms": percentile(0.50),
+                "p95_ms": percentile(0.95),
+                "max_ms": round(samples[-1] * 1000, 2) if samples else 0.0,
+            }
+
+
+# --- Client ---
+class PooledHTTPClient:
+    """
+    Wraps one sync and one async httpx client sharing the same settings.
+
+    Every request is tagged with an ``upstream`` name (e.g. "osrm") that is
+    used for the latency stats.
+    """
+
+    def __init__(self, connect_timeout: float = HTTP_CONNECT_TIMEOUT, read_timeout: float = HTTP_READ_TIMEOUT,
+                 max_retries: int = HTTP_MAX_RETRIES, max_connections_per_host: int = HTTP_MAX_CONNECTIONS_PER_HOST):
+        self.max_retries = max_retries
+        self.max_connections_per_host = max_connections_per_host
+        self._timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._limits = httpx.Limits(
+            max_connections=None,
+            max_keepalive_connections=max_connections_per_host * 4,
+            keepalive_expiry=30,
+        )
+        self._client = None
+        self._async_client = None
+        self._async_loop = None
+        self._host_locks = {}
+        self._async_host_locks = {}
+        self._init_lock = threading.Lock()
+        self._stats = {}
+
+    # -- sync --
+    def get_json(self, upstream: str, url: str, params: dict = None):
+        """
+        Performs a GET request and returns the decoded JSON body.
+
+        Args:
+            upstream (str): Name used to group latency stats.
+            url (str): The full request URL.
+            params (dict): Optional query parameters.
+
+        Raises:
+            httpx.HTTPError: If the request still fails after all retries.
+        """
+        client = self._get_client()
+        host_lock = self._host_lock(url)
+        start = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    with host_lock:
+                        response = client.get(url, params=params)
+                    if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                        time.sleep(self._backoff(attempt, response))
+                        attempt += 1
+                        continue
+                    response.raise_for_status()
+                    data = response.json()
+                except httpx.TransportError:
+                    if attempt < self.max_retries:
+                        time.sleep(self._backoff(attempt))
+                        attempt += 1
+                        continue
+                    raise
+                self._record(upstream, start, True, attempt)
+                return data
+        except Exception:
+            self._record(upstream, start, False, attempt)
+            raise
+
+    # -- async --
+    async def aget_json(self, upstream: str, url: str, params: dict = None):
+        """
+        Async version of get_json.
+
+        Raises:
+            httpx.HTTPError: If the request still fails after all retries.
+        """
+        client = self._get_async_client()
+        host_lock = self._async_host_lock(url)
+        start = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    async with host_lock:
+                        response = await client.get(url, params=params)
+                    if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                        await asyncio.sleep(self._backoff(attempt, response))
+                        attempt += 1
+                        continue
+                    response.raise_for_status()
+                    data = response.json()
+                except httpx.TransportError:
+                    if attempt < self.max_retries:
+                        await asyncio.sleep(self._backoff(attempt))
+                        attempt += 1
+                        continue
+                    raise
+                self._record(upstream, start, True, attempt)
+                return data
+        except Exception:
+            self._record(upstream, start, False, attempt)
+            raise
+
+    def stats(self) -> dict:
+        """Returns latency and error stats per upstream."""
+        return {name: stats.snapshot() for name, stats in self._stats.items()}
+
+    def close(self):
+        """Closes the sync client's pooled connections."""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self):
+        """Closes the async client's pooled connections."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    # -- internals --
+    def _get_client(self) -> httpx.Client:
+        if self._client is None:
+            with self._init_lock:
+                if self._client is None:
+                    self._client = httpx.Client(timeout=self._timeout, limits=self._limits)
+        return self._client
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        # Async connections are bound to the event loop that opened them.
+        loop = asyncio.get_running_loop()
+        if self._async_client is not None and self._async_loop is not loop:
+            self._retire_async_client()
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(timeout=self._timeout, limits=self._limits)
+            self._async_loop = loop
+            self._async_host_locks = {}
+        return self._async_client
+
+    def _retire_async_client(self):
+        """Closes the async client of a previous event loop on that loop."""
+        client, loop = self._async_client, self._async_loop
+        self._async_client = None
+        self._async_loop = None
+        if loop.is_closed():
+            # Nothing can run on it any more; the sockets are released when
+            # the client is garbage collected.
+            print("Dropping an HTTP client whose event loop was closed without aclose()")
+        elif loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            # Runs when the loop is next run (e.g. asyncio.run's cleanup).
+            loop.create_task(client.aclose())
+
+    def _host_lock(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._init_lock:
+            if host not in self._host_locks:
+                self._host_locks[host] = threading.BoundedSemaphore(self.max_connections_per_host)
+            return self._host_locks[host]
+
+    def _async_host_lock(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self._async_host_locks:
+            self._async_host_locks[host] = asyncio.Semaphore(self.max_connections_per_host)
+        return self._async_host_locks[host]
+
+    def _backoff(self, attempt: int, response: httpx.Response = None) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return min(float(retry_after), HTTP_BACKOFF_MAX)
+        # "Full jitter" exponential backoff.
+        return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+    def _record(self, upstream: str, start: float, ok: bool, retries: int):
+        stats = self._stats.get(upstream)
+        if stats is None:
+            stats = self._stats.setdefault(upstream, UpstreamStats())
+        seconds = time.perf_counter() - start
+        stats.record(seconds, ok, retries)
+        UPSTREAM_SECONDS.observe(seconds, upstream=upstream, outcome="ok" if ok else "error")
+        trace_event(upstream, seconds, ok=ok, retries=retries)
+
+
+# Process-wide client shared by all travel API helpers.
+http_client = PooledHTTPClient()
@@ -0,0 +1,417 @@
+"""
+This module contains the background job queue. Long-running work (a full
+trip with its packing list and PDF) is submitted as a job that returns an ID
+at once; a bounded pool of worker tasks processes the jobs while clients poll
+or long-poll for the result, so no HTTP connection is held open for the
+whole generation.
+
+Job state lives in a JobStore (in memory, or SQLite to survive restarts and
+be readable from every worker process); the runner only keeps the IDs of
+jobs waiting to be picked up.
+"""
+import asyncio
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from backend.utils.concurrency import QueueFullError
+
+JOB_STORE_BACKEND = os.environ.get("JOB_STORE_BACKEND", "memory")
+JOB_STORE_SQLITE_PATH = os.environ.get("JOB_STORE_SQLITE_PATH", "jobs.db")
+JOB_STORE_MAX_JOBS = int(os.environ.get("JOB_STORE_MAX_JOBS", "10000"))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_MAX_PENDING = int(os.environ.get("JOB_MAX_PENDING", "256"))
+# Upper bound on a single long-poll, below typical load balancer idle timeouts.
+JOB_MAX_WAIT_SECONDS = float(os.environ.get("JOB_MAX_WAIT_SECONDS", "30"))
+# How often a long-poll re-reads the store, for jobs run by another process.
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "0.5"))
+# How long a job waits before retrying when the LLM limiter is full.
+JOB_BUSY_RETRY_SECONDS = float(os.environ.get("JOB_BUSY_RETRY_SECONDS", "1"))
+# Retries before a job that keeps finding the LLM limiter full is failed.
+JOB_BUSY_MAX_RETRIES = int(os.environ.get("JOB_BUSY_MAX_RETRIES", "60"))
+# Jobs left running (by a crash) are re-queued at startup once they have not
+# been updated for this long. 0 re-queues all of them; with several
+# processes sharing a SQLite store, set it above the longest job.
+JOB_RUNNING_TIMEOUT_SECONDS = float(os.environ.get("JOB_RUNNING_TIMEOUT_SECONDS", "0"))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+
+class JobNotFoundError(KeyError):
+    """Raised when a job ID is not in the store."""
+
+
+def _new_job(kind: str, payload: dict) -> dict:
+    now = time.time()
+    return {
+        "job_id": uuid.uuid4().hex,
+        "kind": kind,
+        "status": QUEUED,
+        "stage": None,
+        "payload": payload,
+        "result": {},
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+class JobStore:
+    """
+    Interface for job stores. Records are dicts with ``job_id``, ``kind``,
+    ``status``, ``stage``, ``payload``, ``result``, ``error``,
+    ``created_at`` and ``updated_at``.
+    """
+
+    def create(self, kind: str, payload: dict) -> dict:
+        """Stores a new queued job and returns its record."""
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> dict:
+        """
+        Loads a job.
+
+        Raises:
+            JobNotFoundError: If the job does not exist.
+        """
+        raise NotImplementedError
+
+    def claim(self, job_id: str) -> dict:
+        """
+        Moves a queued job to running.
+
+        Returns:
+            dict: The job record, or None if the job is no longer queued
+                  (e.g. another process claimed it first).
+        """
+        raise NotImplementedError
+
+    def update(self, job_id: str, **fields) -> dict:
+        """Changes fields of a job and returns the updated record."""
+        raise NotImplementedError
+
+    def queued(self) -> list:
+        """Returns the IDs of queued jobs, oldest first."""
+        raise NotImplementedError
+
+    def requeue_running(self, updated_before: float) -> list:
+        """
+        Moves running jobs last updated before ``updated_before`` back to
+        queued (their worker is gone).
+
+        Returns:
+            list: The IDs of the re-queued jobs.
+        """
+        raise NotImplementedError
+
+
+class InMemoryJobStore(JobStore):
+    """Keeps jobs in process memory, dropping the oldest finished ones."""
+
+    def __init__(self, max_jobs: int = JOB_STORE_MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, kind: str, payload: dict) -> dict:
+        record = _new_job(kind, copy.deepcopy(payload))
+        with self._lock:
+            self._jobs[record["job_id"]] = record
+            if len(self._jobs) > self.max_jobs:
+                for job_id in [j for j, r in self._jobs.items() if r["status"] in FINISHED]:
+                    del self._jobs[job_id]
+                    if len(self._jobs) <= self.max_jobs:
+                        break
+            return copy.deepcopy(record)
+
+    def get(self, job_id: str) -> dict:
+        with self._lock:
+            record = self._jobs.get(job_id)
+            if record is None:
+                raise JobNotFoundError(job_id)
+            return copy.deepcopy(record)
+
+    def claim(self, job_id: str) -> dict:
+        with self._lock:
+            record = self._jobs.get(job_id)
+            if record is None or record["status"] != QUEUED:
+                return None
+            record.update(status=RUNNING, updated_at=time.time())
+            return copy.deepcopy(record)
+
+    def update(self, job_id: str, **fields) -> dict:
+        with self._lock:
+            record = self._jobs.get(job_id)
+            if record is None:
+                raise JobNotFoundError(job_id)
+            record.update(copy.deepcopy(fields), updated_at=time.time())
+            return copy.deepcopy(record)
+
+    def queued(self) -> list:
+        with self._lock:
+            return [job_id for job_id, record in self._jobs.items() if record["status"] == QUEUED]
+
+    def requeue_running(self, updated_before: float) -> list:
+        with self._lock:
+            job_ids = [job_id for job_id, record in self._jobs.items()
+                       if record["status"] == RUNNING and record["updated_at"] <= updated_before]
+            for job_id in job_ids:
+                self._jobs[job_id].update(status=QUEUED, stage=None, updated_at=time.time())
+            return job_ids
+
+
+class SQLiteJobStore(JobStore):
+    """Persists jobs in a SQLite database shared by all worker processes."""
+
+    COLUMNS = ("job_id", "kind", "status", "stage", "payload", "result", "error", "created_at", "updated_at")
+    JSON_COLUMNS = ("payload", "result")
+
+    def __init__(self, path: str = JOB_STORE_SQLITE_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, stage TEXT, "
+            "payload TEXT NOT NULL, result TEXT NOT NULL, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._conn.commit()
+
+    def _row_to_record(self, row) -> dict:
+        record = dict(zip(self.COLUMNS, row))
+        for column in self.JSON_COLUMNS:
+            record[column] = json.loads(record[column])
+        return record
+
+    def create(self, kind: str, payload: dict) -> dict:
+        record = _new_job(kind, payload)
+        values = [json.dumps(record[c]) if c in self.JSON_COLUMNS else record[c] for c in self.COLUMNS]
+        with self._lock:
+            self._conn.execute(f"INSERT INTO jobs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(values))})",
+                               values)
+            self._conn.commit()
+        return record
+
+    def get(self, job_id: str) -> dict:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE job_id = ?",
+                                     (job_id,)).fetchone()
+        if row is None:
+            raise JobNotFoundError(job_id)
+        return self._row_to_record(row)
+
+    def claim(self, job_id: str) -> dict:
+        with self._lock:
+            claimed = self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ? AND status = ?",
+                (RUNNING, time.time(), job_id, QUEUED),
+            ).rowcount
+            self._conn.commit()
+        return self.get(job_id) if claimed else None
+
+    def update(self, job_id: str, **fields) -> dict:
+        fields["updated_at"] = time.time()
+        columns = [c for c in fields if c in self.COLUMNS]
+        values = [json.dumps(fields[c]) if c in self.JSON_COLUMNS else fields[c] for c in columns]
+        with self._lock:
+            updated = self._conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{c} = ?' for c in columns)} WHERE job_id = ?", (*values, job_id)
+            ).rowcount
+            self._conn.commit()
+        if not updated:
+            raise JobNotFoundError(job_id)
+        return self.get(job_id)
+
+    def queued(self) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT job_id FROM jobs WHERE status = ? ORDER BY created_at",
+                                      (QUEUED,)).fetchall()
+        return [row[0] for row in rows]
+
+    def requeue_running(self, updated_before: float) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT job_id FROM jobs WHERE status = ? AND updated_at <= ?",
+                                      (RUNNING, updated_before)).fetchall()
+            job_ids = [row[0] for row in rows]
+            for job_id in job_ids:
+                # Only if still running: another process may have finished it meanwhile.
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, stage = NULL, updated_at = ? WHERE job_id = ? AND status = ?",
+                    (QUEUED, time.time(), job_id, RUNNING),
+                )
+            self._conn.commit()
+        return job_ids
+
+
+def create_job_store() -> JobStore:
+    """Creates the job store selected by JOB_STORE_BACKEND ("memory" or "sqlite")."""
+    if JOB_STORE_BACKEND == "sqlite":
+        return SQLiteJobStore(JOB_STORE_SQLITE_PATH)
+    return InMemoryJobStore()
+
+
+class JobRunner:
+    """
+    Runs jobs from a store on a fixed number of asyncio worker tasks.
+
+    Handlers are registered per job kind. A handler is called as
+    ``await handler(job, progress)``, where ``progress(stage, **result)``
+    records the current stage and merges partial results into the job, so
+    pollers see each stage's output as soon as it is ready. The handler's
+    return value is merged into the result; an exception fails the job.
+    """
+
+    def __init__(self, store: JobStore, workers: int = JOB_WORKERS, max_pending: int = JOB_MAX_PENDING):
+        self.store = store
+        self.workers = workers
+        self.max_pending = max_pending
+        self._handlers = {}
+        self._queue = None
+        self._tasks = []
+        self._events = {}
+        self._busy_retries = {}
+        self.completed = 0
+        self.failed = 0
+        self.recovered = 0
+
+    def register(self, kind: str, handler):
+        """Registers the coroutine function that runs jobs of ``kind``."""
+        self._handlers[kind] = handler
+
+    def start(self):
+        """
+        Starts the worker tasks and re-queues jobs left queued in the store,
+        along with jobs left running by a process that crashed.
+        """
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        recovered = self.store.requeue_running(time.time() - JOB_RUNNING_TIMEOUT_SECONDS)
+        if recovered:
+            print(f"Re-queued {len(recovered)} job(s) left running")
+            self.recovered += len(recovered)
+        for job_id in self.store.queued():
+            self._queue.put_nowait(job_id)
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def aclose(self):
+        """Stops the workers; unfinished jobs are put back in the store as queued."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, kind: str, payload: dict) -> dict:
+        """
+        Queues a job.
+
+        Returns:
+            dict: The new job record.
+
+        Raises:
+            QueueFullError: If ``max_pending`` jobs are already waiting.
+            ValueError: If no handler is registered for ``kind``.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        self.start()
+        if self._queue.qsize() >= self.max_pending:
+            raise QueueFullError(f"{self._queue.qsize()} jobs are already waiting; try again later.")
+        record = self.store.create(kind, payload)
+        self._queue.put_nowait(record["job_id"])
+        return record
+
+    async def wait(self, job_id: str, timeout: float) -> dict:
+        """
+        Returns the job once it has finished or after ``timeout`` seconds,
+        whichever comes first (long-polling).
+
+        Raises:
+            JobNotFoundError: If the job does not exist.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            record = self.store.get(job_id)
+            remaining = deadline - time.monotonic()
+            if record["status"] in FINISHED or remaining <= 0:
+                return record
+            event = self._events.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, JOB_POLL_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        """Returns queue depth and outcome counters."""
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "workers": len(self._tasks),
+            "completed": self.completed,
+            "failed": self.failed,
+            "recovered": self.recovered,
+        }
+
+    def _notify(self, job_id: str):
+        event = self._events.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"Job {job_id} could not be updated: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        job = self.store.claim(job_id)
+        if job is None:
+            return
+
+        def progress(stage: str, **result):
+            job["result"].update(result)
+            self.store.update(job_id, stage=stage, result=job["result"])
+            self._notify(job_id)
+
+        try:
+            result = await self._handlers[job["kind"]](job, progress)
+        except asyncio.CancelledError:
+            # Shutting down: leave the job for the next start to pick up.
+            self.store.update(job_id, status=QUEUED, stage=None)
+            raise
+        except QueueFullError as e:
+            retries = self._busy_retries.get(job_id, 0) + 1
+            if retries <= JOB_BUSY_MAX_RETRIES:
+                # The LLM limiter is saturated by interactive requests; try
+                # again shortly instead of failing a job nobody is waiting on yet.
+                self._busy_retries[job_id] = retries
+                self.store.update(job_id, status=QUEUED, stage=None)
+                await asyncio.sleep(JOB_BUSY_RETRY_SECONDS)
+                self._queue.put_nowait(job_id)
+                return
+            print(f"Job {job_id} failed after {JOB_BUSY_MAX_RETRIES} busy retries: {e}")
+            self.failed += 1
+            self.store.update(job_id, status=FAILED, error=str(e))
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self.failed += 1
+            self.store.update(job_id, status=FAILED, error=str(e))
+        else:
+            job["result"].update(result or {})
+            self.completed += 1
+            self.store.update(job_id, status=SUCCEEDED, stage=None, result=job["result"])
+        self._busy_retries.pop(job_id, None)
+        self._notify(job_id)
+
+
+job_runner = JobRunner(create_job_store())
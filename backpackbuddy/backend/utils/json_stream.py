@@ -0,0 +1,103 @@
+"""
+This module contains an incremental JSON parser used to pull complete
+objects out of a JSON array while the LLM is still streaming tokens.
+"""
+import json
+import re
+
+
+class MalformedItem:
+    """The raw text of an array item that is not valid JSON."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class ArrayItemStreamParser:
+    """
+    Incrementally extracts the objects of a named top-level array, e.g. the
+    days of ``{"itinerary": [{...}, {...}]}``, as soon as each one is closed.
+
+    Text is fed in arbitrary chunks; the parser keeps track of string
+    literals and escapes so braces inside descriptions don't confuse it.
+    Malformed items are skipped, or returned as MalformedItem when
+    ``keep_malformed`` is set so the caller can repair them.
+    """
+
+    def __init__(self, key: str, keep_malformed: bool = False):
+        self.keep_malformed = keep_malformed
+        self._key_pattern = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[')
+        self._buffer = ""
+        self._pos = 0
+        self._array_found = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._item_start = None
+
+    @property
+    def done(self) -> bool:
+        """True once the closing bracket of the array has been seen."""
+        return self._done
+
+    @property
+    def text(self) -> str:
+        """The full text received so far."""
+        return self._buffer
+
+    def feed(self, text: str) -> list:
+        """
+        Consumes the next chunk of model output.
+
+        Args:
+            text (str): The newly received text.
+
+        Returns:
+            list: Objects of the array that were completed by this chunk.
+        """
+        self._buffer += text
+        items = []
+
+        if not self._array_found:
+            match = self._key_pattern.search(self._buffer)
+            if not match:
+                return items
+            self._array_found = True
+            self._pos = match.end()
+
+        while self._pos < len(self._buffer) and not self._done:
+            char = self._buffer[self._pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0 and char == "{":
+                    self._item_start = self._pos
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0 and char == "]":
+                    self._done = True
+                else:
+                    self._depth -= 1
+                    if self._depth == 0 and self._item_start is not None:
+                        fragment = self._buffer[self._item_start:self._pos + 1]
+                        self._item_start = None
+                        try:
+                            items.append(json.loads(fragment))
+                        except json.JSONDecodeError as e:
+                            if self.keep_malformed:
+                                items.append(MalformedItem(fragment))
+                            else:
+                                print(f"Skipping malformed streamed item: {e}")
+
+            self._pos += 1
+
+        return items
@@ -0,0 +1,347 @@
+"""
+This module contains the LLM router that sits in front of the Groq clients.
+It keeps the tail latency of a slow or overloaded model from becoming ours:
+
+- Hedging: when the primary model has not answered within its recent
+  latency percentile, a duplicate request goes to the next model (or
+  endpoint). The first valid answer wins and the other call is cancelled.
+- Fallback: when a model fails, the request moves on to the next one.
+- Circuit breaking: a model that keeps failing is skipped for a while, then
+  tried again with a single probe request.
+
+The router is a LangChain Runnable, so agents use it like a chat model.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from langchain_core.runnables import Runnable
+
+from backend.utils.concurrency import QueueFullError
+from backend.utils.scheduled_llm import call_sent
+
+LLM_HEDGING = os.environ.get("LLM_HEDGING", "true").lower() == "true"
+# A hedge is sent once the primary is slower than this percentile of its
+# recent successful calls...
+LLM_HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", "95"))
+# ...but never sooner than this, and after this delay until enough calls
+# have been seen to estimate the percentile.
+LLM_HEDGE_MIN_DELAY = float(os.environ.get("LLM_HEDGE_MIN_DELAY", "1.0"))
+LLM_HEDGE_INITIAL_DELAY = float(os.environ.get("LLM_HEDGE_INITIAL_DELAY", "15"))
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_LATENCY_WINDOW = int(os.environ.get("LLM_LATENCY_WINDOW", "200"))
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.environ.get("LLM_BREAKER_RESET_SECONDS", "30"))
+
+
+class LLMUnavailableError(Exception):
+    """Raised when every route's circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failures`` consecutive failures. After ``reset_seconds``
+    one probe call is let through (half-open): success closes the breaker,
+    failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.max_failures = failures
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Returns whether a call may be sent now (claiming the probe when half-open)."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return self.state != self.OPEN
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.max_failures:
+                if self.state != self.OPEN:
+                    print(f"LLM circuit breaker opened after {self.failures} failures")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class LLMRoute:
+    """One model or endpoint the router can send calls to."""
+
+    def __init__(self, name: str, get_llm):
+        self.name = name
+        self._get_llm = get_llm
+        self.breaker = CircuitBreaker()
+        # Latencies of successful calls: full responses and first stream chunks.
+        self.latencies = {"invoke": deque(maxlen=LLM_LATENCY_WINDOW), "stream": deque(maxlen=LLM_LATENCY_WINDOW)}
+        self.calls = 0
+        self.failures = 0
+        self.wins = 0
+
+    @property
+    def llm(self):
+        return self._get_llm()
+
+    def hedge_delay(self, kind: str) -> float:
+        """Seconds to wait for this route before hedging."""
+        samples = self.latencies[kind]
+        if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_INITIAL_DELAY
+        return max(LLM_HEDGE_MIN_DELAY, float(np.percentile(samples, LLM_HEDGE_PERCENTILE)))
+
+    def stats(self) -> dict:
+        invoke = list(self.latencies["invoke"])
+        return {
+            "state": self.breaker.state,
+            "calls": self.calls,
+            "failures": self.failures,
+            "wins": self.wins,
+            "p50_s": round(float(np.percentile(invoke, 50)), 3) if invoke else None,
+            "p95_s": round(float(np.percentile(invoke, 95)), 3) if invoke else None,
+            "hedge_delay_s": round(self.hedge_delay("invoke"), 3),
+        }
+
+
+def _budget(route: LLMRoute):
+    """Returns the rate scheduler a route's calls are paced by, if it enforces a limit."""
+    scheduler = getattr(route.llm, "scheduler", None)
+    if scheduler is None or (scheduler.requests is None and scheduler.tokens is None):
+        return None
+    return scheduler
+
+def _shares_budget(a: LLMRoute, b: LLMRoute) -> bool:
+    budget = _budget(a)
+    return budget is not None and budget is _budget(b)
+
+def _has_content(response) -> bool:
+    content = response.content if hasattr(response, "content") else response
+    return bool(str(content).strip())
+
+
+class LLMRouter(Runnable):
+    """
+    Routes chat model calls over ``routes`` in priority order with hedging,
+    fallback and per-route circuit breakers.
+
+    A response counts only if ``validate(response)`` is true (by default,
+    it has content); an invalid response is treated like a failed call.
+    Rate-limit rejections (QueueFullError) move on to the next route but do
+    not count against the breaker. The hedge clock starts when the call
+    leaves its rate scheduler, and a hedge never goes to a route paced by
+    the same budget: a duplicate there would only queue behind the original.
+    """
+
+    def __init__(self, routes: list, hedging: bool = LLM_HEDGING, validate=_has_content):
+        self.routes = routes
+        self.hedging = hedging
+        self.validate = validate
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _next_route(self, tried: set):
+        for route in self.routes:
+            if route not in tried and route.breaker.allow():
+                return route
+        return None
+
+    def _hedge_route(self, tried: set, primary: LLMRoute):
+        for route in self.routes:
+            if route not in tried and not _shares_budget(route, primary) and route.breaker.allow():
+                return route
+        if (len(self.routes) == 1 and _budget(primary) is None
+                and primary.breaker.state == CircuitBreaker.CLOSED):
+            # With a single unpaced model, a duplicate to it still cuts the tail.
+            return primary
+        return None
+
+    def _record(self, route: LLMRoute, kind: str, started: float, error: Exception = None):
+        route.calls += 1
+        if error is None:
+            route.latencies[kind].append(time.monotonic() - started)
+            route.breaker.record_success()
+        elif not isinstance(error, QueueFullError):
+            route.failures += 1
+            route.breaker.record_failure()
+
+    def _raise_unavailable(self, last_error: Exception):
+        if last_error is not None:
+            raise last_error
+        raise LLMUnavailableError("Every LLM route is unavailable (circuit open); try again later.")
+
+    # --- Sync calls: fallback only ---
+    def invoke(self, input, config=None, **kwargs):
+        tried, last_error = set(), None
+        while True:
+            route = self._next_route(tried)
+            if route is None:
+                self._raise_unavailable(last_error)
+            tried.add(route)
+            started = time.monotonic()
+            try:
+                response = route.llm.invoke(input, config, **kwargs)
+                if not self.validate(response):
+                    raise ValueError(f"Invalid response from {route.name}")
+            except Exception as e:
+                print(f"LLM route {route.name} failed: {e}")
+                self._record(route, "invoke", started, e)
+                last_error = e
+                continue
+            self._record(route, "invoke", started)
+            route.wins += 1
+            return response
+
+    # --- Async calls: hedging and fallback ---
+    async def _race(self, kind: str, call, validate, discard=None):
+        """
+        Runs ``call(route)`` with hedging and fallback and returns the first
+        valid result. Finished results that lose are passed to ``discard``.
+        """
+        tried, last_error = set(), None
+        pending = {}
+
+        def start(route: LLMRoute) -> dict:
+            tried.add(route)
+            attempt = {"route": route, "sent": asyncio.Event(), "sent_at": None}
+
+            def sent():
+                if attempt["sent_at"] is None:
+                    attempt["sent_at"] = time.monotonic()
+                    attempt["sent"].set()
+
+            if _budget(route) is None:
+                sent()
+
+            async def run():
+                call_sent.set(sent)
+                return await call(route)
+
+            pending[asyncio.ensure_future(run())] = attempt
+            return attempt
+
+        def next_primary() -> tuple:
+            route = self._next_route(tried)
+            if route is None:
+                self._raise_unavailable(last_error)
+            attempt = start(route)
+            return route, attempt if self.hedging else None
+
+        primary, hedge_from = next_primary()
+        sent_waiter = None
+        try:
+            while pending:
+                waiters, timeout = set(pending), None
+                if hedge_from is not None and hedge_from["sent_at"] is not None:
+                    timeout = max(0.0, hedge_from["sent_at"] + primary.hedge_delay(kind) - time.monotonic())
+                elif hedge_from is not None:
+                    # Still waiting for rate-limit budget; the clock starts once it is sent.
+                    sent_waiter = asyncio.ensure_future(hedge_from["sent"].wait())
+                    waiters.add(sent_waiter)
+                done, _ = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if sent_waiter is not None:
+                    sent_waiter.cancel()
+                    done.discard(sent_waiter)
+                    sent_waiter = None
+                    if not done:
+                        continue
+                if not done:
+                    hedge_from = None
+                    route = self._hedge_route(tried, primary)
+                    if route is not None:
+                        print(f"Hedging slow LLM call on {primary.name} to {route.name}")
+                        self.hedges += 1
+                        start(route)
+                    continue
+
+                for task in done:
+                    attempt = pending.pop(task)
+                    route, sent_at = attempt["route"], attempt["sent_at"] or time.monotonic()
+                    try:
+                        result = task.result()
+                        if not validate(result):
+                            raise ValueError(f"Invalid response from {route.name}")
+                    except Exception as e:
+                        print(f"LLM route {route.name} failed: {e}")
+                        self._record(route, kind, sent_at, e)
+                        last_error = e
+                        continue
+                    self._record(route, kind, sent_at)
+                    route.wins += 1
+                    if route is not primary:
+                        self.hedge_wins += 1
+                    return result
+
+                if not pending:
+                    # Everything in flight failed; fall back to the next route.
+                    primary, hedge_from = next_primary()
+            self._raise_unavailable(last_error)
+        finally:
+            if sent_waiter is not None:
+                sent_waiter.cancel()
+            for task, attempt in pending.items():
+                task.cancel()
+                if attempt["sent_at"] is not None:
+                    # The loser took at least this long; recording it keeps the
+                    # percentile from drifting down to the hedged calls only.
+                    attempt["route"].latencies[kind].append(time.monotonic() - attempt["sent_at"])
+            if pending:
+                results = await asyncio.gather(*pending, return_exceptions=True)
+                if discard is not None:
+                    for result in results:
+                        if not isinstance(result, BaseException):
+                            await discard(result)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return await self._race("invoke", lambda route: route.llm.ainvoke(input, config, **kwargs), self.validate)
+
+    async def astream(self, input, config=None, **kwargs):
+        """
+        Streams from the first route to produce a chunk. Hedging and
+        fallback apply until the first chunk arrives; after that the
+        stream is committed to its route.
+        """
+        async def open_stream(route: LLMRoute):
+            stream = route.llm.astream(input, config, **kwargs).__aiter__()
+            try:
+                return stream, await stream.__anext__()
+            except BaseException:
+                await stream.aclose()
+                raise
+
+        async def discard(opened):
+            await opened[0].aclose()
+
+        stream, first = await self._race("stream", open_stream, lambda opened: True, discard)
+        yield first
+        async for chunk in stream:
+            yield chunk
+
+    def stats(self) -> dict:
+        """Returns per-route health and latency, and hedging counters."""
+        return {
+            "routes": {route.name: route.stats() for route in self.routes},
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
@@ -1,6 +1,340 @@
 """
-This module will contain utilities for handling map-related data,
-such as interacting with the OSRM API for routing and preparing
-map data for the frontend.
+This module contains utilities for handling map-related data. The offline
+geo engine orders each day's activities and estimates travel times from
+haversine distances without any network access; the OSRM ``table``
+service can optionally refine those estimates with real road legs.
 """
-pass
+import asyncio
+import os
+
+import httpx
+import numpy as np
+
+from backend.utils.api_clients import OSRM_API_URL
+from backend.utils.cache import ResponseCache
+from backend.utils.http_client import http_client
+from backend.utils.metrics import timed
+
+ENABLE_OSRM_ROUTING = os.environ.get("ENABLE_OSRM_ROUTING", "false").lower() in ("1", "true", "yes")
+OSRM_PROFILE = os.environ.get("OSRM_PROFILE", "driving")
+LEG_CACHE_PRECISION = int(os.environ.get("LEG_CACHE_PRECISION", "4"))
+LEG_CACHE_SIZE = int(os.environ.get("LEG_CACHE_SIZE", "20000"))
+
+GEO_AVG_SPEED_KMH = float(os.environ.get("GEO_AVG_SPEED_KMH", "25"))
+GEO_DETOUR_FACTOR = float(os.environ.get("GEO_DETOUR_FACTOR", "1.3"))
+GEO_MAX_DAY_KM = float(os.environ.get("GEO_MAX_DAY_KM", "60"))
+GEO_MAX_DAY_TRAVEL_MIN = float(os.environ.get("GEO_MAX_DAY_TRAVEL_MIN", "180"))
+GEO_REORDER_MIN_SAVING = float(os.environ.get("GEO_REORDER_MIN_SAVING", "0.15"))
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Legs keyed by rounded coordinate pairs. The rounding (4 decimals ~ 11 m)
+# lets slightly different LLM coordinates for the same place share a leg.
+_leg_cache = ResponseCache(max_entries=LEG_CACHE_SIZE)
+
+
+# --- Helpers ---
+def activity_coords(activity: dict):
+    """
+    Returns (lon, lat) for an activity, or None if it has no usable location.
+    """
+    location = activity.get("location") or {}
+    try:
+        return float(location["lon"]), float(location["lat"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _rounded(coord: tuple) -> tuple:
+    return round(coord[0], LEG_CACHE_PRECISION), round(coord[1], LEG_CACHE_PRECISION)
+
+def _leg_key(origin: tuple, destination: tuple) -> str:
+    (olon, olat), (dlon, dlat) = _rounded(origin), _rounded(destination)
+    return f"{OSRM_PROFILE}:{olon},{olat};{dlon},{dlat}"
+
+def _table_url(coords: list) -> str:
+    points = ";".join(f"{lon},{lat}" for lon, lat in (_rounded(c) for c in coords))
+    return f"{OSRM_API_URL}/table/v1/{OSRM_PROFILE}/{points}"
+
+def _cached_legs(coords: list):
+    """Returns the consecutive legs from the cache, or None if any is missing."""
+    legs = []
+    for origin, destination in zip(coords, coords[1:]):
+        leg = _leg_cache.get(_leg_key(origin, destination))
+        if leg is None:
+            return None
+        legs.append(leg)
+    return legs
+
+def _legs_from_table(coords: list, data: dict) -> list:
+    """
+    Stores every pair of the OSRM matrix in the leg cache and returns the
+    legs between consecutive coordinates.
+    """
+    if data.get("code") != "Ok":
+        print(f"OSRM table service returned an error: {data.get('message')}")
+        return []
+
+    durations = data.get("durations") or []
+    distances = data.get("distances") or []
+    for i, origin in enumerate(coords):
+        for j, destination in enumerate(coords):
+            if i == j:
+                continue
+            duration = durations[i][j] if i < len(durations) else None
+            distance = distances[i][j] if i < len(distances) else None
+            if duration is None:
+                continue
+            _leg_cache.set(_leg_key(origin, destination), {
+                "duration_min": round(duration / 60, 1),
+                "distance_km": round(distance / 1000, 2) if distance is not None else None,
+                "source": "osrm",
+            })
+
+    return _cached_legs(coords) or []
+
+def _apply_legs(activities: list, located: list, legs: list):
+    for (index, _), leg in zip(located[1:], legs):
+        activities[index]["travel_from_previous"] = leg
+
+
+# --- Day Routing ---
+def get_day_legs(coords: list) -> list:
+    """
+    Returns travel legs between consecutive coordinates of one day using a
+    single OSRM ``table`` request (or none at all if every leg is cached).
+
+    Args:
+        coords (list): (lon, lat) tuples in visiting order.
+
+    Returns:
+        list: One dict per leg with ``duration_min``, ``distance_km`` and
+              ``source``, or an empty list if OSRM could not be reached.
+    """
+    if len(coords) < 2:
+        return []
+    legs = _cached_legs(coords)
+    if legs is not None:
+        return legs
+    try:
+        data = http_client.get_json("osrm", _table_url(coords), {"annotations": "duration,distance"})
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Error fetching data from OSRM table service: {e}")
+        return []
+    return _legs_from_table(coords, data)
+
+async def aget_day_legs(coords: list) -> list:
+    """
+    Async version of get_day_legs.
+    """
+    if len(coords) < 2:
+        return []
+    legs = _cached_legs(coords)
+    if legs is not None:
+        return legs
+    try:
+        data = await http_client.aget_json("osrm", _table_url(coords), {"annotations": "duration,distance"})
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Error fetching data from OSRM table service: {e}")
+        return []
+    return _legs_from_table(coords, data)
+
+def attach_travel_legs(itinerary: dict) -> dict:
+    """
+    Adds a ``travel_from_previous`` entry (duration and distance) to every
+    located activity after the first one of each day.
+
+    Args:
+        itinerary (dict): An itinerary with an ``itinerary`` list of days.
+
+    Returns:
+        dict: The same itinerary, updated in place.
+    """
+    for day in itinerary.get("itinerary", []):
+        if not isinstance(day, dict):
+            continue
+        activities = day.get("activities") or []
+        located = [(i, c) for i, c in ((i, activity_coords(a)) for i, a in enumerate(activities)) if c]
+        _apply_legs(activities, located, get_day_legs([c for _, c in located]))
+    return itinerary
+
+async def aattach_day_legs(day: dict) -> dict:
+    """
+    Async version of attach_travel_legs for a single day.
+    """
+    activities = day.get("activities") or []
+    located = [(i, c) for i, c in ((i, activity_coords(a)) for i, a in enumerate(activities)) if c]
+    _apply_legs(activities, located, await aget_day_legs([c for _, c in located]))
+    return day
+
+async def aattach_travel_legs(itinerary: dict) -> dict:
+    """
+    Async version of attach_travel_legs. All days are routed concurrently.
+    """
+    days = [day for day in itinerary.get("itinerary", []) if isinstance(day, dict)]
+    await asyncio.gather(*(aattach_day_legs(day) for day in days))
+    return itinerary
+
+
+# --- Offline Geo Engine ---
+def haversine_matrix(coords) -> np.ndarray:
+    """
+    Computes great-circle distances between all pairs of points at once.
+
+    Args:
+        coords: An (n, 2) array-like of (lon, lat) in degrees.
+
+    Returns:
+        np.ndarray: An (n, n) matrix of distances in kilometres.
+    """
+    points = np.radians(np.asarray(coords, dtype=float).reshape(-1, 2))
+    lon, lat = points[:, 0], points[:, 1]
+    dlon = lon[:, None] - lon[None, :]
+    dlat = lat[:, None] - lat[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def _path_length(order: list, dist: np.ndarray) -> float:
+    if len(order) < 2:
+        return 0.0
+    return float(dist[order[:-1], order[1:]].sum())
+
+def _nearest_neighbour(start: int, dist: np.ndarray) -> list:
+    n = len(dist)
+    order = [start]
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, dist[order[-1]])
+        nxt = int(np.argmin(row))
+        order.append(nxt)
+        visited[nxt] = True
+    return order
+
+def _two_opt(order: list, dist: np.ndarray) -> list:
+    """Improves an open path by reversing segments while that shortens it."""
+    order = list(order)
+    n = len(order)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n - 2):
+            for k in range(i + 2, n):
+                a, b, c = order[i], order[i + 1], order[k]
+                before = dist[a, b]
+                after = dist[a, c]
+                if k + 1 < n:
+                    d = order[k + 1]
+                    before += dist[c, d]
+                    after += dist[b, d]
+                if after < before - 1e-9:
+                    order[i + 1:k + 1] = reversed(order[i + 1:k + 1])
+                    improved = True
+    return order
+
+def shortest_visit_order(dist: np.ndarray) -> list:
+    """
+    Finds a short open path through all points with a nearest-neighbour
+    construction from every start point followed by 2-opt.
+
+    Args:
+        dist (np.ndarray): An (n, n) distance matrix.
+
+    Returns:
+        list: Point indices in visiting order.
+    """
+    n = len(dist)
+    if n < 3:
+        return list(range(n))
+    best = min((_nearest_neighbour(start, dist) for start in range(n)), key=lambda o: _path_length(o, dist))
+    return _two_opt(best, dist)
+
+def estimate_leg(distance_km: float) -> dict:
+    """Turns a straight-line distance into an estimated travel leg."""
+    road_km = distance_km * GEO_DETOUR_FACTOR
+    return {
+        "duration_min": round(road_km / GEO_AVG_SPEED_KMH * 60, 1),
+        "distance_km": round(road_km, 2),
+        "source": "estimate",
+    }
+
+def optimize_day_route(day: dict, dist: np.ndarray = None) -> dict:
+    """
+    Reorders one day's located activities into a short visiting order,
+    attaches estimated travel legs and a ``route_summary``.
+
+    The activities' time slots stay where they were; only which activity
+    fills each slot changes, and only when the new order saves at least
+    GEO_REORDER_MIN_SAVING of the original distance. Activities without
+    coordinates keep their position.
+
+    Args:
+        day (dict): One entry of the ``itinerary`` list.
+        dist (np.ndarray): Optional precomputed distance matrix for the
+                           day's located activities, in activity order.
+
+    Returns:
+        dict: The same day, updated in place.
+    """
+    activities = day.get("activities") or []
+    located = [(i, c) for i, c in ((i, activity_coords(a)) for i, a in enumerate(activities)) if c]
+    if dist is None:
+        dist = haversine_matrix([c for _, c in located]) if located else np.zeros((0, 0))
+
+    slots = [index for index, _ in located]
+    original = list(range(len(located)))
+    order = shortest_visit_order(dist)
+    original_km = _path_length(original, dist)
+    reordered = False
+    if original_km > 0 and _path_length(order, dist) <= original_km * (1 - GEO_REORDER_MIN_SAVING):
+        times = [activities[slot].get("time") for slot in slots]
+        moved = [activities[slots[o]] for o in order]
+        for slot, time_slot, activity in zip(slots, times, moved):
+            if time_slot is not None:
+                activity["time"] = time_slot
+            activities[slot] = activity
+        reordered = True
+    else:
+        order = original
+
+    total_km = 0.0
+    total_min = 0.0
+    if slots:
+        activities[slots[0]].pop("travel_from_previous", None)
+    for slot, prev, cur in zip(slots[1:], order, order[1:]):
+        leg = estimate_leg(float(dist[prev, cur]))
+        activities[slot]["travel_from_previous"] = leg
+        total_km += leg["distance_km"]
+        total_min += leg["duration_min"]
+
+    day["route_summary"] = {
+        "total_distance_km": round(total_km, 2),
+        "total_travel_min": round(total_min, 1),
+        "reordered": reordered,
+        "unrealistic": total_km > GEO_MAX_DAY_KM or total_min > GEO_MAX_DAY_TRAVEL_MIN,
+    }
+    return day
+
+@timed("optimize_routes")
+def optimize_itinerary_routes(itinerary: dict) -> dict:
+    """
+    Runs the offline geo engine over a whole itinerary. Distances for every
+    activity of the trip are computed in one vectorized pass and sliced per
+    day.
+
+    Args:
+        itinerary (dict): An itinerary with an ``itinerary`` list of days.
+
+    Returns:
+        dict: The same itinerary, updated in place.
+    """
+    days = [day for day in itinerary.get("itinerary", []) if isinstance(day, dict)]
+    per_day = [[c for c in (activity_coords(a) for a in (day.get("activities") or [])) if c] for day in days]
+    all_coords = [c for coords in per_day for c in coords]
+    dist = haversine_matrix(all_coords) if all_coords else np.zeros((0, 0))
+
+    offset = 0
+    for day, coords in zip(days, per_day):
+        end = offset + len(coords)
+        optimize_day_route(day, dist[offset:end, offset:end])
+        offset = end
+    return itinerary
@@ -0,0 +1,292 @@
+"""
+This module contains the API's metrics: counters and latency histograms for
+the pipeline stages (LLM calls, parsing, travel APIs, PDF rendering),
+rendered in the Prometheus text format for ``/metrics``, and optional
+per-request trace lines that break one request down by stage.
+"""
+import bisect
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+
+# Print one JSON line per HTTP request with the time spent in each stage.
+METRICS_TRACE_REQUESTS = os.environ.get("METRICS_TRACE_REQUESTS", "false").lower() == "true"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels_text(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """A monotonically increasing count per label set."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels_text(self.labelnames, key)} {_number(v)}" for key, v in sorted(values.items())]
+        return lines
+
+
+class Histogram:
+    """Observations bucketed by upper bound, with their sum and count, per label set."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels_text(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels_text(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Holds the metrics and renders them. Collectors are callables returning
+    ``(name, type, help, [(labels dict, value), ...])`` tuples, for values
+    that other modules already keep (queue depths, cache counters).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+                for labels, value in samples:
+                    if value is not None:
+                        lines.append(f"{name}{_labels_text(tuple(labels), tuple(labels.values()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "backpackbuddy_stage_seconds", "Time spent in each pipeline stage.", ("stage",))
+STAGE_ERRORS = registry.counter(
+    "backpackbuddy_stage_errors_total", "Pipeline stages that raised an exception.", ("stage",))
+LLM_CALL_SECONDS = registry.histogram(
+    "backpackbuddy_llm_call_seconds", "Groq call duration once sent (excluding rate-limit pacing).", ("model",))
+LLM_SCHEDULE_WAIT_SECONDS = registry.histogram(
+    "backpackbuddy_llm_schedule_wait_seconds", "Time a Groq call waited for rate-limit budget before being sent.",
+    ("model",))
+LLM_FIRST_TOKEN_SECONDS = registry.histogram(
+    "backpackbuddy_llm_first_token_seconds", "Time to the first streamed chunk of a Groq call.", ("model",))
+LLM_TOKENS = registry.counter(
+    "backpackbuddy_llm_tokens_total", "Tokens reported by Groq, by kind (prompt or completion).", ("model", "kind"))
+PROMPT_TOKENS = registry.counter(
+    "backpackbuddy_prompt_tokens_estimated_total", "Prompt tokens counted locally before sending.", ("prompt",))
+UPSTREAM_SECONDS = registry.histogram(
+    "backpackbuddy_upstream_seconds", "Travel API request duration including retries.", ("upstream", "outcome"))
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "backpackbuddy_http_request_seconds", "API request duration until the last body byte.",
+    ("method", "route", "status"))
+
+
+# --- Request Traces ---
+_trace = contextvars.ContextVar("backpackbuddy_trace", default=None)
+
+def trace_event(stage: str, seconds: float, **fields):
+    """Adds a stage to the current request's trace, if one is being recorded."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.append({"stage": stage, "ms": round(seconds * 1000, 2), **fields})
+
+
+class timed:
+    """
+    Times a stage into ``backpackbuddy_stage_seconds`` (and the request
+    trace). Use as a context manager or as a decorator on functions,
+    coroutine functions and async generators.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._record(time.perf_counter() - self._start, exc_type)
+        return False
+
+    def _record(self, seconds: float, exc_type=None):
+        STAGE_SECONDS.observe(seconds, stage=self.stage)
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            STAGE_ERRORS.inc(stage=self.stage)
+        trace_event(self.stage, seconds)
+
+    def __call__(self, func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def agen_wrapper(*args, **kwargs):
+                start, exc_type = time.perf_counter(), None
+                try:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                except BaseException as e:
+                    exc_type = type(e)
+                    raise
+                finally:
+                    self._record(time.perf_counter() - start, exc_type)
+            return agen_wrapper
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start, exc_type = time.perf_counter(), None
+                try:
+                    return await func(*args, **kwargs)
+                except BaseException as e:
+                    exc_type = type(e)
+                    raise
+                finally:
+                    self._record(time.perf_counter() - start, exc_type)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start, exc_type = time.perf_counter(), None
+            try:
+                return func(*args, **kwargs)
+            except BaseException as e:
+                exc_type = type(e)
+                raise
+            finally:
+                self._record(time.perf_counter() - start, exc_type)
+        return wrapper
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing each request until its last body byte (so
+    streamed responses are measured in full) and, with
+    METRICS_TRACE_REQUESTS, printing a trace line per request. The request
+    ID is taken from ``X-Request-ID`` or generated, and echoed back.
+    """
+
+    def __init__(self, app, trace_requests: bool = METRICS_TRACE_REQUESTS):
+        self.app = app
+        self.trace_requests = trace_requests
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex[:16]
+        trace = [] if self.trace_requests else None
+        token = _trace.set(trace)
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) +
+                           [(b"x-request-id", request_id.encode("latin-1"))]}
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+            await send(message)
+
+        finished = []
+
+        def finish():
+            if finished:
+                return
+            finished.append(True)
+            seconds = time.perf_counter() - start
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(seconds, method=scope["method"], route=route, status=status["code"])
+            if trace is not None:
+                print("trace " + json.dumps({
+                    "request_id": request_id, "method": scope["method"], "path": scope["path"],
+                    "status": status["code"], "ms": round(seconds * 1000, 2), "stages": trace,
+                }))
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finish()
+            _trace.reset(token)
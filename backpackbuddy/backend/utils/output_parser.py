@@ -0,0 +1,478 @@
+"""
+This module contains the shared parser for LLM output. It extracts the JSON
+object from a model response, fixes common syntax slips locally (code
+fences, trailing commas, raw newlines in strings, truncation), validates the
+result against typed schemas and reports exactly which fragment (e.g. which
+day, or which field) is still malformed. Only those fragments are sent back
+to the model, so a single bad day no longer costs a full regeneration.
+"""
+import asyncio
+import json
+import re
+import threading
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+from backend.utils.json_stream import MalformedItem
+from backend.utils.metrics import timed
+from backend.utils.prompts import LazyChatPrompt
+from backend.utils.rate_limit import LLM_DAY_OUTPUT_TOKENS, output_budget
+
+# Bounds the work spent looking for a parseable prefix of a truncated response.
+MAX_TRUNCATION_CANDIDATES = 50
+
+
+# --- Schemas ---
+class Location(BaseModel):
+    model_config = ConfigDict(extra="allow", coerce_numbers_to_str=True)
+    name: Optional[str] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+
+class Activity(BaseModel):
+    model_config = ConfigDict(extra="allow", coerce_numbers_to_str=True)
+    time: Optional[str] = None
+    description: str
+    location: Optional[Location] = None
+    budget_notes: Optional[str] = None
+
+class ItineraryDay(BaseModel):
+    model_config = ConfigDict(extra="allow", coerce_numbers_to_str=True)
+    day: int
+    date: Optional[str] = None
+    theme: Optional[str] = None
+    activities: List[Activity] = Field(min_length=1)
+
+class OutlineDay(BaseModel):
+    model_config = ConfigDict(extra="allow", coerce_numbers_to_str=True)
+    day: int
+    date: Optional[str] = None
+    theme: Optional[str] = None
+    area: Optional[str] = None
+
+class PackingList(BaseModel):
+    model_config = ConfigDict(extra="allow", coerce_numbers_to_str=True)
+    packing_list: Dict[str, List[str]] = Field(min_length=1)
+    weather_summary: str = "Check local weather forecast"
+
+
+class OutputSchema:
+    """
+    Describes an expected response. Responses holding a list of items under
+    ``array_key`` are validated (and repaired) item by item with
+    ``item_model``; other responses are validated with ``model`` field by
+    field.
+    """
+
+    def __init__(self, name: str, model=None, array_key: str = None, item_model=None):
+        self.name = name
+        self.model = model
+        self.array_key = array_key
+        self.item_model = item_model
+
+    def fragment_schema(self, path: tuple) -> str:
+        """Returns a compact JSON schema for the fragment at ``path``."""
+        if self.array_key:
+            schema = self.item_model.model_json_schema()
+        else:
+            full = self.model.model_json_schema()
+            schema = full.get("properties", {}).get(path[0], {}) if path else full
+            if "$defs" in full:
+                schema = {**schema, "$defs": full["$defs"]}
+        return json.dumps(_strip_titles(schema), separators=(",", ":"))
+
+
+ITINERARY_SCHEMA = OutputSchema("itinerary", array_key="itinerary", item_model=ItineraryDay)
+OUTLINE_SCHEMA = OutputSchema("trip outline", array_key="days", item_model=OutlineDay)
+DAY_SCHEMA = OutputSchema("itinerary day", model=ItineraryDay)
+PACKING_LIST_SCHEMA = OutputSchema("packing list", model=PackingList)
+
+
+class OutputParseError(ValueError):
+    """Raised when a response can't be turned into the expected structure."""
+
+
+class FragmentError:
+    """A malformed part of a response: where it is, what's wrong, and its text."""
+
+    def __init__(self, path: tuple, message: str, raw: str):
+        self.path = path
+        self.message = message
+        self.raw = raw
+
+    def __repr__(self):
+        return f"FragmentError({'.'.join(map(str, self.path)) or '<root>'}: {self.message})"
+
+
+class ParsedOutput:
+    """
+    The outcome of parsing a response.
+
+    ``data`` holds everything that validated (for item schemas, the valid
+    items); ``errors`` lists the fragments that did not. A root error (empty
+    path) means the response as a whole is unusable.
+    """
+
+    def __init__(self, obj, data, errors: list, truncated: bool = False):
+        self.obj = obj
+        self.data = data
+        self.errors = errors
+        self.truncated = truncated
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    @property
+    def root_error(self):
+        return next((e for e in self.errors if not e.path), None)
+
+
+_stats = {"responses": 0, "clean": 0, "fixed_locally": 0, "fragments_reprompted": 0,
+          "fragments_repaired": 0, "failed": 0}
+_stats_lock = threading.Lock()
+
+def _count(key: str, n: int = 1):
+    with _stats_lock:
+        _stats[key] += n
+
+def output_parser_stats() -> dict:
+    """Returns how often responses needed local fixes, fragment re-prompts, or failed."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+# --- Extraction & Local Fixes ---
+_FENCE = re.compile(r"```(?:json)?", re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+def _strip_titles(schema):
+    if isinstance(schema, dict):
+        return {k: _strip_titles(v) for k, v in schema.items() if k != "title"}
+    if isinstance(schema, list):
+        return [_strip_titles(v) for v in schema]
+    return schema
+
+def _loads(text: str):
+    """
+    json.loads that also accepts raw control characters in strings and
+    trailing commas. Returns (value, fixed), value being None on failure.
+    """
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+    for candidate in (text, _TRAILING_COMMA.sub(r"\1", text)):
+        try:
+            return json.loads(candidate, strict=False), True
+        except json.JSONDecodeError:
+            continue
+    return None, True
+
+def _scan(text: str, start: int):
+    """
+    Scans the JSON value opening at ``text[start]``, tracking strings and
+    nesting. Returns (end, cuts), where ``end`` is the index after the
+    closing bracket (None if the text stops first) and ``cuts`` lists
+    (position, closers) pairs after each nested container closes and before
+    each comma, which are the places a truncated response can be cut and
+    closed cleanly.
+    """
+    stack, cuts = [], []
+    in_string = escape = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == ",":
+            cuts.append((i, "".join(reversed(stack))))
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if not stack:
+                return i, cuts
+            stack.pop()
+            if not stack:
+                return i + 1, cuts
+            cuts.append((i + 1, "".join(reversed(stack))))
+    cuts.append((len(text), ('"' if in_string else "") + "".join(reversed(stack))))
+    return None, cuts
+
+def _load_value(text: str, start: int):
+    """
+    Returns (value, end, truncated, fixed) for the JSON container starting
+    at ``start``; ``fixed`` is set when local fixes were needed.
+    """
+    end, cuts = _scan(text, start)
+    if end is not None:
+        value, fixed = _loads(text[start:end])
+        return value, end, False, fixed
+    # Cut off mid-response: close the open containers at the latest point
+    # that still parses.
+    for cut, closers in reversed(cuts[-MAX_TRUNCATION_CANDIDATES:]):
+        value, _ = _loads(_TRAILING_COMMA.sub(r"\1", text[start:cut].rstrip().rstrip(",")) + closers)
+        if value is not None:
+            return value, len(text), True, True
+    return None, len(text), True, True
+
+def _salvage_items(text: str, start: int, key: str):
+    """
+    Splits the ``key`` array into its items when the response as a whole
+    doesn't parse, so the items that are fine can be kept.
+    """
+    match = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[').search(text, start)
+    if not match:
+        return None, False
+    items, pos, truncated = [], match.end(), False
+    while pos < len(text):
+        char = text[pos]
+        if char == "]":
+            break
+        if char != "{":
+            pos += 1
+            continue
+        value, end, item_truncated, _ = _load_value(text, pos)
+        items.append(value if isinstance(value, dict) else MalformedItem(text[pos:end]))
+        truncated = truncated or item_truncated
+        pos = end
+    return {key: items}, truncated
+
+
+# --- Validation ---
+def _describe(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(p) for p in e['loc']) or 'value'}: {e['msg']}" for e in error.errors()
+    )
+
+def _validate(obj: dict, schema: OutputSchema, truncated: bool = False) -> ParsedOutput:
+    errors = []
+    if schema.array_key:
+        items = obj.get(schema.array_key)
+        if not isinstance(items, list) or not items:
+            return ParsedOutput(obj, None, [FragmentError((), f"Missing '{schema.array_key}' list.", json.dumps(obj))])
+        valid = []
+        for index, item in enumerate(items):
+            path = (schema.array_key, index)
+            if isinstance(item, MalformedItem):
+                errors.append(FragmentError(path, "Not valid JSON.", item.text))
+                continue
+            try:
+                valid.append(schema.item_model.model_validate(item).model_dump(exclude_none=True))
+            except ValidationError as e:
+                errors.append(FragmentError(path, _describe(e), json.dumps(item, ensure_ascii=False)))
+                continue
+            if truncated and index == len(items) - 1:
+                # The response stopped inside this item; it may be missing entries.
+                valid.pop()
+                errors.append(FragmentError(path, "The response was cut off; this item is incomplete.",
+                                            json.dumps(item, ensure_ascii=False)))
+        data = {**{k: v for k, v in obj.items() if k != schema.array_key}, schema.array_key: valid}
+        return ParsedOutput(obj, data, errors, truncated)
+
+    try:
+        return ParsedOutput(obj, schema.model.model_validate(obj).model_dump(exclude_none=True), [], truncated)
+    except ValidationError as e:
+        fields = {}
+        for detail in e.errors():
+            field = detail["loc"][0] if detail["loc"] else None
+            fields.setdefault(field, []).append(
+                f"{'.'.join(str(p) for p in detail['loc'])}: {detail['msg']}"
+            )
+        for field, messages in fields.items():
+            path = (field,) if field is not None else ()
+            raw = json.dumps(obj.get(field) if field is not None else obj, ensure_ascii=False)
+            errors.append(FragmentError(path, "; ".join(messages), raw))
+        return ParsedOutput(obj, None, errors, truncated)
+
+@timed("parse_output")
+def parse_output(content: str, schema: OutputSchema) -> ParsedOutput:
+    """
+    Extracts and validates the JSON object in a model response.
+
+    Args:
+        content (str): The raw model output.
+        schema (OutputSchema): The expected structure.
+
+    Returns:
+        ParsedOutput: The validated data and any malformed fragments.
+    """
+    _count("responses")
+    text = _FENCE.sub("", content or "")
+    start = text.find("{")
+    if start == -1:
+        return ParsedOutput(None, None, [FragmentError((), "No JSON object in the response.", content or "")])
+
+    obj, _, truncated, fixed = _load_value(text, start)
+    if schema.array_key and (truncated or not isinstance(obj, dict)):
+        # Splitting the array item by item keeps more of a broken or
+        # cut-off response than closing it at the last clean point.
+        salvaged, salvaged_truncated = _salvage_items(text, start, schema.array_key)
+        if salvaged is not None and (not isinstance(obj, dict) or
+                                     len(salvaged[schema.array_key]) > len(obj.get(schema.array_key) or [])):
+            obj, truncated, fixed = salvaged, salvaged_truncated, True
+    if not isinstance(obj, dict):
+        return ParsedOutput(None, None, [FragmentError((), "The response is not valid JSON.", text[start:])])
+
+    parsed = _validate(obj, schema, truncated)
+    if parsed.ok:
+        _count("fixed_locally" if fixed else "clean")
+    return parsed
+
+
+# --- Fragment Re-prompting ---
+REPAIR_SYSTEM_PROMPT = """
+You fix malformed JSON fragments produced by another model for BackpackBuddy, a travel planner.
+Keep the original content wherever it is usable; only fix what the problems list mentions and
+fill in anything missing so the fragment matches the schema.
+
+Return ONLY a JSON object of the form {{"value": <the corrected fragment>}}.
+"""
+
+REPAIR_USER_PROMPT = """
+**Context:** {context}
+
+**Fragment ({path}):**
+{fragment}
+
+**Problems:** {problems}
+
+**Expected schema:**
+{schema}
+
+Return the corrected fragment:
+"""
+
+repair_prompt = LazyChatPrompt([
+    ("system", REPAIR_SYSTEM_PROMPT),
+    ("human", REPAIR_USER_PROMPT)
+])
+
+def _repair_inputs(error: FragmentError, schema: OutputSchema, context: str) -> dict:
+    return {
+        "context": context or f"Part of a {schema.name}.",
+        "path": ".".join(str(p) for p in error.path) or "whole response",
+        "fragment": error.raw,
+        "problems": error.message,
+        "schema": schema.fragment_schema(error.path),
+    }
+
+def _fragments(parsed: ParsedOutput, schema: OutputSchema) -> list:
+    """
+    The errors worth a re-prompt. A root error is only repaired for
+    single-object schemas (e.g. one day), where re-prompting the whole
+    object is still a small request.
+    """
+    return [e for e in parsed.errors if e.path or not schema.array_key]
+
+def _splice(parsed: ParsedOutput, error: FragmentError, response) -> bool:
+    content = response.content if hasattr(response, 'content') else str(response)
+    text = _FENCE.sub("", content)
+    start = text.find("{")
+    value = _load_value(text, start)[0] if start != -1 else None
+    if not isinstance(value, dict) or "value" not in value:
+        return False
+    if not error.path:
+        if not isinstance(value["value"], dict):
+            return False
+        parsed.obj = value["value"]
+        return True
+    target = parsed.obj
+    for key in error.path[:-1]:
+        target = target[key]
+    target[error.path[-1]] = value["value"]
+    return True
+
+def _revalidate(parsed: ParsedOutput, schema: OutputSchema, fragments: list) -> ParsedOutput:
+    if parsed.obj is None:
+        return parsed
+    repaired = _validate(parsed.obj, schema)
+    _count("fragments_repaired", len(fragments) - len(_fragments(repaired, schema)))
+    return repaired
+
+async def arepair_output(parsed: ParsedOutput, schema: OutputSchema, llm, context: str = "") -> ParsedOutput:
+    """
+    Re-prompts the model for each malformed fragment (concurrently) and
+    splices the fixes back in.
+
+    Returns:
+        ParsedOutput: The re-validated result.
+    """
+    fragments = _fragments(parsed, schema)
+    if not fragments:
+        return parsed
+    _count("fragments_reprompted", len(fragments))
+    print(f"Re-prompting for malformed {schema.name} fragments: {fragments}")
+
+    async def repair(error: FragmentError) -> bool:
+        try:
+            response = await (repair_prompt | llm).ainvoke(_repair_inputs(error, schema, context),
+                                                           config=output_budget(LLM_DAY_OUTPUT_TOKENS))
+            return _splice(parsed, error, response)
+        except Exception as e:
+            print(f"Could not repair {schema.name} fragment {error.path}: {e}")
+            return False
+
+    await asyncio.gather(*(repair(e) for e in fragments))
+    return _revalidate(parsed, schema, fragments)
+
+def repair_output(parsed: ParsedOutput, schema: OutputSchema, llm, context: str = "") -> ParsedOutput:
+    """Synchronous version of arepair_output; fragments are repaired one by one."""
+    fragments = _fragments(parsed, schema)
+    if not fragments:
+        return parsed
+    _count("fragments_reprompted", len(fragments))
+    print(f"Re-prompting for malformed {schema.name} fragments: {fragments}")
+    for error in fragments:
+        try:
+            response = (repair_prompt | llm).invoke(_repair_inputs(error, schema, context),
+                                                    config=output_budget(LLM_DAY_OUTPUT_TOKENS))
+            _splice(parsed, error, response)
+        except Exception as e:
+            print(f"Could not repair {schema.name} fragment {error.path}: {e}")
+    return _revalidate(parsed, schema, fragments)
+
+def _finish(parsed: ParsedOutput, schema: OutputSchema) -> dict:
+    if parsed.root_error or parsed.data is None:
+        _count("failed")
+        error = parsed.root_error or parsed.errors[0]
+        raise OutputParseError(f"Could not parse the {schema.name}: {error.message}")
+    if parsed.errors:
+        # Items that still don't validate are dropped rather than failing
+        # the whole response.
+        print(f"Dropping unrepairable {schema.name} fragments: {parsed.errors}")
+        if not parsed.data.get(schema.array_key):
+            _count("failed")
+            raise OutputParseError(f"Could not parse any {schema.array_key} from the {schema.name}.")
+    return parsed.data
+
+@timed("parse_and_repair")
+async def aparse_and_repair(content: str, schema: OutputSchema, llm, context: str = "") -> dict:
+    """
+    Parses a response, re-prompting only for the fragments that are malformed.
+
+    Returns:
+        dict: The validated data.
+
+    Raises:
+        OutputParseError: If the response can't be used at all.
+    """
+    parsed = parse_output(content, schema)
+    if not parsed.ok:
+        parsed = await arepair_output(parsed, schema, llm, context)
+    return _finish(parsed, schema)
+
+@timed("parse_and_repair")
+def parse_and_repair(content: str, schema: OutputSchema, llm, context: str = "") -> dict:
+    """Synchronous version of aparse_and_repair."""
+    parsed = parse_output(content, schema)
+    if not parsed.ok:
+        parsed = repair_output(parsed, schema, llm, context)
+    return _finish(parsed, schema)
@@ -0,0 +1,178 @@
+"""
+This module contains the content-addressed cache for rendered PDFs. Each
+PDF is stored under the content hash of its itinerary in a size-capped
+on-disk spool, with small files also kept in memory.
+"""
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+PDF_SPOOL_DIR = os.environ.get("PDF_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "backpackbuddy-pdf"))
+PDF_SPOOL_MAX_BYTES = int(os.environ.get("PDF_SPOOL_MAX_BYTES", str(512 * 1024 * 1024)))
+PDF_MEMORY_MAX_BYTES = int(os.environ.get("PDF_MEMORY_MAX_BYTES", str(64 * 1024 * 1024)))
+PDF_MEMORY_ITEM_MAX_BYTES = int(os.environ.get("PDF_MEMORY_ITEM_MAX_BYTES", str(1024 * 1024)))
+
+
+class PDFArtifact:
+    """A cached PDF, held either in memory or as a file in the spool."""
+
+    def __init__(self, digest: str, size: int, data: bytes = None, path: str = None):
+        self.digest = digest
+        self.size = size
+        self.data = data
+        self.path = path
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.digest}"'
+
+
+class PDFArtifactCache:
+    """
+    Two-tier, size-capped cache of rendered PDFs.
+
+    Every PDF is written to the spool directory; the least recently used
+    files are deleted once the spool exceeds ``max_disk_bytes``. PDFs up to
+    ``memory_item_max_bytes`` are also kept in an in-memory LRU capped at
+    ``max_memory_bytes``; larger ones are served from disk only.
+    """
+
+    def __init__(self, spool_dir: str = PDF_SPOOL_DIR, max_disk_bytes: int = PDF_SPOOL_MAX_BYTES,
+                 max_memory_bytes: int = PDF_MEMORY_MAX_BYTES, memory_item_max_bytes: int = PDF_MEMORY_ITEM_MAX_BYTES):
+        self.spool_dir = spool_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.memory_item_max_bytes = memory_item_max_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: str):
+        """
+        Looks up a rendered PDF.
+
+        Returns:
+            PDFArtifact: The cached artifact, or None.
+        """
+        with self._lock:
+            self._load_spool()
+            data = self._memory.get(digest)
+            if data is not None:
+                self._memory.move_to_end(digest)
+                if digest in self._disk:
+                    self._disk.move_to_end(digest)
+                self.hits += 1
+                return PDFArtifact(digest, len(data), data=data)
+
+            size = self._disk.get(digest)
+            if size is not None:
+                path = self._path(digest)
+                if os.path.exists(path):
+                    self._disk.move_to_end(digest)
+                    self.hits += 1
+                    return PDFArtifact(digest, size, path=path)
+                self._forget_disk(digest)
+
+            self.misses += 1
+            return None
+
+    async def aget(self, digest: str):
+        """Async version of get; the spool is checked off the event loop."""
+        return await asyncio.to_thread(self.get, digest)
+
+    def put(self, digest: str, data: bytes) -> PDFArtifact:
+        """
+        Stores a rendered PDF in the spool (and in memory if small enough).
+
+        Returns:
+            PDFArtifact: The stored artifact.
+        """
+        with self._lock:
+            self._load_spool()
+            path = self._path(digest)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                if digest in self._disk:
+                    self._disk_bytes -= self._disk.pop(digest)
+                self._disk[digest] = len(data)
+                self._disk_bytes += len(data)
+                self._evict_disk()
+            except OSError as e:
+                print(f"Could not spool PDF {digest}: {e}")
+
+            if len(data) <= self.memory_item_max_bytes:
+                if digest in self._memory:
+                    self._memory_bytes -= len(self._memory.pop(digest))
+                self._memory[digest] = data
+                self._memory_bytes += len(data)
+                while self._memory_bytes > self.max_memory_bytes and self._memory:
+                    _, evicted = self._memory.popitem(last=False)
+                    self._memory_bytes -= len(evicted)
+
+            return PDFArtifact(digest, len(data), data=data)
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters and the size of each tier."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.spool_dir, f"{digest}.pdf")
+
+    def _load_spool(self):
+        """Indexes PDFs left in the spool by a previous run, oldest first."""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            entries = []
+            for name in os.listdir(self.spool_dir):
+                path = os.path.join(self.spool_dir, name)
+                if name.endswith(".tmp"):
+                    # Leftovers from an interrupted write; recent ones may
+                    # still belong to another worker process.
+                    if time.time() - os.stat(path).st_mtime > 3600:
+                        os.remove(path)
+                elif name.endswith(".pdf"):
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, name[:-4], stat.st_size))
+            for _, digest, size in sorted(entries):
+                self._disk[digest] = size
+                self._disk_bytes += size
+            self._evict_disk()
+        except OSError as e:
+            print(f"Could not load PDF spool {self.spool_dir}: {e}")
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.max_disk_bytes and self._disk:
+            digest, _ = next(iter(self._disk.items()))
+            self._forget_disk(digest)
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                pass
+
+    def _forget_disk(self, digest: str):
+        self._disk_bytes -= self._disk.pop(digest)
+
+
+pdf_cache = PDFArtifactCache()
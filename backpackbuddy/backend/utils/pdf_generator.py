@@ -8,6 +8,44 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
 
+_styles = None
+
+def get_styles():
+    """
+    Returns the stylesheet used for itinerary PDFs, building it on first use.
+
+    The stylesheet is only read while rendering, so one instance is shared
+    by every PDF generated in this process.
+    """
+    global _styles
+    if _styles is None:
+        styles = getSampleStyleSheet()
+        styles.add(ParagraphStyle(name='MainTitle',
+                                  fontSize=24,
+                                  leading=28,
+                                  alignment=TA_CENTER,
+                                  spaceAfter=20))
+        styles.add(ParagraphStyle(name='DayHeader',
+                                  fontSize=18,
+                                  leading=22,
+                                  spaceBefore=20,
+                                  spaceAfter=10))
+        styles.add(ParagraphStyle(name='Activity',
+                                  leftIndent=inch/2,
+                                  spaceBefore=5))
+        styles.add(ParagraphStyle(name='ActivityDetails',
+                                  leftIndent=inch,
+                                  textColor='grey'))
+        _styles = styles
+    return _styles
+
+def warm_up():
+    """
+    Builds the stylesheet and renders a tiny document so that fonts and
+    ReportLab's lazily loaded modules are ready before the first real PDF.
+    """
+    create_itinerary_pdf({"itinerary": [{"day": 1, "activities": [{"time": "", "description": ""}]}]})
+
 def create_itinerary_pdf(itinerary_data: dict) -> bytes:
     """
     Generates a PDF document from a structured itinerary dictionary.
@@ -27,23 +65,7 @@ def create_itinerary_pdf(itinerary_data: dict) -> bytes:
                             topMargin=inch,
                             bottomMargin=inch)
 
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle(name='MainTitle',
-                              fontSize=24,
-                              leading=28,
-                              alignment=TA_CENTER,
-                              spaceAfter=20))
-    styles.add(ParagraphStyle(name='DayHeader',
-                              fontSize=18,
-                              leading=22,
-                              spaceBefore=20,
-                              spaceAfter=10))
-    styles.add(ParagraphStyle(name='Activity',
-                              leftIndent=inch/2,
-                              spaceBefore=5))
-    styles.add(ParagraphStyle(name='ActivityDetails',
-                              leftIndent=inch,
-                              textColor='grey'))
+    styles = get_styles()
 
     story = []
 
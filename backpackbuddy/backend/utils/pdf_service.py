@@ -0,0 +1,119 @@
+"""
+This module contains the PDF rendering service. ReportLab work runs in a
+bounded pool of worker processes that build their stylesheet and fonts once
+at startup, so long PDFs never block the API's event loop and rendering
+scales across cores.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from backend.utils.concurrency import QueueFullError
+from backend.utils.metrics import STAGE_SECONDS, timed, trace_event
+
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_MAX_PENDING = int(os.environ.get("PDF_MAX_PENDING", str(PDF_WORKERS * 4)))
+PDF_RENDER_TIMEOUT = float(os.environ.get("PDF_RENDER_TIMEOUT", "30"))
+
+
+# ReportLab is only imported in the worker processes, not in the API process.
+def _init_worker():
+    try:
+        from backend.utils.pdf_generator import warm_up
+        warm_up()
+    except Exception as e:
+        print(f"PDF worker warm-up failed: {e}")
+
+def _render_pdf(itinerary: dict) -> tuple:
+    from backend.utils.pdf_generator import create_itinerary_pdf
+    start = time.perf_counter()
+    pdf_bytes = create_itinerary_pdf(itinerary)
+    # Metrics live in the API process, so the worker reports its render time.
+    return pdf_bytes, time.perf_counter() - start
+
+
+class PDFRenderService:
+    """
+    Submits itinerary PDFs to a process pool.
+
+    At most ``max_pending`` renders may be queued or running; beyond that
+    ``render`` fails fast with QueueFullError instead of building a backlog.
+    """
+
+    def __init__(self, workers: int = PDF_WORKERS, max_pending: int = PDF_MAX_PENDING,
+                 timeout: float = PDF_RENDER_TIMEOUT):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Creates the pool and warms every worker process."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+                # Force the workers to spawn now rather than on the first request.
+                for _ in range(self.workers):
+                    self._executor.submit(int)
+
+    def shutdown(self):
+        """Stops the worker processes."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    @timed("pdf_render")
+    async def render(self, itinerary: dict) -> bytes:
+        """
+        Renders an itinerary PDF in the pool.
+
+        Args:
+            itinerary (dict): The itinerary to render.
+
+        Returns:
+            bytes: The PDF file.
+
+        Raises:
+            QueueFullError: If too many renders are already pending.
+            asyncio.TimeoutError: If rendering takes longer than the timeout.
+        """
+        self.start()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFullError(f"{self._pending} PDFs are already being rendered; try again later.")
+            self._pending += 1
+            future = self._executor.submit(_render_pdf, itinerary)
+        # The slot is freed when the worker finishes, even if the caller
+        # stopped waiting, so timeouts can't oversubscribe the pool.
+        future.add_done_callback(self._release)
+        try:
+            pdf_bytes, seconds = await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM); replace the pool for the next request.
+            print("PDF worker pool broke; restarting it.")
+            self.shutdown()
+            raise
+        STAGE_SECONDS.observe(seconds, stage="create_itinerary_pdf")
+        trace_event("create_itinerary_pdf", seconds)
+        return pdf_bytes
+
+    def stats(self) -> dict:
+        """Returns the pool size and number of pending renders."""
+        return {
+            "workers": self.workers,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+        }
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+
+pdf_service = PDFRenderService()
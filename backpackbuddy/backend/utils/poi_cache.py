@@ -0,0 +1,217 @@
+"""
+This module contains a geohash tile cache for OpenTripMap place queries.
+Radius searches are answered from the geohash cells covering the search
+circle; each cell is fetched from the upstream once per ``kinds`` and
+then filtered locally, so nearby or overlapping searches reuse it.
+"""
+import asyncio
+import math
+import os
+
+import numpy as np
+
+from backend.utils.cache import CACHE_SQLITE_PATH, ResponseCache
+from backend.utils.singleflight import inflight_requests
+
+POI_GEOHASH_PRECISION = int(os.environ.get("POI_GEOHASH_PRECISION", "5"))
+POI_MAX_CELLS = int(os.environ.get("POI_MAX_CELLS", "16"))
+POI_CACHE_TTL_SECONDS = float(os.environ.get("POI_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+POI_CACHE_MAX_CELLS = int(os.environ.get("POI_CACHE_MAX_CELLS", "5000"))
+POI_RESULT_LIMIT = 20
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_METERS_PER_DEGREE_LAT = 111320.0
+_EARTH_RADIUS_M = 6371008.8
+
+_cell_cache = ResponseCache(
+    max_entries=POI_CACHE_MAX_CELLS,
+    ttl_seconds=POI_CACHE_TTL_SECONDS,
+    sqlite_path=CACHE_SQLITE_PATH,
+    table="poi_cell_cache",
+)
+
+
+# --- Geohash ---
+def geohash_encode(lat: float, lon: float, precision: int) -> str:
+    """Encodes a point as a geohash string of the given length."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+def geohash_bounds(cell: str) -> tuple:
+    """Returns (lat_min, lat_max, lon_min, lon_max) of a geohash cell."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in cell:
+        value = _BASE32.index(char)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (value >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+def _cell_size(precision: int) -> tuple:
+    bits = 5 * precision
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+def covering_cells(lon: float, lat: float, radius: float, precision: int) -> list:
+    """
+    Lists the geohash cells of a given precision that intersect the
+    bounding box of a search circle.
+
+    Args:
+        lon (float): Longitude of the center point.
+        lat (float): Latitude of the center point.
+        radius (float): Search radius in meters.
+        precision (int): Geohash length.
+
+    Returns:
+        list: Sorted geohash strings.
+    """
+    dlat = radius / _METERS_PER_DEGREE_LAT
+    dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+    lat_min, lat_max = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    lon_min, lon_max = max(lon - dlon, -180.0), min(lon + dlon, 180.0)
+    cell_h, cell_w = _cell_size(precision)
+
+    cells = set()
+    row = math.floor((lat_min + 90.0) / cell_h)
+    while -90.0 + row * cell_h < lat_max:
+        col = math.floor((lon_min + 180.0) / cell_w)
+        while -180.0 + col * cell_w < lon_max:
+            center_lat = min(-90.0 + (row + 0.5) * cell_h, 90.0)
+            center_lon = min(-180.0 + (col + 0.5) * cell_w, 180.0)
+            cells.add(geohash_encode(center_lat, center_lon, precision))
+            col += 1
+        row += 1
+    return sorted(cells)
+
+def _plan_cells(lon: float, lat: float, radius: float) -> list:
+    """
+    Picks the finest precision (up to POI_GEOHASH_PRECISION) whose covering
+    set stays within POI_MAX_CELLS, so large radii use fewer, bigger cells.
+    """
+    for precision in range(POI_GEOHASH_PRECISION, 1, -1):
+        cells = covering_cells(lon, lat, radius, precision)
+        if len(cells) <= POI_MAX_CELLS:
+            return cells
+    return covering_cells(lon, lat, radius, 1)
+
+
+# --- Local Filtering ---
+def _filter_features(features: list, lon: float, lat: float, radius: float, limit: int) -> list:
+    """
+    Keeps the features inside the search circle, nearest first, with the
+    ``dist`` field recomputed relative to the new center.
+    """
+    located = [f for f in features if isinstance(f.get("point"), dict) and "lon" in f["point"] and "lat" in f["point"]]
+    if not located:
+        return []
+
+    points = np.radians(np.array([[f["point"]["lon"], f["point"]["lat"]] for f in located], dtype=float))
+    clon, clat = math.radians(lon), math.radians(lat)
+    a = (np.sin((points[:, 1] - clat) / 2) ** 2
+         + math.cos(clat) * np.cos(points[:, 1]) * np.sin((points[:, 0] - clon) / 2) ** 2)
+    distances = 2 * _EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    results = []
+    for index in np.argsort(distances):
+        if distances[index] > radius or len(results) >= limit:
+            break
+        feature = dict(located[index])
+        feature["dist"] = round(float(distances[index]), 2)
+        results.append(feature)
+    return results
+
+def _dedupe(features: list) -> list:
+    seen = set()
+    unique = []
+    for feature in features:
+        key = feature.get("xid") or (feature.get("name"), str(feature.get("point")))
+        if key not in seen:
+            seen.add(key)
+            unique.append(feature)
+    return unique
+
+
+# --- Cached Queries ---
+def places_in_radius(lon: float, lat: float, radius: float, kinds: str, fetch_cell, limit: int = POI_RESULT_LIMIT) -> list:
+    """
+    Answers a radius query from cached geohash cells, fetching missing cells.
+
+    Args:
+        lon (float): Longitude of the center point.
+        lat (float): Latitude of the center point.
+        radius (float): Search radius in meters.
+        kinds (str): OpenTripMap kinds filter; part of the cell key.
+        fetch_cell: Callable taking (lat_min, lat_max, lon_min, lon_max, kinds)
+                    and returning the list of features in that box.
+        limit (int): Maximum number of features to return.
+
+    Returns:
+        list: Features within the radius, nearest first.
+    """
+    features = []
+    for cell in _plan_cells(lon, lat, radius):
+        key = f"{kinds}:{cell}"
+        cell_features = _cell_cache.get(key)
+        if cell_features is None:
+            try:
+                cell_features = fetch_cell(*geohash_bounds(cell), kinds)
+            except Exception as e:
+                print(f"Error fetching places for geohash cell {cell}: {e}")
+                continue
+            _cell_cache.set(key, cell_features)
+        features.extend(cell_features)
+    return _filter_features(_dedupe(features), lon, lat, radius, limit)
+
+async def aplaces_in_radius(lon: float, lat: float, radius: float, kinds: str, afetch_cell, limit: int = POI_RESULT_LIMIT) -> list:
+    """
+    Async version of places_in_radius. Missing cells are fetched
+    concurrently and concurrent requests for the same cell are coalesced.
+    """
+    async def load(cell: str) -> list:
+        key = f"{kinds}:{cell}"
+        cell_features = _cell_cache.get(key)
+        if cell_features is not None:
+            return cell_features
+
+        async def fetch():
+            result = await afetch_cell(*geohash_bounds(cell), kinds)
+            _cell_cache.set(key, result)
+            return result
+
+        try:
+            return await inflight_requests.do(f"poi:{key}", fetch)
+        except Exception as e:
+            print(f"Error fetching places for geohash cell {cell}: {e}")
+            return []
+
+    batches = await asyncio.gather(*(load(cell) for cell in _plan_cells(lon, lat, radius)))
+    features = [feature for batch in batches for feature in batch]
+    return _filter_features(_dedupe(features), lon, lat, radius, limit)
+
+def poi_cache_stats() -> dict:
+    """Returns hit/miss counters of the cell cache."""
+    return _cell_cache.stats()
@@ -0,0 +1,31 @@
+"""
+This module contains a lazily built chat prompt. LangChain's prompt classes
+are slow to import, so the agents declare their prompts with LazyChatPrompt
+and the template is only built (and LangChain imported) on first use.
+"""
+import threading
+
+
+class LazyChatPrompt:
+    """
+    A ChatPromptTemplate built on first use. ``prompt | llm`` works as with
+    the real template.
+    """
+
+    def __init__(self, messages: list):
+        self.messages = messages
+        self._template = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns the underlying ChatPromptTemplate, building it once."""
+        if self._template is None:
+            with self._lock:
+                if self._template is None:
+                    from langchain_core.prompts import ChatPromptTemplate
+
+                    self._template = ChatPromptTemplate.from_messages(self.messages)
+        return self._template
+
+    def __or__(self, other):
+        return self.get() | other
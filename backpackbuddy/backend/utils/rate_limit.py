@@ -0,0 +1,207 @@
+"""
+This module contains the LLM rate scheduler. Groq limits each model by
+requests per minute (RPM) and tokens per minute (TPM); the scheduler keeps a
+token bucket for each budget and paces calls to stay just under both,
+instead of letting bursts fail with 429s.
+
+Each call reserves one request and its estimated tokens up front. When a
+bucket runs dry its level goes negative and the caller sleeps until the
+deficit has refilled, so waiting callers are served in arrival order. Once
+the response reports its real usage the estimate is corrected.
+"""
+import asyncio
+import os
+import threading
+import time
+
+from backend.utils.concurrency import QueueFullError
+
+# The defaults are Groq's free-tier limits for llama-3.1-8b-instant. Set
+# them to your plan's limits per model, divided by the number of workers;
+# 0 disables a budget.
+GROQ_RPM_LIMIT = float(os.environ.get("GROQ_RPM_LIMIT", "30"))
+GROQ_TPM_LIMIT = float(os.environ.get("GROQ_TPM_LIMIT", "6000"))
+# Fraction of the limits actually used, leaving room for clock skew and
+# estimation error.
+GROQ_RATE_HEADROOM = float(os.environ.get("GROQ_RATE_HEADROOM", "0.9"))
+# Output tokens reserved per call until the real usage is known: by default
+# (a full itinerary), and for the smaller call types.
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.environ.get("LLM_EXPECTED_OUTPUT_TOKENS", "1000"))
+LLM_DAY_OUTPUT_TOKENS = int(os.environ.get("LLM_DAY_OUTPUT_TOKENS", "350"))
+LLM_OUTLINE_OUTPUT_TOKENS = int(os.environ.get("LLM_OUTLINE_OUTPUT_TOKENS", "400"))
+LLM_PACKING_OUTPUT_TOKENS = int(os.environ.get("LLM_PACKING_OUTPUT_TOKENS", "500"))
+# Calls that would have to wait longer than this are rejected with QueueFullError.
+LLM_MAX_SCHEDULE_WAIT = float(os.environ.get("LLM_MAX_SCHEDULE_WAIT", "120"))
+
+
+def output_budget(tokens: int) -> dict:
+    """
+    Returns a run config that makes the scheduled LLM client reserve
+    ``tokens`` output tokens for a call instead of its default, e.g.
+    ``(prompt | llm).ainvoke(inputs, config=output_budget(LLM_DAY_OUTPUT_TOKENS))``.
+    """
+    return {"metadata": {"expected_output_tokens": tokens}}
+
+def expected_output_tokens(config, default: int = LLM_EXPECTED_OUTPUT_TOKENS) -> int:
+    """Returns the output reservation requested by a run config, or ``default``."""
+    metadata = (config or {}).get("metadata") or {}
+    return metadata.get("expected_output_tokens", default)
+
+
+class TokenBucket:
+    """
+    A bucket holding up to ``capacity`` units that refills continuously at
+    ``capacity`` per minute. Not thread-safe; LLMScheduler locks around it.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, amount: float) -> float:
+        """Takes ``amount`` units, possibly going negative; returns the seconds until the level is back to 0."""
+        self._refill()
+        self.level -= amount
+        return max(0.0, -self.level / self.rate)
+
+    def give(self, amount: float):
+        """Returns units (e.g. an over-estimate) to the bucket."""
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class LLMScheduler:
+    """
+    Paces calls to one model under its RPM and TPM budgets.
+
+    Use ``reserve`` (or ``acquire``/``aacquire``, which also wait) before a
+    call and ``settle`` with the real token usage afterwards.
+    """
+
+    def __init__(self, rpm: float = GROQ_RPM_LIMIT, tpm: float = GROQ_TPM_LIMIT,
+                 headroom: float = GROQ_RATE_HEADROOM, max_wait: float = LLM_MAX_SCHEDULE_WAIT):
+        self.requests = TokenBucket(rpm * headroom) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm * headroom) if tpm > 0 else None
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.delayed_calls = 0
+        self.rejected_calls = 0
+        self.released_calls = 0
+        self.total_wait = 0.0
+        self.estimated_tokens = 0
+        self.actual_tokens = 0
+
+    def reserve(self, tokens: int) -> float:
+        """
+        Reserves one request and ``tokens`` tokens.
+
+        Returns:
+            float: Seconds the caller must wait before sending the request.
+
+        Raises:
+            QueueFullError: If the wait would exceed ``max_wait``; nothing is reserved.
+        """
+        with self._lock:
+            wait = 0.0
+            if self.requests is not None:
+                wait = max(wait, self.requests.take(1))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.take(tokens))
+            if wait > self.max_wait:
+                if self.requests is not None:
+                    self.requests.give(1)
+                if self.tokens is not None:
+                    self.tokens.give(tokens)
+                self.rejected_calls += 1
+                raise QueueFullError(f"Groq rate limit reached; next slot in {wait:.0f}s.")
+            self.calls += 1
+            self.estimated_tokens += tokens
+            if wait > 0:
+                self.delayed_calls += 1
+                self.total_wait += wait
+            return wait
+
+    def acquire(self, tokens: int):
+        """Reserves capacity and blocks until the call may be sent."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int):
+        """Reserves capacity and sleeps (without blocking the loop) until the call may be sent."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def release(self, tokens: int, request: bool = True):
+        """
+        Gives back (part of) a reservation that will not be used, e.g. for a
+        call cancelled while waiting (``request=True``) or while running.
+        """
+        with self._lock:
+            if request and self.requests is not None:
+                self.requests.give(1)
+            if self.tokens is not None:
+                self.tokens.give(tokens)
+            self.estimated_tokens -= tokens
+            self.released_calls += 1
+
+    def settle(self, estimated: int, actual: int = None):
+        """Replaces a call's estimated token cost with its reported usage."""
+        if actual is None:
+            return
+        with self._lock:
+            self.actual_tokens += actual
+            if self.tokens is not None:
+                if actual < estimated:
+                    self.tokens.give(estimated - actual)
+                else:
+                    self.tokens.take(actual - estimated)
+
+    def stats(self) -> dict:
+        """Returns the remaining budgets and how much pacing was needed."""
+        with self._lock:
+            for bucket in (self.requests, self.tokens):
+                if bucket is not None:
+                    bucket._refill()
+            return {
+                "rpm_limit": self.requests.capacity if self.requests else None,
+                "tpm_limit": self.tokens.capacity if self.tokens else None,
+                "requests_available": round(self.requests.level, 2) if self.requests else None,
+                "tokens_available": round(self.tokens.level) if self.tokens else None,
+                "calls": self.calls,
+                "delayed_calls": self.delayed_calls,
+                "rejected_calls": self.rejected_calls,
+                "released_calls": self.released_calls,
+                "avg_wait_s": round(self.total_wait / self.calls, 3) if self.calls else 0.0,
+                "estimated_tokens": self.estimated_tokens,
+                "actual_tokens": self.actual_tokens,
+            }
+
+
+# --- Per-model Schedulers ---
+# Groq's limits apply per model, so each model gets its own scheduler.
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_llm_scheduler(model: str) -> LLMScheduler:
+    """Returns the process-wide scheduler for a model."""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(model)
+        if scheduler is None:
+            scheduler = _schedulers[model] = LLMScheduler()
+        return scheduler
+
+def rate_limit_stats() -> dict:
+    """Returns scheduler stats per model."""
+    with _schedulers_lock:
+        schedulers = dict(_schedulers)
+    return {model: scheduler.stats() for model, scheduler in schedulers.items()}
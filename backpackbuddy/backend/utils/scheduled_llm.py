@@ -0,0 +1,153 @@
+"""
+This module contains a chat model wrapper that sends every call through an
+LLMScheduler. It is a LangChain Runnable, so agents keep composing it with
+prompts (``prompt | llm``) and calling ``invoke``, ``ainvoke`` or ``astream``.
+Each call is also recorded in the LLM metrics (time spent waiting for
+budget, duration once sent, time to first chunk, reported prompt and
+completion tokens).
+"""
+import asyncio
+import contextvars
+import time
+
+from langchain_core.runnables import Runnable
+
+from backend.utils.metrics import (
+    LLM_CALL_SECONDS, LLM_FIRST_TOKEN_SECONDS, LLM_SCHEDULE_WAIT_SECONDS, LLM_TOKENS, trace_event
+)
+from backend.utils.rate_limit import LLM_EXPECTED_OUTPUT_TOKENS, LLMScheduler, expected_output_tokens
+from backend.utils.tokens import count_tokens
+
+
+# A callback the LLM router sets to learn when a call leaves the scheduler
+# and is actually sent, so time spent waiting for budget is not mistaken for
+# a slow model.
+call_sent = contextvars.ContextVar("scheduled_llm_call_sent", default=None)
+
+def _usage(message) -> dict:
+    return getattr(message, "usage_metadata", None) or {}
+
+def _mark_sent():
+    callback = call_sent.get()
+    if callback is not None:
+        callback()
+
+
+class ScheduledLLM(Runnable):
+    """
+    Wraps a chat model so each call first reserves its estimated cost (the
+    prompt's tokens plus ``expected_output_tokens``) with the scheduler.
+    """
+
+    def __init__(self, llm, scheduler: LLMScheduler, expected_output_tokens: int = LLM_EXPECTED_OUTPUT_TOKENS,
+                 name: str = "llm"):
+        self.llm = llm
+        self.scheduler = scheduler
+        self.expected_output_tokens = expected_output_tokens
+        self.name = name
+
+    def __getattr__(self, name):
+        # Model attributes (model_name, etc.) come from the wrapped client.
+        return getattr(self.llm, name)
+
+    def estimate_tokens(self, input, config=None) -> int:
+        """Estimates the total tokens a call with this input (and run config) will use."""
+        text = input.to_string() if hasattr(input, "to_string") else str(input)
+        return count_tokens(text) + expected_output_tokens(config, self.expected_output_tokens)
+
+    async def _aacquire(self, tokens: int):
+        """Waits for the scheduler; a call cancelled while waiting gives its reservation back."""
+        wait = self.scheduler.reserve(tokens)
+        try:
+            if wait > 0:
+                await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            self.scheduler.release(tokens)
+            raise
+        _mark_sent()
+
+    def _release_unused(self, tokens: int, config):
+        # The call was cancelled or failed after it was sent. The prompt
+        # counts against the limit; only the output reservation is returned.
+        self.scheduler.release(min(tokens, expected_output_tokens(config, self.expected_output_tokens)), request=False)
+
+    def _finish(self, tokens: int, usage: dict, queued: float, started: float, first_chunk: float = None):
+        """
+        Settles the reservation and records the call's metrics. ``queued`` is
+        when the call asked the scheduler for budget, ``started`` when it was sent.
+        """
+        seconds = time.perf_counter() - started
+        self.scheduler.settle(tokens, usage.get("total_tokens"))
+        LLM_SCHEDULE_WAIT_SECONDS.observe(started - queued, model=self.name)
+        LLM_CALL_SECONDS.observe(seconds, model=self.name)
+        if first_chunk is not None:
+            LLM_FIRST_TOKEN_SECONDS.observe(first_chunk - started, model=self.name)
+        for kind, key in (("prompt", "input_tokens"), ("completion", "output_tokens")):
+            if usage.get(key):
+                LLM_TOKENS.inc(usage[key], model=self.name, kind=kind)
+        trace_event("llm_call", seconds, model=self.name, wait_ms=round((started - queued) * 1000, 2),
+                    prompt_tokens=usage.get("input_tokens"),
+                    completion_tokens=usage.get("output_tokens"),
+                    first_chunk_ms=round((first_chunk - started) * 1000, 2) if first_chunk else None)
+
+    def invoke(self, input, config=None, **kwargs):
+        queued = time.perf_counter()
+        tokens = self.estimate_tokens(input, config)
+        self.scheduler.acquire(tokens)
+        started = time.perf_counter()
+        try:
+            response = self.llm.invoke(input, config, **kwargs)
+        except BaseException:
+            self._release_unused(tokens, config)
+            raise
+        self._finish(tokens, _usage(response), queued, started)
+        return response
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        queued = time.perf_counter()
+        tokens = self.estimate_tokens(input, config)
+        await self._aacquire(tokens)
+        started = time.perf_counter()
+        try:
+            response = await self.llm.ainvoke(input, config, **kwargs)
+        except BaseException:
+            # Cancelled (e.g. a losing hedge) or failed: no output is coming.
+            self._release_unused(tokens, config)
+            raise
+        self._finish(tokens, _usage(response), queued, started)
+        return response
+
+    def stream(self, input, config=None, **kwargs):
+        queued = time.perf_counter()
+        tokens = self.estimate_tokens(input, config)
+        self.scheduler.acquire(tokens)
+        started = time.perf_counter()
+        usage, first_chunk = {}, None
+        try:
+            for chunk in self.llm.stream(input, config, **kwargs):
+                first_chunk = first_chunk or time.perf_counter()
+                usage = _usage(chunk) or usage
+                yield chunk
+        except BaseException:
+            if first_chunk is None:
+                self._release_unused(tokens, config)
+            raise
+        self._finish(tokens, usage, queued, started, first_chunk)
+
+    async def astream(self, input, config=None, **kwargs):
+        queued = time.perf_counter()
+        tokens = self.estimate_tokens(input, config)
+        await self._aacquire(tokens)
+        started = time.perf_counter()
+        usage, first_chunk = {}, None
+        try:
+            async for chunk in self.llm.astream(input, config, **kwargs):
+                first_chunk = first_chunk or time.perf_counter()
+                usage = _usage(chunk) or usage
+                yield chunk
+        except BaseException:
+            # Once output has arrived the reservation is kept; it was used.
+            if first_chunk is None:
+                self._release_unused(tokens, config)
+            raise
+        self._finish(tokens, usage, queued, started, first_chunk)
@@ -0,0 +1,68 @@
+"""
+This module contains request coalescing ("single-flight") for expensive
+async work. Concurrent callers asking for the same key share one
+in-flight computation instead of each starting their own.
+"""
+import asyncio
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls by key.
+
+    The first caller for a key starts the work; callers arriving while it
+    is still running await the same task. The key is released as soon as
+    the task finishes, so a failure is delivered to every waiter of that
+    flight but the next call starts a fresh attempt.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.started = 0
+        self.shared = 0
+
+    async def do(self, key: str, fn):
+        """
+        Runs ``fn()`` once per key among concurrent callers.
+
+        Args:
+            key (str): Identifies equivalent requests.
+            fn: A zero-argument callable returning an awaitable.
+
+        Returns:
+            The result of the shared computation.
+
+        Raises:
+            Exception: Whatever the shared computation raised.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._release(key, t))
+            self.started += 1
+        else:
+            self.shared += 1
+
+        # Shield the shared task so one client disconnecting does not cancel
+        # the work for everybody else waiting on it.
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        """Returns the number of started and coalesced calls."""
+        return {
+            "inflight": len(self._inflight),
+            "started": self.started,
+            "shared": self.shared,
+        }
+
+    def _release(self, key: str, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved in case every waiter went away.
+        if not task.cancelled():
+            task.exception()
+
+
+# Shared coalescer for the API; keys are namespaced per endpoint.
+inflight_requests = SingleFlight()
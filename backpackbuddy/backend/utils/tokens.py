@@ -0,0 +1,91 @@
+"""
+This module contains prompt token accounting: a local token counter, a helper
+to keep prompts under a hard token budget, and per-prompt usage counters.
+"""
+import math
+import os
+import re
+import threading
+
+from backend.utils.metrics import PROMPT_TOKENS
+
+# Optional tiktoken encoding name (e.g. "cl100k_base"). tiktoken downloads its
+# tables on first use, so by default a local estimate is used instead.
+TOKEN_ENCODING = os.environ.get("TOKEN_ENCODING", "")
+
+_WORD = re.compile(r"\w+|[^\w\s]")
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        if TOKEN_ENCODING:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+            except Exception as e:
+                print(f"Could not load token encoding {TOKEN_ENCODING}, using estimates: {e}")
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the tokens in a piece of text.
+
+    Without TOKEN_ENCODING this is an estimate tuned for BPE tokenizers like
+    Llama's: one token per punctuation mark and per ~4 characters of a word.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return sum(math.ceil(len(piece) / 4) for piece in _WORD.findall(text))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cuts text at a line (or, failing that, word) boundary to fit ``max_tokens``."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    for separator in ("\n", " "):
+        pieces = text.split(separator)
+        kept, used = [], 0
+        for piece in pieces:
+            cost = count_tokens(piece + separator)
+            if used + cost > max_tokens:
+                break
+            kept.append(piece)
+            used += cost
+        if kept:
+            return separator.join(kept)
+    return ""
+
+
+class TokenMeter:
+    """Counts prompt tokens sent per prompt type."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prompts = {}
+
+    def record(self, name: str, prompt_tokens: int, truncated: bool = False):
+        PROMPT_TOKENS.inc(prompt_tokens, prompt=name)
+        with self._lock:
+            entry = self._prompts.setdefault(name, {"requests": 0, "prompt_tokens": 0, "max_prompt_tokens": 0,
+                                                    "truncated": 0})
+            entry["requests"] += 1
+            entry["prompt_tokens"] += prompt_tokens
+            entry["max_prompt_tokens"] = max(entry["max_prompt_tokens"], prompt_tokens)
+            entry["truncated"] += int(truncated)
+
+    def stats(self) -> dict:
+        """Returns totals and the average prompt size per prompt type."""
+        with self._lock:
+            return {
+                name: {**entry, "avg_prompt_tokens": round(entry["prompt_tokens"] / entry["requests"], 1)}
+                for name, entry in self._prompts.items()
+            }
+
+
+token_meter = TokenMeter()
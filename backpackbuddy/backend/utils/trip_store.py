@@ -0,0 +1,167 @@
+"""
+This module contains the server-side trip store. Generated itineraries are
+saved under a trip ID so follow-up requests (packing list, PDF, replanning)
+can reference the trip instead of re-uploading the whole itinerary.
+"""
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from backend.utils.cache import content_hash
+
+TRIP_STORE_BACKEND = os.environ.get("TRIP_STORE_BACKEND", "memory")
+TRIP_STORE_SQLITE_PATH = os.environ.get("TRIP_STORE_SQLITE_PATH", "trips.db")
+TRIP_STORE_MAX_TRIPS = int(os.environ.get("TRIP_STORE_MAX_TRIPS", "10000"))
+
+
+class TripNotFoundError(KeyError):
+    """Raised when a trip ID (or version) is not in the store."""
+
+
+def _new_record(trip_id: str, version: int, itinerary: dict) -> dict:
+    return {
+        "trip_id": trip_id,
+        "version": version,
+        "itinerary": itinerary,
+        "content_hash": content_hash(itinerary),
+        "created_at": time.time(),
+    }
+
+
+class TripStore:
+    """
+    Interface for trip stores. Each save of an existing trip creates a new
+    version; ``get`` returns the latest version unless one is requested.
+
+    Records are dicts with ``trip_id``, ``version``, ``itinerary``,
+    ``content_hash`` and ``created_at``.
+    """
+
+    def save(self, itinerary: dict, trip_id: str = None) -> dict:
+        """
+        Stores an itinerary as a new trip, or as the next version of an
+        existing trip when ``trip_id`` is given.
+
+        Returns:
+            dict: The stored record.
+        """
+        raise NotImplementedError
+
+    def get(self, trip_id: str, version: int = None) -> dict:
+        """
+        Loads a trip.
+
+        Raises:
+            TripNotFoundError: If the trip or version does not exist.
+        """
+        raise NotImplementedError
+
+
+class InMemoryTripStore(TripStore):
+    """Keeps trips in process memory, dropping the least recently used ones."""
+
+    def __init__(self, max_trips: int = TRIP_STORE_MAX_TRIPS):
+        self.max_trips = max_trips
+        self._trips = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, itinerary: dict, trip_id: str = None) -> dict:
+        with self._lock:
+            if trip_id is None:
+                trip_id = uuid.uuid4().hex
+                versions = []
+            elif trip_id in self._trips:
+                versions = self._trips[trip_id]
+            else:
+                raise TripNotFoundError(trip_id)
+
+            record = _new_record(trip_id, len(versions) + 1, copy.deepcopy(itinerary))
+            versions.append(record)
+            self._trips[trip_id] = versions
+            self._trips.move_to_end(trip_id)
+            while len(self._trips) > self.max_trips:
+                self._trips.popitem(last=False)
+            return copy.deepcopy(record)
+
+    def get(self, trip_id: str, version: int = None) -> dict:
+        with self._lock:
+            versions = self._trips.get(trip_id)
+            if not versions:
+                raise TripNotFoundError(trip_id)
+            self._trips.move_to_end(trip_id)
+            if version is None:
+                version = len(versions)
+            if not 1 <= version <= len(versions):
+                raise TripNotFoundError(f"{trip_id} v{version}")
+            return copy.deepcopy(versions[version - 1])
+
+
+class SQLiteTripStore(TripStore):
+    """Persists trips in a SQLite database so they survive restarts."""
+
+    def __init__(self, path: str = TRIP_STORE_SQLITE_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS trips ("
+            "trip_id TEXT NOT NULL, version INTEGER NOT NULL, itinerary TEXT NOT NULL, "
+            "content_hash TEXT NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (trip_id, version))"
+        )
+        self._conn.commit()
+
+    def save(self, itinerary: dict, trip_id: str = None) -> dict:
+        with self._lock:
+            if trip_id is None:
+                trip_id = uuid.uuid4().hex
+                version = 1
+            else:
+                row = self._conn.execute("SELECT MAX(version) FROM trips WHERE trip_id = ?", (trip_id,)).fetchone()
+                if row[0] is None:
+                    raise TripNotFoundError(trip_id)
+                version = row[0] + 1
+
+            record = _new_record(trip_id, version, itinerary)
+            self._conn.execute(
+                "INSERT INTO trips (trip_id, version, itinerary, content_hash, created_at) VALUES (?, ?, ?, ?, ?)",
+                (trip_id, version, json.dumps(itinerary), record["content_hash"], record["created_at"]),
+            )
+            self._conn.commit()
+            return record
+
+    def get(self, trip_id: str, version: int = None) -> dict:
+        with self._lock:
+            if version is None:
+                row = self._conn.execute(
+                    "SELECT version, itinerary, content_hash, created_at FROM trips "
+                    "WHERE trip_id = ? ORDER BY version DESC LIMIT 1", (trip_id,)
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    "SELECT version, itinerary, content_hash, created_at FROM trips "
+                    "WHERE trip_id = ? AND version = ?", (trip_id, version)
+                ).fetchone()
+        if row is None:
+            raise TripNotFoundError(trip_id if version is None else f"{trip_id} v{version}")
+        return {
+            "trip_id": trip_id,
+            "version": row[0],
+            "itinerary": json.loads(row[1]),
+            "content_hash": row[2],
+            "created_at": row[3],
+        }
+
+
+def create_trip_store() -> TripStore:
+    """Creates the trip store selected by TRIP_STORE_BACKEND ("memory" or "sqlite")."""
+    if TRIP_STORE_BACKEND == "sqlite":
+        return SQLiteTripStore(TRIP_STORE_SQLITE_PATH)
+    return InMemoryTripStore()
+
+
+trip_store = create_trip_store()
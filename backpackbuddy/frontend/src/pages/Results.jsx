@@ -21,11 +21,25 @@ const Results = ({ itinerary, onReset }) => {
       .filter(location => location && typeof location.lat === 'number' && typeof location.lon === 'number')
   );
 
+  // Follow-up requests reference the stored trip instead of re-uploading it.
+  // The in-memory trip store is lost on restart and not shared between
+  // workers, so a 404 falls back to sending the whole itinerary.
+  const postTrip = async (url, config) => {
+    if (!itinerary?.trip_id) {
+      return axios.post(url, { itinerary }, config);
+    }
+    try {
+      return await axios.post(url, { trip_id: itinerary.trip_id, trip_version: itinerary.trip_version }, config);
+    } catch (error) {
+      if (error.response?.status !== 404) throw error;
+      return axios.post(url, { itinerary }, config);
+    }
+  };
+
   const handleDownloadPdf = async () => {
     setIsDownloading(true);
     try {
-      const response = await axios.post('http://localhost:8000/download-itinerary-pdf',
-        { itinerary: itinerary },
+      const response = await postTrip('http://localhost:8000/download-itinerary-pdf',
         { responseType: 'blob' }
       );
 
@@ -48,7 +62,7 @@ const Results = ({ itinerary, onReset }) => {
   const handleGeneratePackingList = async () => {
     setIsPackingListLoading(true);
     try {
-      const response = await axios.post('http://localhost:8000/generate-packing-list', { itinerary });
+      const response = await postTrip('http://localhost:8000/generate-packing-list');
       setPackingList(response.data);
       setIsModalOpen(true); // Open the modal with the new list
     } catch (error) {